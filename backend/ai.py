@@ -1,14 +1,12 @@
 # backend/ai.py
 
-import openai
 import os
 import json
-from fastapi import HTTPException
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from models import TasteSummary, TasteSnapshot
-
-openai.api_key = os.getenv("OPENAI_API_KEY")
+from llm import llm_client
+from cache import bump_user_version
 
 
 async def generate_snapshot_comment(
@@ -58,20 +56,238 @@ async def generate_snapshot_comment(
     )
 
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-        )
-        return response.choices[0].message.content.strip()
+        return await llm_client.chat(prompt, temperature=0.7, site="snapshot_comment")
     except Exception as e:
         print("Error generating snapshot comment:", e)
         return "You watched a movie, but we couldn't interpret your reaction clearly."
 
 
-import json
+# ---------- Taste summary ----------
+# "incremental": fold only new snapshots into the stored summary (bounded prompt)
+# "full": re-prompt over every snapshot on each update (legacy behaviour)
+TASTE_SUMMARY_MODE = os.getenv("TASTE_SUMMARY_MODE", "incremental")
+TASTE_TOKEN_BUDGET = int(os.getenv("TASTE_TOKEN_BUDGET", "2000"))  # max input tokens per summary prompt
+CHECKPOINT_TOKEN_BUDGET = TASTE_TOKEN_BUDGET // 4
+INSIGHT_TOKEN_BUDGET = TASTE_TOKEN_BUDGET // 4
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting English prompts
+    return len(text or "") // 4 + 1
+
+
+def take_within_budget(items: list[str], budget: int) -> list[str]:
+    """Longest prefix of items whose estimated size fits the budget."""
+    taken, used = [], 0
+    for item in items:
+        cost = estimate_tokens(item)
+        if used + cost > budget:
+            break
+        taken.append(item)
+        used += cost
+    return taken
+
+
+async def _get_or_create_summary(session: AsyncSession, user_id: int) -> TasteSummary:
+    result = await session.execute(
+        select(TasteSummary).where(TasteSummary.user_id == user_id)
+    )
+    record = result.scalar_one_or_none()
+    if record is None:
+        record = TasteSummary(user_id=user_id, summary="", highlight_titles=json.dumps([]))
+        session.add(record)
+    return record
+
+
+SUMMARY_UNAVAILABLE = "Your profile could not be updated at the moment."
+
+def _reset_summary(record: TasteSummary):
+    record.summary = ""
+    record.highlight_titles = json.dumps([])
+    record.last_snapshot_id = None
+    record.checkpoints = json.dumps([])
+
+
+async def regenerate_taste_summary(
+    session: AsyncSession,
+    user_id: int,
+    deleted_snapshot_ids: list[int] | None = None,
+):
+    """Bring the user's TasteSummary up to date with their snapshots.
+
+    In incremental mode only snapshots newer than `last_snapshot_id` are sent
+    to the model, together with the current summary and the condensed
+    checkpoints, so each prompt stays within TASTE_TOKEN_BUDGET. Pass the ids
+    of snapshots that were just deleted: if any of them had already been
+    folded in, the summary is rebuilt from scratch (still in bounded batches).
+    Returns the summary to show; if the model call fails it is left as it was
+    and a placeholder is returned (never stored) when there is none yet.
+    """
+    if TASTE_SUMMARY_MODE == "full":
+        return await _regenerate_full_summary(session, user_id)
+
+    record = await _get_or_create_summary(session, user_id)
+
+    folded_through = record.last_snapshot_id
+    if folded_through is not None and deleted_snapshot_ids:
+        if min(deleted_snapshot_ids) <= folded_through:
+            print(f"🔁 Deleted snapshot was already folded in, rebuilding summary for user {user_id}")
+            _reset_summary(record)
 
-async def regenerate_taste_summary(session: AsyncSession, user_id: int):
+    result = await session.execute(
+        select(TasteSnapshot)
+        .where(
+            TasteSnapshot.user_id == user_id,
+            TasteSnapshot.id > (record.last_snapshot_id or 0),
+        )
+        .order_by(TasteSnapshot.id.asc())
+    )
+    new_snapshots = result.scalars().all()
+
+    if not new_snapshots:
+        if record.last_snapshot_id is None:
+            # 无 snapshot，清空 summary
+            _reset_summary(record)
+        await session.commit()
+        bump_user_version(user_id, "summary")
+        return ""
+
+    remaining = list(new_snapshots)
+    while remaining:
+        # 每批重新取：前几批刚折叠进去的 correction 也要钉在后面的 prompt 里
+        pinned_insights = await _pinned_insights(session, user_id, record.last_snapshot_id)
+        checkpoints = json.loads(record.checkpoints or "[]")
+        base_cost = (
+            estimate_tokens(record.summary)
+            + sum(estimate_tokens(c["text"]) for c in checkpoints)
+            + sum(estimate_tokens(i) for i in pinned_insights)
+        )
+        lines = [
+            f'"{snap.gpt_comment}"' if snap.action_type == "correction" else snap.gpt_comment
+            for snap in remaining
+        ]
+        batch_size = len(take_within_budget(lines, max(TASTE_TOKEN_BUDGET - base_cost, 0))) or 1
+        batch, remaining = remaining[:batch_size], remaining[batch_size:]
+
+        folded = await _fold_snapshots(record, checkpoints, pinned_insights, batch)
+        if not folded:
+            # 保留旧的 summary 和 checkpoint，下次再试。占位文字只用于返回值，
+            # 不能存进去，否则之后每次 fold 都会把它当成 "current summary"
+            break
+
+    await session.commit()
+    bump_user_version(user_id, "summary")
+    return record.summary or SUMMARY_UNAVAILABLE
+
+
+async def _pinned_insights(session: AsyncSession, user_id: int, folded_through: int | None) -> list[str]:
+    # Corrections are the user's own words, so the most recent ones stay in
+    # every prompt even after they have been folded into a checkpoint.
+    result = await session.execute(
+        select(TasteSnapshot.gpt_comment)
+        .where(
+            TasteSnapshot.user_id == user_id,
+            TasteSnapshot.action_type == "correction",
+            TasteSnapshot.id <= (folded_through or 0),
+        )
+        .order_by(TasteSnapshot.id.desc())
+    )
+    return take_within_budget(
+        [f'"{c}"' for c in result.scalars().all() if c], INSIGHT_TOKEN_BUDGET
+    )
+
+
+async def _fold_snapshots(record, checkpoints, pinned_insights, batch) -> bool:
+    user_insights = list(pinned_insights)
+    behavior_observations = []
+    for snap in batch:
+        if snap.action_type == "correction":
+            user_insights.append(f'"{snap.gpt_comment}"')
+        elif snap.gpt_comment:
+            behavior_observations.append(snap.gpt_comment)
+
+    max_chars = TASTE_TOKEN_BUDGET * 4
+    if len(batch) == 1:
+        # a single oversized snapshot still has to fit
+        behavior_observations = [obs[:max_chars] for obs in behavior_observations]
+
+    profile_section = ""
+    if record.summary:
+        profile_section = f"Your current summary of the user's taste:\n{record.summary}\n\n"
+
+    checkpoint_section = ""
+    if checkpoints:
+        checkpoint_section = "Condensed notes from earlier observations:\n"
+        for c in checkpoints:
+            checkpoint_section += f"- {c['text']}\n"
+        checkpoint_section += "\n"
+
+    user_insights_section = ""
+    if user_insights:
+        user_insights_section += "The user has directly shared the following personal insights:\n"
+        for insight in user_insights:
+            user_insights_section += f"- {insight}\n"
+        user_insights_section += "\n"
+
+    behavior_observations_section = ""
+    if behavior_observations:
+        behavior_observations_section += "New observations based on the user's latest reviews, moods, and preferences:\n"
+        for obs in behavior_observations:
+            behavior_observations_section += f"- {obs}\n"
+        behavior_observations_section += "\n"
+
+    prompt = (
+        "You are an AI assistant helping a user understand their personal movie preferences.\n"
+        "You keep a running profile of their taste and update it as new observations arrive.\n\n"
+        f"{profile_section}"
+        f"{checkpoint_section}"
+        f"{user_insights_section}"
+        f"{behavior_observations_section}"
+        "Now, do two things:\n"
+        "1. Write an updated, thoughtful and cohesive summary (3–5 sentences) in a warm and perceptive tone that reflects\n"
+        "   both the existing profile and the new information. Use 'you' to address the user.\n"
+        "   Do NOT quote earlier text directly. Focus on patterns and preferences, not individual reviews.\n"
+        "2. Return a JSON object with three keys:\n"
+        "   - 'summary': your summary text\n"
+        "   - 'highlight_titles': an array of movie titles mentioned explicitly in the summary.\n"
+        "   - 'checkpoint': one or two sentences condensing only the new observations and insights above.\n"
+        "Format your entire output as a valid JSON object. Do not include any other commentary or formatting."
+    )
+
+    try:
+        raw = await llm_client.chat(prompt, temperature=0.7, site="summary_fold")
+    except Exception as e:
+        print("❌ Error during summary generation:", e)
+        return False
+
+    try:
+        parsed = json.loads(raw)
+        summary_text = parsed.get("summary", "").strip()
+        highlight_titles = parsed.get("highlight_titles", [])
+        checkpoint_text = (parsed.get("checkpoint") or "").strip()
+    except Exception as parse_err:
+        print("⚠️ Failed to parse JSON from GPT:", parse_err)
+        summary_text = raw
+        highlight_titles = []
+        checkpoint_text = ""
+
+    if not checkpoint_text:
+        checkpoint_text = " ".join(behavior_observations)[:400]
+
+    through_id = batch[-1].id
+    checkpoints.append({"through_id": through_id, "text": checkpoint_text})
+    # 旧的 checkpoint 超出预算就丢掉（它们已经体现在 summary 里）
+    while len(checkpoints) > 1 and sum(estimate_tokens(c["text"]) for c in checkpoints) > CHECKPOINT_TOKEN_BUDGET:
+        checkpoints.pop(0)
+
+    record.summary = summary_text
+    record.highlight_titles = json.dumps(highlight_titles)
+    record.checkpoints = json.dumps(checkpoints)
+    record.last_snapshot_id = through_id
+    return True
+
+
+async def _regenerate_full_summary(session: AsyncSession, user_id: int):
     result = await session.execute(
         select(TasteSnapshot)
         .where(TasteSnapshot.user_id == user_id)
@@ -86,8 +302,7 @@ async def regenerate_taste_summary(session: AsyncSession, user_id: int):
         )
         record = result.scalar_one_or_none()
         if record:
-            record.summary = ""
-            record.highlight_titles = json.dumps([])
+            _reset_summary(record)
         else:
             session.add(TasteSummary(
                 user_id=user_id,
@@ -95,7 +310,8 @@ async def regenerate_taste_summary(session: AsyncSession, user_id: int):
                 highlight_titles=json.dumps([])
             ))
         await session.commit()
-        return
+        bump_user_version(user_id, "summary")
+        return ""
 
     user_insights = []
     behavior_observations = []
@@ -135,12 +351,7 @@ async def regenerate_taste_summary(session: AsyncSession, user_id: int):
     )
 
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-        )
-        raw = response.choices[0].message.content.strip()
+        raw = await llm_client.chat(prompt, temperature=0.7, site="summary_full")
 
         try:
             parsed = json.loads(raw)
@@ -153,8 +364,10 @@ async def regenerate_taste_summary(session: AsyncSession, user_id: int):
 
     except Exception as e:
         print("❌ Error during summary generation:", e)
-        summary_text = "Your profile could not be updated at the moment."
-        highlight_titles = []
+        # 旧 summary 原样保留（也不把 snapshot 标记为已折叠），占位文字只返回不存
+        record = await _get_or_create_summary(session, user_id)
+        await session.commit()
+        return record.summary or SUMMARY_UNAVAILABLE
 
     # ✅ 更新数据库
     result = await session.execute(
@@ -165,11 +378,17 @@ async def regenerate_taste_summary(session: AsyncSession, user_id: int):
         record.summary = summary_text
         record.highlight_titles = json.dumps(highlight_titles)
     else:
-        session.add(TasteSummary(
+        record = TasteSummary(
             user_id=user_id,
             summary=summary_text,
             highlight_titles=json.dumps(highlight_titles)
-        ))
+        )
+        session.add(record)
+    # full rebuild 之后可以直接切回 incremental
+    record.last_snapshot_id = max(snap.id for snap in snapshots)
+    record.checkpoints = json.dumps([])
 
     await session.commit()
+    bump_user_version(user_id, "summary")
+    return summary_text
 
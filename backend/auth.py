@@ -5,9 +5,13 @@ from sqlalchemy.future import select
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from database import get_db
+from concurrent.futures import ThreadPoolExecutor
+from database import get_db, async_session
 from models import User
+from cache import TTLCache
 import os
+import time
+import asyncio
 from pydantic import BaseModel
 class UserCreate(BaseModel):
     username: str
@@ -21,11 +25,21 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt 每次要 100ms 以上，放到线程池里跑，不阻塞事件循环
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "4"))
+hash_executor = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# verified token -> User, so authenticated requests skip the users query
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+user_cache = TTLCache("auth_users", maxsize=4096, ttl=AUTH_USER_CACHE_TTL)
+
+async def verify_password(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hash_executor, pwd_context.verify, plain_password, hashed_password)
+
+async def get_password_hash(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hash_executor, pwd_context.hash, password)
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -43,7 +57,7 @@ async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     if result.scalar():
         raise HTTPException(status_code=400, detail="Username already exists.")
 
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash(password)
     new_user = User(username=username, hashed_password=hashed_password)
     db.add(new_user)
     await db.commit()
@@ -57,10 +71,10 @@ async def login_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
 
     result = await db.execute(select(User).where(User.username == username))
     db_user = result.scalar()
-    if not db_user or not verify_password(password, db_user.hashed_password):
+    if not db_user or not await verify_password(password, db_user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    token = create_access_token(data={"sub": db_user.username})
+    token = create_access_token(data={"sub": db_user.username, "uid": db_user.id})
     return {"access_token": token, "token_type": "bearer"}
 
 # ========== Current User Helper ==========
@@ -68,7 +82,8 @@ from fastapi.security import OAuth2PasswordBearer
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    # 签名和过期时间每次都校验，只有查用户这一步走缓存
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -77,8 +92,23 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     except JWTError:
         raise HTTPException(status_code=401, detail="Token decode error")
 
-    result = await db.execute(select(User).where(User.username == username))
-    user = result.scalar()
-    if user is None:
+    user = user_cache.get(token)
+    if user is not None:
+        return user
+
+    async with async_session() as db:
+        uid = payload.get("uid")
+        if uid is not None:
+            user = await db.get(User, uid)
+        else:
+            # tokens issued before the uid claim was added
+            result = await db.execute(select(User).where(User.username == username))
+            user = result.scalar()
+    if user is None or user.username != username:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
\ No newline at end of file
+
+    # never keep a token around longer than it is valid
+    ttl = min(AUTH_USER_CACHE_TTL, payload.get("exp", 0) - time.time())
+    if ttl > 0:
+        user_cache.set(token, user, ttl=ttl)
+    return user
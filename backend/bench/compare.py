@@ -0,0 +1,42 @@
+# backend/bench/compare.py
+"""Compare two bench/run.py result files, scenario by scenario.
+
+    python -m bench.compare bench/results/before.json bench/results/after.json
+"""
+import json
+import argparse
+from pathlib import Path
+
+METRICS = [
+    ("p50 ms", lambda r: r["latency_ms"]["p50"]),
+    ("p95 ms", lambda r: r["latency_ms"]["p95"]),
+    ("p99 ms", lambda r: r["latency_ms"]["p99"]),
+    ("req/s", lambda r: r["throughput_rps"]),
+    ("tmdb/req", lambda r: r["upstream_per_request"].get("tmdb", 0.0)),
+    ("openai/req", lambda r: r["upstream_per_request"].get("openai", 0.0)),
+]
+
+
+def _change(old: float, new: float) -> str:
+    if not old:
+        return "" if not new else "new"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(before: dict, after: dict):
+    for name in after["scenarios"]:
+        if name not in before["scenarios"]:
+            continue
+        old, new = before["scenarios"][name], after["scenarios"][name]
+        print(f"\n{name}")
+        for label, get in METRICS:
+            a, b = get(old), get(new)
+            print(f"  {label:<11}{a:>10}  →{b:>10}  {_change(a, b)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    args = parser.parse_args()
+    compare(json.loads(args.before.read_text()), json.loads(args.after.read_text()))
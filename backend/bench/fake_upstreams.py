@@ -0,0 +1,193 @@
+# backend/bench/fake_upstreams.py
+"""Stand-in TMDB and OpenAI servers for benchmarks.
+
+Responses are deterministic (derived from the request), so runs are
+comparable; latency and failure rates are configurable. Every request is
+counted per route so a run can report upstream traffic per endpoint.
+
+    python -m bench.fake_upstreams --port 8765 --latency-ms 80
+"""
+import json
+import zlib
+import random
+import asyncio
+import argparse
+from collections import Counter
+from aiohttp import web
+
+GENRES = [
+    (28, "Action"), (35, "Comedy"), (18, "Drama"), (878, "Science Fiction"),
+    (53, "Thriller"), (10749, "Romance"), (16, "Animation"), (80, "Crime"),
+]
+CATALOG_SIZE = 5000
+
+
+def movie_title(tmdb_id: int) -> str:
+    return f"Bench Movie {tmdb_id}"
+
+def fake_movie(tmdb_id: int) -> dict:
+    gid, gname = GENRES[tmdb_id % len(GENRES)]
+    return {
+        "id": tmdb_id,
+        "title": movie_title(tmdb_id),
+        "overview": f"Synthetic overview for movie {tmdb_id}.",
+        "release_date": f"{1950 + tmdb_id % 75}-01-01",
+        "poster_path": f"/poster{tmdb_id}.jpg",
+        "backdrop_path": f"/backdrop{tmdb_id}.jpg",
+        "vote_average": round(5 + (tmdb_id % 50) / 10, 1),
+        "vote_count": 50 + tmdb_id % 5000,
+        "popularity": float(tmdb_id % 997),
+        "genre_ids": [gid],
+        "genres": [{"id": gid, "name": gname}],
+    }
+
+def _ids_for(text: str, n: int) -> list[int]:
+    seed = zlib.crc32(text.lower().encode("utf-8"))
+    return [1 + (seed + k * 7919) % CATALOG_SIZE for k in range(n)]
+
+
+class FakeUpstreams:
+    def __init__(self, latency_ms: float = 50, jitter_ms: float = 20,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self._attempts = Counter()
+        self._runner = None
+
+    # ---------- Helpers ----------
+    def snapshot(self) -> dict:
+        return dict(self.counts)
+
+    @staticmethod
+    def route(path: str) -> str:
+        """Collapse ids so counts are per route: 'tmdb /movie/{id}/credits'."""
+        if path.startswith("/v1/"):
+            return "openai " + path[3:]
+        parts = [("{id}" if p.isdigit() or p.startswith("tt") else p) for p in path[2:].split("/")]
+        return "tmdb " + "/".join(parts)
+
+    async def _delay(self):
+        await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+
+    def _failure(self):
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return web.json_response({"status_message": "rate limited"}, status=429, headers={"Retry-After": "1"})
+        if roll < self.rate_limit_rate + self.error_rate:
+            return web.json_response({"status_message": "boom"}, status=500)
+        return None
+
+    def _scripted_failure(self, request: web.Request):
+        # 按搜索词注入的确定性故障，给 bench.regress 的重试用例：
+        # "flaky ..." 先 503 再 429，第三次才成功；"outage ..." 一直 429
+        query = request.query.get("query", "").lower()
+        if query.startswith("outage"):
+            return web.json_response({"status_message": "rate limited"}, status=429, headers={"Retry-After": "30"})
+        if query.startswith("flaky"):
+            key = (request.path, query)
+            self._attempts[key] += 1
+            if self._attempts[key] == 1:
+                return web.json_response({"status_message": "unavailable"}, status=503)
+            if self._attempts[key] == 2:
+                return web.json_response({"status_message": "rate limited"}, status=429, headers={"Retry-After": "0"})
+        return None
+
+    # ---------- Handlers ----------
+    async def handle(self, request: web.Request):
+        path = request.path
+        route = self.route(path)
+        self.counts[route] += 1
+        self.counts[route.split(" ")[0]] += 1
+        await self._delay()
+        failure = self._failure() or self._scripted_failure(request)
+        if failure is not None:
+            return failure
+
+        if path == "/3/search/movie":
+            ids = _ids_for(request.query.get("query", ""), 5)
+            return web.json_response({"results": [fake_movie(i) for i in ids]})
+        if path == "/3/discover/movie":
+            page = int(request.query.get("page", "1"))
+            ids = _ids_for(request.query.get("with_genres", "") + str(page), 20)
+            return web.json_response({"results": [fake_movie(i) for i in ids]})
+        if path.startswith("/3/find/"):
+            imdb_id = path.split("/")[3]
+            found = imdb_id[2:].isdigit() and int(imdb_id[2:]) % 10 != 0  # every tenth id is unknown
+            return web.json_response({"movie_results": [fake_movie(1 + int(imdb_id[2:]) % CATALOG_SIZE)] if found else []})
+        if path.startswith("/3/movie/") and path.endswith("/credits"):
+            tmdb_id = int(path.split("/")[3])
+            return web.json_response({"crew": [{"job": "Director", "name": f"Director {tmdb_id % 300}"}]})
+        if path.startswith("/3/movie/"):
+            return web.json_response(fake_movie(int(path.split("/")[3])))
+        if path == "/v1/chat/completions":
+            return await self.chat(request)
+        return web.json_response({"status_message": "not found"}, status=404)
+
+    async def chat(self, request: web.Request):
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        if "movie titles that match" in prompt:  # guest candidates
+            titles = [f"{movie_title(i)} ({1950 + i % 75})" for i in _ids_for(prompt, 3)]
+            content = json.dumps(titles)
+        elif "JSON array" in prompt:
+            content = json.dumps([
+                {"title": movie_title(i), "year": 1950 + i % 75, "reason": "Fits your taste."}
+                for i in _ids_for(prompt, 10)
+            ])
+        elif "JSON object" in prompt:
+            content = json.dumps({
+                "summary": "You enjoy character-driven films with a strong mood.",
+                "highlight_titles": [],
+                "checkpoint": "Prefers character-driven films.",
+            })
+        else:
+            content = "This choice says something about your taste."
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return web.json_response({
+            "id": "bench",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "bench"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    # ---------- Lifecycle ----------
+    async def start(self, host: str = "127.0.0.1", port: int = 8765):
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(args):
+    fakes = FakeUpstreams(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate)
+    await fakes.start(port=args.port)
+    print(f"🎭 Fake TMDB at http://127.0.0.1:{args.port}/3, OpenAI at http://127.0.0.1:{args.port}/v1")
+    await asyncio.Event().wait()
+
+def add_upstream_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=50, help="mean upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="latency standard deviation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction answered 429")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    add_upstream_args(parser)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
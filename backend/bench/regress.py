@@ -0,0 +1,255 @@
+# backend/bench/regress.py
+"""Upstream round-trip regression check, replayed from recorded cassettes.
+
+Runs representative /recommend, /search and /review flows one at a time
+against the app with UPSTREAM_CASSETTE_MODE=replay, so TMDB and OpenAI
+answers (and how long they took) come from bench/cassettes/. For every
+flow it counts upstream calls made before the response returned, the
+number of upstream waits on the critical path ("serial depth"), and the
+calls made afterwards by background work. It exits non-zero when any of
+them exceeds bench/budgets.json, or when a flow's HTTP status differs from
+the recorded one. Flows that leave background work (the taste worker after
+/review) must also show its SQL under route="background" in /metrics.
+The last two flows hit scripted TMDB failures (see
+FakeUpstreams._scripted_failure): a 503 then a 429 that must be retried
+through to a 200, and a 429 outage that must surface as a 503.
+
+    cd backend
+    python -m bench.regress                       # replay and check
+    python -m bench.regress --record              # re-record against the fake upstreams
+    python -m bench.regress --record --live       # re-record against real TMDB / OpenAI (.env keys)
+    python -m bench.regress --update-budgets      # accept the current numbers
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from collections import Counter
+
+import aiohttp
+
+from bench.fake_upstreams import FakeUpstreams
+from bench.run import _free_port
+from bench.seed import seed
+
+BENCH_DIR = Path(__file__).resolve().parent
+CASSETTE_DIR = BENCH_DIR / "cassettes"
+BUDGETS_PATH = BENCH_DIR / "budgets.json"
+
+# 一次 flow 结束后，这么久没有新的上游调用才算后台任务跑完
+SETTLE_SECONDS = 1.0
+RECORD_LATENCY_MS = 80
+
+
+# ---------- Flows ----------
+# (name, method, path, body builder, authenticated); builders see the shared ctx
+FLOWS = [
+    ("login", "POST", "/login", lambda c: {"json": {"username": c["username"], "password": c["password"]}}, False),
+    ("watched_list", "GET", "/watched-list", lambda c: {"params": {"limit": 50}}, True),
+    ("recommend", "POST", "/recommend", lambda c: {"json": {"mood": "cozy rainy evening", "user_id": c["user_id"]}}, True),
+    ("recommend_next_page", "POST", "/recommend", lambda c: {"json": {
+        "mood": "cozy rainy evening", "user_id": c["user_id"], "cursor": c.get("next_cursor"),
+    }}, True),
+    ("recommend_fast", "POST", "/recommend", lambda c: {"json": {"mood": "tense thriller night", "user_id": c["user_id"], "mode": "fast"}}, True),
+    ("recommend_guest", "POST", "/recommend", lambda c: {"json": {"mood": "uplifting road trip"}}, False),
+    ("search", "POST", "/search", lambda c: {"json": {"mood": "bench heat"}}, False),
+    ("search_suggestions", "GET", "/search_suggestions", lambda c: {"params": {"query": "bench mov"}}, False),
+    ("review", "POST", "/review", lambda c: {"json": {
+        "title": c["review_title"], "user_rating": 9, "liked": True,
+        "review": "Loved the atmosphere.", "moods": ["cozy"],
+    }}, True),
+    ("search_upstream_retry", "POST", "/search", lambda c: {"json": {"mood": "flaky heat"}}, False),
+    # 最后跑：429 会让 TMDB 限流器停一段时间
+    ("search_upstream_outage", "POST", "/search", lambda c: {"json": {"mood": "outage heat"}}, False),
+]
+
+
+def serial_depth(intervals: list[tuple[float, float]]) -> int:
+    """Longest chain of upstream calls where each started after the previous one finished."""
+    depth, last_end = 0, float("-inf")
+    for start, end in sorted(intervals, key=lambda i: i[1]):
+        if start >= last_end:
+            depth += 1
+            last_end = end
+    return depth
+
+
+def _configure_env(mode: str, db_path: Path, upstream: str | None):
+    os.environ.update({
+        "DATABASE_URL": f"sqlite+aiosqlite:///{db_path}",
+        "UPSTREAM_CASSETTE_MODE": mode,
+        "UPSTREAM_CASSETTE_DIR": str(CASSETTE_DIR),
+        "MOVIE_PASS_KEY": os.environ.get("MOVIE_PASS_KEY", "bench-secret"),
+        "TASTE_DEBOUNCE_SECONDS": "0.2",
+        "LLM_CACHE_PERSIST": "0",
+    })
+    if upstream is not None:
+        os.environ.update({
+            "TMDB_BASE_URL": f"{upstream}/3",
+            "TMDB_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"{upstream}/v1",
+            "OPENAI_API_KEY": "bench",
+        })
+    elif mode == "replay":
+        # nothing should leave the machine; a cassette miss fails loudly instead
+        os.environ.update({"TMDB_BASE_URL": "http://127.0.0.1:9/3", "OPENAI_BASE_URL": "http://127.0.0.1:9/v1"})
+        os.environ.setdefault("TMDB_API_KEY", "replay")
+        os.environ.setdefault("OPENAI_API_KEY", "replay")
+
+
+async def _settle(cassette):
+    seen = len(cassette.calls)
+    while True:
+        await asyncio.sleep(SETTLE_SECONDS)
+        if len(cassette.calls) == seen:
+            return
+        seen = len(cassette.calls)
+
+
+async def run_flows(mode: str, live: bool) -> dict:
+    fakes = None
+    upstream = None
+    if mode == "record" and not live:
+        fakes = FakeUpstreams(latency_ms=RECORD_LATENCY_MS, jitter_ms=0)
+        port = _free_port()
+        await fakes.start(port=port)
+        upstream = f"http://127.0.0.1:{port}"
+
+    workdir = Path(tempfile.mkdtemp(prefix="movie-regress-"))
+    db_path = workdir / "regress.db"
+    manifest = seed(db_path, users=2, watched=12, waiting=4, snapshots=4)
+    _configure_env(mode, db_path, upstream)
+
+    # 环境变量要在 import main 之前设好（模块级配置）
+    import uvicorn
+    from main import app
+    from cassette import cassette
+    from metrics import db_queries
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()
+        await asyncio.sleep(0.05)
+
+    base = f"http://127.0.0.1:{port}"
+    user = manifest["users"][0]
+    ctx = {
+        "username": user["username"],
+        "password": manifest["password"],
+        "review_title": user["watched_titles"][0],
+    }
+    results = {}
+    loop = asyncio.get_running_loop()
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+            async with session.post(f"{base}/login", json={"username": ctx["username"], "password": ctx["password"]}) as resp:
+                token = (await resp.json())["access_token"]
+            auth = {"Authorization": f"Bearer {token}"}
+            async with session.get(f"{base}/me", headers=auth) as resp:
+                ctx["user_id"] = (await resp.json())["id"]
+
+            for name, method, path, build, authenticated in FLOWS:
+                await _settle(cassette)
+                first = len(cassette.calls)
+                background_queries = db_queries._values.get(("background",), 0)
+                started = loop.time()
+                wall = time.perf_counter()
+                async with session.request(method, base + path, headers=auth if authenticated else None, **build(ctx)) as resp:
+                    status = resp.status
+                    body = await resp.json(content_type=None)
+                finished = loop.time()
+                latency = time.perf_counter() - wall
+                if isinstance(body, dict) and body.get("next_cursor"):
+                    ctx["next_cursor"] = body["next_cursor"]
+                await _settle(cassette)
+
+                calls = cassette.calls[first:]
+                inline = [c for c in calls if c[2] < finished]
+                background = [c for c in calls if c[2] >= finished]
+                results[name] = {
+                    "status": status,
+                    "inline_calls": dict(Counter(c[0] for c in inline)),
+                    "serial_depth": serial_depth([(c[2], c[3]) for c in inline if c[2] >= started]),
+                    "background_calls": dict(Counter(c[0] for c in background)),
+                    # 后台任务（taste worker 等）的 SQL 要记在 route="background" 下，不能算到已结束的请求头上
+                    "background_queries": db_queries._values.get(("background",), 0) - background_queries,
+                    "latency_ms": round(latency * 1000, 1),
+                }
+    finally:
+        server.should_exit = True
+        await serving
+        if fakes is not None:
+            await fakes.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    results["_misses"] = [f"{u} {k}" for u, k in cassette.misses]
+    return results
+
+
+# ---------- Budget check ----------
+def check(results: dict, budgets: dict) -> list[str]:
+    failures = []
+    for name, _, _, _, _ in FLOWS:
+        got, budget = results[name], budgets.get(name)
+        if budget is None:
+            failures.append(f"{name}: no budget, run with --update-budgets")
+            continue
+        if got["status"] != budget.get("status", 200):
+            failures.append(f"{name}: HTTP {got['status']} (expected {budget.get('status', 200)})")
+        for kind in ("inline_calls", "background_calls"):
+            for upstream, n in got[kind].items():
+                allowed = budget[kind].get(upstream, 0)
+                if n > allowed:
+                    failures.append(f"{name}: {n} {upstream} {kind.replace('_', ' ')} (budget {allowed})")
+        if got["background_calls"] and not got["background_queries"]:
+            failures.append(f"{name}: background work ran no SQL under route=\"background\" in /metrics")
+        if got["serial_depth"] > budget["serial_depth"]:
+            failures.append(f"{name}: serial depth {got['serial_depth']} (budget {budget['serial_depth']})")
+    failures += [f"cassette miss: {m}" for m in results["_misses"]]
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", action="store_true", help="re-record bench/cassettes instead of replaying")
+    parser.add_argument("--live", action="store_true", help="with --record: use the real upstreams configured in the environment")
+    parser.add_argument("--update-budgets", action="store_true", help="write the measured numbers to bench/budgets.json")
+    args = parser.parse_args()
+
+    if args.record:
+        shutil.rmtree(CASSETTE_DIR, ignore_errors=True)
+    results = asyncio.run(run_flows("record" if args.record else "replay", args.live))
+
+    print(f"{'flow':<22}{'status':>7}{'depth':>7}{'ms':>9}  inline / background upstream calls")
+    for name, _, _, _, _ in FLOWS:
+        r = results[name]
+        print(f"{name:<22}{r['status']:>7}{r['serial_depth']:>7}{r['latency_ms']:>9}  {r['inline_calls']} / {r['background_calls']}")
+
+    if args.update_budgets:
+        BUDGETS_PATH.write_text(json.dumps({
+            name: {k: results[name][k] for k in ("status", "inline_calls", "serial_depth", "background_calls")}
+            for name, _, _, _, _ in FLOWS
+        }, indent=2) + "\n")
+        print(f"📄 Budgets written to {BUDGETS_PATH}")
+        return
+
+    if args.record:
+        return
+    failures = check(results, json.loads(BUDGETS_PATH.read_text()))
+    if failures:
+        print("\n❌ Upstream regressions:")
+        for f in failures:
+            print("  -", f)
+        sys.exit(1)
+    print("\n✅ All flows within their upstream budgets")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+# backend/bench/run.py
+"""Load-test the API against fake upstreams.
+
+Starts the fake TMDB/OpenAI servers, seeds a fresh SQLite database, boots
+the app under uvicorn pointed at both, then drives each scenario at a fixed
+concurrency. Per endpoint it reports p50/p95/p99 latency, throughput,
+status codes and how many upstream calls the scenario caused. Results are
+written as JSON so runs can be compared with bench/compare.py.
+
+    cd backend
+    python -m bench.run --users 20 --concurrency 8 --requests 200
+    python -m bench.run --scenarios recommend,search --latency-ms 150
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+from pathlib import Path
+from collections import Counter
+from datetime import datetime
+
+import aiohttp
+
+from bench.fake_upstreams import FakeUpstreams, add_upstream_args
+from bench.seed import seed, MOODS
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+SCENARIOS = ["login", "watched-list", "search", "review", "recommend"]
+
+# 背景任务（taste worker）在这段时间内没有新的上游请求，才算场景结束
+SETTLE_SECONDS = 1.0
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+# ---------- Scenarios ----------
+# each returns (method, path, kwargs) for request number n made as `user`
+def _login(n, user, ctx):
+    return "POST", "/login", {"json": {"username": user["username"], "password": ctx["password"]}}
+
+def _watched_list(n, user, ctx):
+    return "GET", "/watched-list", {"params": {"limit": 50}}
+
+def _search(n, user, ctx):
+    return "POST", "/search", {"json": {"mood": f"bench query {n % ctx['distinct']}"}}
+
+def _review(n, user, ctx):
+    title = user["watched_titles"][n % len(user["watched_titles"])]
+    return "POST", "/review", {"json": {
+        "title": title,
+        "user_rating": 1 + n % 10,
+        "liked": n % 3 == 0,
+        "review": f"Bench review {n}",
+        "moods": [MOODS[n % len(MOODS)]],
+    }}
+
+def _recommend(n, user, ctx):
+    mood = MOODS[n % len(MOODS)]
+    return "POST", "/recommend", {"json": {"mood": f"{mood} {n % ctx['distinct']}", "mode": ctx["recommend_mode"]}}
+
+BUILDERS = {
+    "login": _login,
+    "watched-list": _watched_list,
+    "search": _search,
+    "review": _review,
+    "recommend": _recommend,
+}
+
+
+# ---------- Driver ----------
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.fakes = FakeUpstreams(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate)
+        self.upstream_port = _free_port()
+        self.app_port = _free_port()
+        self.base = f"http://127.0.0.1:{self.app_port}"
+        self.server = None
+        self.tokens = {}
+
+    async def start(self):
+        await self.fakes.start(port=self.upstream_port)
+        db_path = Path(self.args.db).resolve()
+        self.manifest = seed(db_path, self.args.users, self.args.watched, self.args.waiting, self.args.snapshots)
+
+        upstream = f"http://127.0.0.1:{self.upstream_port}"
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": f"sqlite+aiosqlite:///{db_path}",
+            "TMDB_BASE_URL": f"{upstream}/3",
+            "TMDB_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"{upstream}/v1",
+            "OPENAI_API_KEY": "bench",
+            "MOVIE_PASS_KEY": env.get("MOVIE_PASS_KEY", "bench-secret"),
+            "TASTE_DEBOUNCE_SECONDS": str(self.args.debounce),
+            "LLM_CACHE_PERSIST": "0",
+            "DEBUG_ENDPOINTS": "1",  # the driver reads /cache-stats
+        })
+        env.update(dict(kv.split("=", 1) for kv in self.args.env))
+        self.log = open(Path(self.args.db).with_suffix(".server.log"), "w")
+        self.server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.app_port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+
+        async with aiohttp.ClientSession() as session:
+            for _ in range(200):
+                try:
+                    async with session.get(f"{self.base}/cache-stats") as resp:
+                        if resp.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                if self.server.poll() is not None:
+                    raise RuntimeError(f"server exited, see {self.log.name}")
+                await asyncio.sleep(0.1)
+        raise RuntimeError("server did not start")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.terminate()
+            try:
+                self.server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.server.kill()
+            self.log.close()
+        await self.fakes.stop()
+
+    async def login_all(self, session):
+        for user in self.manifest["users"]:
+            async with session.post(f"{self.base}/login", json={
+                "username": user["username"], "password": self.manifest["password"],
+            }) as resp:
+                self.tokens[user["username"]] = (await resp.json())["access_token"]
+
+    async def settle(self):
+        """Wait until background work stops calling upstreams."""
+        last = self.fakes.snapshot()
+        while True:
+            await asyncio.sleep(SETTLE_SECONDS)
+            now = self.fakes.snapshot()
+            if now == last:
+                return
+            last = now
+
+    async def run_scenario(self, session, name):
+        build = BUILDERS[name]
+        ctx = {
+            "password": self.manifest["password"],
+            "distinct": self.args.distinct,
+            "recommend_mode": self.args.recommend_mode,
+        }
+        users = self.manifest["users"]
+        rng = random.Random(name)
+        latencies, statuses = [], Counter()
+        counter = iter(range(self.args.requests))
+
+        async def worker():
+            for n in counter:
+                user = rng.choice(users)
+                method, path, kwargs = build(n, user, ctx)
+                headers = {"Authorization": f"Bearer {self.tokens[user['username']]}"}
+                start = time.perf_counter()
+                try:
+                    async with session.request(method, self.base + path, headers=headers, **kwargs) as resp:
+                        await resp.read()
+                        statuses[str(resp.status)] += 1
+                except aiohttp.ClientError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+
+        before = self.fakes.snapshot()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - started
+        await self.settle()
+        after = self.fakes.snapshot()
+
+        latencies.sort()
+        upstream = {k: after[k] - before.get(k, 0) for k in after if after[k] != before.get(k, 0)}
+        return {
+            "requests": len(latencies),
+            "concurrency": self.args.concurrency,
+            "duration_s": round(elapsed, 3),
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+                "p50": round(percentile(latencies, 0.50) * 1000, 2),
+                "p95": round(percentile(latencies, 0.95) * 1000, 2),
+                "p99": round(percentile(latencies, 0.99) * 1000, 2),
+                "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            },
+            "status": dict(statuses),
+            "upstream_calls": upstream,
+            "upstream_per_request": {
+                k: round(v / len(latencies), 3) for k, v in upstream.items() if " " not in k
+            } if latencies else {},
+        }
+
+    async def run(self):
+        results = {}
+        await self.start()
+        try:
+            timeout = aiohttp.ClientTimeout(total=self.args.timeout)
+            connector = aiohttp.TCPConnector(limit=self.args.concurrency * 2)
+            async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+                await self.login_all(session)
+                for name in self.args.scenarios:
+                    print(f"🏁 {name}: {self.args.requests} requests at concurrency {self.args.concurrency}")
+                    results[name] = await self.run_scenario(session, name)
+                    r = results[name]
+                    print(f"   p50 {r['latency_ms']['p50']}ms  p95 {r['latency_ms']['p95']}ms  "
+                          f"p99 {r['latency_ms']['p99']}ms  {r['throughput_rps']} req/s  "
+                          f"status {r['status']}  upstream {r['upstream_per_request']}/req")
+                async with session.get(f"{self.base}/cache-stats") as resp:
+                    cache_stats = await resp.json()
+        finally:
+            await self.stop()
+        return results, cache_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=SCENARIOS,
+                        help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout, seconds")
+    parser.add_argument("--distinct", type=int, default=20, help="distinct search/mood strings (lower = more cache hits)")
+    parser.add_argument("--recommend-mode", default=None, help="MoodInput.mode for /recommend, e.g. fast")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--watched", type=int, default=40)
+    parser.add_argument("--waiting", type=int, default=10)
+    parser.add_argument("--snapshots", type=int, default=8)
+    parser.add_argument("--debounce", type=float, default=0.2, help="TASTE_DEBOUNCE_SECONDS for the server")
+    parser.add_argument("--db", default=str(Path(__file__).resolve().parent / "bench.db"))
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra server environment, e.g. --env RECOMMEND_PIPELINE=retry")
+    parser.add_argument("--output", type=Path, default=None, help="result JSON path (default bench/results/<timestamp>.json)")
+    add_upstream_args(parser)
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results, cache_stats = asyncio.run(Bench(args).run())
+
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+        "scenarios": results,
+        "cache_stats": cache_stats,
+    }, indent=2))
+    print(f"📄 Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
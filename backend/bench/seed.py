@@ -0,0 +1,134 @@
+# backend/bench/seed.py
+"""Create a SQLite database of synthetic users for benchmarks.
+
+Every user gets watched and waiting lists drawn from the fake TMDB catalog,
+a handful of taste snapshots and a taste summary, so list, review and
+recommendation endpoints do realistic amounts of work. All users share the
+password in BENCH_PASSWORD. A `<db>.manifest.json` next to the database
+lists the usernames and some titles for the load driver to use.
+
+    python -m bench.seed --db bench/bench.db --users 50 --watched 40
+"""
+import json
+import random
+import argparse
+from pathlib import Path
+from datetime import date, datetime, timedelta
+from passlib.context import CryptContext
+from sqlalchemy import create_engine
+from sqlalchemy.dialects.sqlite import insert
+
+from base import Base
+from models import Movie, User, WatchedMovie, WaitingMovie, TasteSnapshot, TasteSummary
+from bench.fake_upstreams import CATALOG_SIZE, fake_movie
+
+BENCH_PASSWORD = "bench-password"
+MOODS = ["cozy", "tense", "melancholy", "uplifting", "weird", "romantic", "dark", "funny"]
+
+
+def catalog_row(tmdb_id: int) -> dict:
+    movie = fake_movie(tmdb_id)
+    return {
+        "tmdb_id": tmdb_id,
+        "title": movie["title"],
+        "poster": f"https://image.tmdb.org/t/p/w500{movie['poster_path']}",
+        "backdrop": f"https://image.tmdb.org/t/p/w780{movie['backdrop_path']}",
+        "tmdb_rating": movie["vote_average"],
+        "description": movie["overview"],
+        "release_year": int(movie["release_date"][:4]),
+        "genres": ", ".join(g["name"] for g in movie["genres"]),
+        "director": f"Director {tmdb_id % 300}",
+    }
+
+
+def seed(db_path: Path, users: int, watched: int, waiting: int, snapshots: int, seed_value: int = 0) -> dict:
+    rng = random.Random(seed_value)
+    if db_path.exists():
+        db_path.unlink()
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(engine)
+
+    # one bcrypt hash for everyone; hashing per user would dominate seeding time
+    hashed = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(BENCH_PASSWORD)
+    manifest = {"password": BENCH_PASSWORD, "users": []}
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        picks = {}
+        used = set()
+        for i in range(users):
+            ids = rng.sample(range(1, CATALOG_SIZE + 1), watched + waiting)
+            picks[i] = (ids[:watched], ids[watched:])
+            used.update(ids)
+        conn.execute(insert(Movie).on_conflict_do_nothing(), [catalog_row(t) for t in sorted(used)])
+
+        for i in range(users):
+            username = f"bench_user_{i}"
+            user_id = conn.execute(
+                insert(User).values(username=username, hashed_password=hashed).returning(User.id)
+            ).scalar_one()
+            watched_ids, waiting_ids = picks[i]
+
+            watched_rows = []
+            for k, tmdb_id in enumerate(watched_ids):
+                rating = rng.randint(1, 10)
+                watched_rows.append({
+                    "user_id": user_id,
+                    "tmdb_id": tmdb_id,
+                    "title": fake_movie(tmdb_id)["title"],
+                    "user_rating": rating,
+                    "liked": 1 if rating >= 8 else 0,
+                    "disliked": rating <= 3,
+                    "review": f"Synthetic review {k} for user {i}." if rng.random() < 0.5 else None,
+                    "moods": ", ".join(rng.sample(MOODS, 2)),
+                    "watch_date": date.today() - timedelta(days=rng.randint(0, 1500)),
+                })
+            inserted = conn.execute(insert(WatchedMovie).returning(WatchedMovie.id), watched_rows).scalars().all()
+
+            conn.execute(insert(WaitingMovie), [
+                {"user_id": user_id, "tmdb_id": t, "title": fake_movie(t)["title"], "added_date": date.today()}
+                for t in waiting_ids
+            ])
+
+            snapshot_ids = []
+            for k in range(min(snapshots, len(inserted))):
+                snapshot_ids.append(conn.execute(
+                    insert(TasteSnapshot).values(
+                        user_id=user_id,
+                        movie_id=inserted[k],
+                        timestamp=now - timedelta(hours=snapshots - k),
+                        action_type="review",
+                        mood_tag=watched_rows[k]["moods"],
+                        gpt_comment="You gravitate toward films with a strong mood.",
+                        movie_title=watched_rows[k]["title"],
+                    ).returning(TasteSnapshot.id)
+                ).scalar_one())
+            conn.execute(insert(TasteSummary).values(
+                user_id=user_id,
+                summary="You enjoy character-driven films with a strong mood.",
+                highlight_titles="[]",
+                last_snapshot_id=snapshot_ids[-1] if snapshot_ids else None,
+            ))
+
+            manifest["users"].append({
+                "username": username,
+                "watched_titles": [r["title"] for r in watched_rows[:10]],
+                "waiting_titles": [fake_movie(t)["title"] for t in waiting_ids[:10]],
+            })
+    engine.dispose()
+
+    Path(f"{db_path}.manifest.json").write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, default=Path("bench/bench.db"))
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--watched", type=int, default=40, help="watched movies per user")
+    parser.add_argument("--waiting", type=int, default=10, help="waitlist movies per user")
+    parser.add_argument("--snapshots", type=int, default=8, help="taste snapshots per user")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    seed(args.db, args.users, args.watched, args.waiting, args.snapshots, args.seed)
+    print(f"🌱 Seeded {args.users} users into {args.db}")
@@ -0,0 +1,78 @@
+# backend/cache.py
+import time
+from collections import OrderedDict
+
+# name -> cache, so /cache-stats can report every in-process cache
+caches = {}
+
+
+class TTLCache:
+    """Small in-process LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        caches[name] = self
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def cache_stats():
+    return {name: c.stats() for name, c in caches.items()}
+
+
+# ---------- Per-user versions ----------
+# Writes bump a user's version after they commit; caches that include the
+# version in their key stop seeing older entries, which then age out.
+_user_versions = {}
+
+
+def get_user_version(user_id: int, kind: str) -> int:
+    return _user_versions.get((user_id, kind), 0)
+
+
+def bump_user_version(user_id: int, kind: str):
+    _user_versions[(user_id, kind)] = get_user_version(user_id, kind) + 1
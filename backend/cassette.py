@@ -0,0 +1,101 @@
+# backend/cassette.py
+import os
+import json
+import time
+import asyncio
+from pathlib import Path
+from collections import Counter, defaultdict
+
+# off: talk to upstreams; record: talk to them and write every exchange down;
+# replay: answer from the recordings only, waiting as long as the original call took
+UPSTREAM_CASSETTE_MODE = os.getenv("UPSTREAM_CASSETTE_MODE", "off")
+UPSTREAM_CASSETTE_DIR = os.getenv("UPSTREAM_CASSETTE_DIR", "cassettes")
+UPSTREAM_CASSETTE_SPEED = float(os.getenv("UPSTREAM_CASSETTE_SPEED", "1"))  # 2 = replay twice as fast
+
+
+class CassetteMiss(RuntimeError):
+    """Replay mode got a request that was never recorded."""
+
+
+class Cassette:
+    """Records or replays upstream exchanges, one JSONL file per upstream.
+
+    TMDB and OpenAI clients pass each single HTTP exchange through
+    `exchange(upstream, key, fn, *args)`; `fn` must return something JSON
+    serializable. Keys are the same ones the response caches use, so a
+    replay matches as long as the app asks for the same things. A key
+    recorded several times is replayed in the recorded order, then the last
+    answer repeats. Outside "off" mode every call is also appended to
+    `calls` so tooling can count round trips and serial waits per request.
+    """
+
+    def __init__(self, mode: str = UPSTREAM_CASSETTE_MODE, directory: str = UPSTREAM_CASSETTE_DIR):
+        if mode not in ("off", "record", "replay"):
+            raise ValueError(f"UPSTREAM_CASSETTE_MODE must be off, record or replay, not {mode!r}")
+        self.mode = mode
+        self.directory = Path(directory)
+        self.calls = []  # (upstream, key, started, finished) in loop time
+        self.counts = Counter()
+        self.misses = []
+        self._tapes = None  # replay: (upstream, key) -> [entries]
+        self._served = Counter()
+
+    def _load(self):
+        self._tapes = defaultdict(list)
+        for path in sorted(self.directory.glob("*.jsonl")):
+            with path.open(encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._tapes[(path.stem, entry["key"])].append(entry)
+        print(f"📼 Replaying {sum(len(v) for v in self._tapes.values())} upstream exchanges from {self.directory}")
+
+    async def exchange(self, upstream: str, key: str, fn, *args, request=None):
+        if self.mode == "off":
+            return await fn(*args)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.counts[upstream] += 1
+        try:
+            if self.mode == "replay":
+                return await self._replay(upstream, key)
+            result = await fn(*args)
+            self._write(upstream, {
+                "key": key,
+                "request": request if request is not None else key,
+                "elapsed": round(loop.time() - started, 4),
+                "response": result,
+            })
+            return result
+        finally:
+            self.calls.append((upstream, key, started, loop.time()))
+
+    async def _replay(self, upstream: str, key: str):
+        if self._tapes is None:
+            self._load()
+        tape = self._tapes.get((upstream, key))
+        if not tape:
+            self.misses.append((upstream, key))
+            raise CassetteMiss(f"no recorded {upstream} exchange for {key}")
+        n = self._served[(upstream, key)]
+        self._served[(upstream, key)] += 1
+        entry = tape[min(n, len(tape) - 1)]
+        await asyncio.sleep(entry["elapsed"] / UPSTREAM_CASSETTE_SPEED)
+        return entry["response"]
+
+    def _write(self, upstream: str, entry: dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry["recorded_at"] = round(time.time(), 3)
+        with (self.directory / f"{upstream}.jsonl").open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, sort_keys=True) + "\n")
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "calls": dict(self.counts),
+            "misses": len(self.misses),
+        }
+
+
+cassette = Cassette()
@@ -1,175 +1,560 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.future import select
-from sqlalchemy import delete
-from models import WatchedMovie, WaitingMovie
-from base import Base
-from datetime import datetime
+from sqlalchemy import String, delete, event, exists, func, inspect, literal, or_, text, tuple_, type_coerce
+from sqlalchemy.dialects.sqlite import insert
+from models import WatchedMovie, WaitingMovie, Movie, TasteSnapshot, CATALOG_FIELDS
+from datetime import date, datetime
 
 import os
+import json
+import base64
 from dotenv import load_dotenv
 
 load_dotenv(dotenv_path=".env")  
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# 逐条打印 SQL 很慢，只在本地排查时打开；慢查询和 N+1 见 query_profiler.py
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "500"))  # rows fetched per round trip when exporting
+
+engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO)
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _enable_wal(dbapi_connection, connection_record):
+        # WAL: 长时间的读（流式导出）不会挡住写入的提交
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
 async def init_db():
     from models import Base
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_migrate_to_catalog)
+        await conn.run_sync(_dedupe_lists)
+
+# create_all 不会给已存在的表加列，新列在这里补上
+NEW_COLUMNS = {
+    "taste_summaries": {
+        "last_snapshot_id": "INTEGER",
+        "checkpoints": "TEXT",
+    },
+}
+
+def _add_missing_columns(sync_conn):
+    inspector = inspect(sync_conn)
+    for table, columns in NEW_COLUMNS.items():
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        for name, ddl in columns.items():
+            if name not in existing:
+                print(f"🛠️ Adding column {table}.{name}")
+                sync_conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+# 旧版本把 TMDB 元数据复制到每个用户的列表行里；迁到共享的 movies 表后删掉这些列
+def _migrate_to_catalog(sync_conn):
+    inspector = inspect(sync_conn)
+    columns = ", ".join(CATALOG_FIELDS)
+    tables = {}
+    for table in ("watched_movies", "waiting_movies"):
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        legacy = [name for name in CATALOG_FIELDS if name in existing]
+        if legacy:
+            tables[table] = legacy
+    if not tables:
+        return
+
+    # Very old rows were saved before tmdb_id existed. Give each such title a
+    # placeholder (negative) catalog id so its metadata survives the move.
+    next_placeholder = min(0, sync_conn.execute(text("SELECT MIN(tmdb_id) FROM movies")).scalar() or 0) - 1
+    for table in tables:
+        titles = sync_conn.execute(text(
+            f"SELECT DISTINCT title FROM {table} WHERE tmdb_id IS NULL"
+        )).scalars().all()
+        for title in titles:
+            placeholder = sync_conn.execute(
+                text("SELECT tmdb_id FROM movies WHERE tmdb_id < 0 AND title = :title"),
+                {"title": title},
+            ).scalar()
+            if placeholder is None:
+                placeholder = next_placeholder
+                next_placeholder -= 1
+                sync_conn.execute(text(
+                    f"INSERT INTO movies (tmdb_id, title, {columns}) "
+                    f"SELECT :placeholder, title, {columns} FROM {table} "
+                    f"WHERE tmdb_id IS NULL AND title = :title LIMIT 1"
+                ), {"placeholder": placeholder, "title": title})
+            sync_conn.execute(
+                text(f"UPDATE {table} SET tmdb_id = :placeholder WHERE tmdb_id IS NULL AND title = :title"),
+                {"placeholder": placeholder, "title": title},
+            )
+
+    for table, legacy in tables.items():
+        print(f"🛠️ Moving {table} metadata into movies")
+        sync_conn.execute(text(
+            f"INSERT OR IGNORE INTO movies (tmdb_id, title, {columns}) "
+            f"SELECT tmdb_id, title, {columns} FROM {table} "
+            f"WHERE tmdb_id IS NOT NULL GROUP BY tmdb_id"
+        ))
+        for name in legacy:
+            try:
+                sync_conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+            except Exception as e:
+                # SQLite < 3.35 不支持 DROP COLUMN；旧列留着也不影响读写
+                print(f"⚠️ Could not drop {table}.{name}: {e}")
+                break
+
+# 唯一索引建立之前先清掉重复行；create_all 不会给已存在的表补索引
+LIST_INDEXES = [
+    *WatchedMovie.__table__.indexes,
+    *WaitingMovie.__table__.indexes,
+    *TasteSnapshot.__table__.indexes,
+]
+
+def _dedupe_lists(sync_conn):
+    # 一次性迁移：唯一索引已经在了就说明去重做过，别每次启动都全表扫
+    existing = {
+        index["name"]
+        for table in ("watched_movies", "waiting_movies")
+        for index in inspect(sync_conn).get_indexes(table)
+    }
+    if all(index.name in existing for index in LIST_INDEXES if index.unique):
+        for index in LIST_INDEXES:
+            index.create(sync_conn, checkfirst=True)
+        return
+
+    # Keep the oldest row per (user_id, tmdb_id) and point snapshots of the
+    # duplicates at it before they are deleted.
+    keep_watched = (
+        "SELECT MIN(id) FROM watched_movies WHERE tmdb_id IS NOT NULL GROUP BY user_id, tmdb_id"
+    )
+    moved = sync_conn.execute(text(
+        "UPDATE taste_snapshots SET movie_id = ("
+        "  SELECT MIN(k.id) FROM watched_movies d JOIN watched_movies k"
+        "  ON k.user_id = d.user_id AND k.tmdb_id = d.tmdb_id"
+        "  WHERE d.id = taste_snapshots.movie_id"
+        ") WHERE movie_id IN ("
+        f"  SELECT id FROM watched_movies WHERE tmdb_id IS NOT NULL AND id NOT IN ({keep_watched})"
+        ")"
+    )).rowcount
+    removed = sync_conn.execute(text(
+        f"DELETE FROM watched_movies WHERE tmdb_id IS NOT NULL AND id NOT IN ({keep_watched})"
+    )).rowcount
+    removed += sync_conn.execute(text(
+        "DELETE FROM waiting_movies WHERE tmdb_id IS NOT NULL AND id NOT IN ("
+        "  SELECT MIN(id) FROM waiting_movies WHERE tmdb_id IS NOT NULL GROUP BY user_id, tmdb_id"
+        ")"
+    )).rowcount
+    if removed:
+        print(f"🛠️ Removed {removed} duplicate list rows ({moved} snapshots re-pointed)")
+
+    for index in LIST_INDEXES:
+        index.create(sync_conn, checkfirst=True)
+
+# ---------- Catalog ----------
+def _blank(column):
+    return func.nullif(column, "")
+
+def catalog_upsert(rows: list[dict]):
+    """INSERT into movies. An existing row keeps what it has, but its blank
+    (NULL or "") columns are filled from the new payload, so one client
+    sending an empty poster can't blank the film for every user."""
+    stmt = insert(Movie).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=["tmdb_id"],
+        set_={
+            field: func.coalesce(_blank(getattr(Movie, field)), stmt.excluded[field])
+            for field in CATALOG_FIELDS
+        },
+        where=or_(*(
+            _blank(getattr(Movie, field)).is_(None) & _blank(stmt.excluded[field]).isnot(None)
+            for field in CATALOG_FIELDS
+        )),
+    )
+
+async def ensure_catalog_movie(session: AsyncSession, movie_data: dict):
+    """Insert the shared movies row for movie_data["tmdb_id"], or fill in its blank fields."""
+    tmdb_id = movie_data.get("tmdb_id")
+    if tmdb_id is None:
+        return
+    await session.execute(catalog_upsert([{
+        "tmdb_id": tmdb_id,
+        "title": movie_data["title"],
+        **{field: movie_data.get(field) for field in CATALOG_FIELDS},
+    }]))
+
+def public_tmdb_id(tmdb_id):
+    # negative ids are placeholders for legacy rows, not real TMDB ids
+    return tmdb_id if tmdb_id is not None and tmdb_id > 0 else None
+
+def serialize_watched(movie: WatchedMovie):
+    return {
+        "id": movie.id,
+        "title": movie.title,
+        "user_rating": movie.user_rating,
+        "liked": movie.liked,
+        "review": movie.review,
+        "moods": movie.moods,
+        "watch_date": movie.watch_date,
+        "user_id": movie.user_id,
+        "tmdb_id": public_tmdb_id(movie.tmdb_id),
+        "disliked": movie.disliked,
+        **{field: getattr(movie, field) for field in CATALOG_FIELDS},
+    }
+
+def serialize_waiting(movie: WaitingMovie):
+    return {
+        "id": movie.id,
+        "title": movie.title,
+        "added_date": movie.added_date,
+        "user_id": movie.user_id,
+        "tmdb_id": public_tmdb_id(movie.tmdb_id),
+        **{field: getattr(movie, field) for field in CATALOG_FIELDS},
+    }
+
+def serialize_snapshot(s: TasteSnapshot):
+    return {
+        "id": s.id,
+        "movie_id": s.movie_id,
+        "timestamp": s.timestamp.isoformat() if s.timestamp else None,
+        "mood": s.mood_tag,
+        "comment": s.gpt_comment,
+        "movie_title": s.movie_title,
+    }
+
+# ---------- Pagination ----------
+# 列表卡片只用到这些字段；fields="summary" 时只查这些列
+WATCHED_SUMMARY_COLUMNS = [
+    WatchedMovie.id, WatchedMovie.title, WatchedMovie.tmdb_id, WatchedMovie.user_rating,
+    WatchedMovie.liked, WatchedMovie.disliked, WatchedMovie.watch_date,
+    Movie.poster, Movie.release_year, Movie.genres,
+]
+WAITING_SUMMARY_COLUMNS = [
+    WaitingMovie.id, WaitingMovie.title, WaitingMovie.tmdb_id, WaitingMovie.added_date,
+    Movie.poster, Movie.release_year, Movie.genres,
+]
+SNAPSHOT_SUMMARY_COLUMNS = [
+    TasteSnapshot.id, TasteSnapshot.movie_id, TasteSnapshot.timestamp,
+    TasteSnapshot.mood_tag, TasteSnapshot.movie_title,
+]
+
+# sort name -> (key expression, descending). Keys are compared as the text
+# SQLite stores, so cursors round-trip exactly; ties break on id.
+WATCHED_SORTS = {
+    "id": (WatchedMovie.id, False),
+    "-id": (WatchedMovie.id, True),
+    "watch_date": (func.coalesce(type_coerce(WatchedMovie.watch_date, String), ""), False),
+    "-watch_date": (func.coalesce(type_coerce(WatchedMovie.watch_date, String), ""), True),
+}
+WAITING_SORTS = {
+    "id": (WaitingMovie.id, False),
+    "-id": (WaitingMovie.id, True),
+}
+SNAPSHOT_SORTS = {
+    "-timestamp": (func.coalesce(type_coerce(TasteSnapshot.timestamp, String), ""), True),
+    "timestamp": (func.coalesce(type_coerce(TasteSnapshot.timestamp, String), ""), False),
+}
+
+def encode_cursor(key, row_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([key, row_id]).encode()).decode()
+
+def decode_cursor(cursor: str):
+    """Opaque cursor -> (key, id). Raises ValueError if it was tampered with."""
+    try:
+        key, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    # 排序键只会是标量（id / 日期字符串 / 时间戳）；list、dict 进到 tuple_ 里会直接 500
+    if not isinstance(row_id, int) or not (key is None or isinstance(key, (str, int, float))):
+        raise ValueError("Invalid cursor")
+    return key, row_id
+
+async def keyset_page(session: AsyncSession, query, sort, id_column, limit=None, cursor=None):
+    """Run query ordered by (sort key, id) starting after cursor.
+
+    Returns (rows, next_cursor); rows are ORM objects or column rows depending
+    on the query. limit=None returns everything (next_cursor is then None).
+    """
+    key, descending = sort
+    query = query.add_columns(key.label("_sort_key"), id_column.label("_sort_id"))
+    if cursor:
+        after = tuple_(key, id_column)
+        bound = tuple_(*decode_cursor(cursor))
+        query = query.where(after < bound if descending else after > bound)
+    if descending:
+        query = query.order_by(key.desc(), id_column.desc())
+    else:
+        query = query.order_by(key, id_column)
+    if limit is not None:
+        query = query.limit(limit + 1)  # one extra row tells us whether there is a next page
+
+    rows = (await session.execute(query)).unique().all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]._sort_key, rows[-1]._sort_id)
+    return rows, next_cursor
+
+def _summary_dict(row, columns):
+    data = {column.key: getattr(row, column.key) for column in columns}
+    data["tmdb_id"] = public_tmdb_id(data["tmdb_id"])
+    return data
+
+async def count_rows(session: AsyncSession, model, user_id: int) -> int:
+    # 走 user_id 开头的索引，不会加载行
+    result = await session.execute(
+        select(func.count()).select_from(model).where(model.user_id == user_id)
+    )
+    return result.scalar_one()
 
 # ---------- Watched List ----------
-async def get_watched_movies(user_id: int):
+async def get_watched_movies(user_id: int, limit=None, cursor=None, sort="id", fields="full"):
+    """One page of the user's watched list -> (movies, next_cursor, total)."""
     async with async_session() as session:
-        result = await session.execute(
-            select(WatchedMovie).where(WatchedMovie.user_id == user_id)
+        if fields == "summary":
+            query = select(*WATCHED_SUMMARY_COLUMNS).outerjoin(Movie, WatchedMovie.movie)
+        else:
+            query = select(WatchedMovie)
+        query = query.where(WatchedMovie.user_id == user_id)
+        rows, next_cursor = await keyset_page(
+            session, query, WATCHED_SORTS[sort], WatchedMovie.id, limit, cursor
         )
-        return result.scalars().all()
+        total = await count_rows(session, WatchedMovie, user_id)
+    if fields == "summary":
+        movies = [_summary_dict(row, WATCHED_SUMMARY_COLUMNS) for row in rows]
+    else:
+        movies = [serialize_watched(row[0]) for row in rows]
+    return movies, next_cursor, total
 
 async def add_to_watched(session: AsyncSession, movie_data: dict):
     user_id = movie_data["user_id"]
-    title = movie_data["title"]
+    tmdb_id = movie_data["tmdb_id"]
 
-    existing = await session.execute(
-    select(WatchedMovie).where(
-        WatchedMovie.user_id == user_id,
-        WatchedMovie.tmdb_id == movie_data["tmdb_id"]
+    # 重复添加由 (user_id, tmdb_id) 唯一索引挡住，不需要先查
+    await ensure_catalog_movie(session, movie_data)
+    await session.execute(
+        insert(WatchedMovie)
+        .values(
+            title=movie_data["title"],
+            user_rating=movie_data.get("user_rating"),
+            liked=movie_data.get("liked"),
+            review=movie_data.get("review"),
+            moods=movie_data.get("moods"),
+            watch_date=movie_data.get("watch_date"),
+            user_id=user_id,
+            tmdb_id=tmdb_id,
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "tmdb_id"])
     )
-)
-    if existing.scalar():
-        return
-
     await session.execute(
-    delete(WaitingMovie).where(
-        WaitingMovie.user_id == user_id,
-        WaitingMovie.tmdb_id == movie_data["tmdb_id"]
+        delete(WaitingMovie).where(
+            WaitingMovie.user_id == user_id,
+            WaitingMovie.tmdb_id == tmdb_id,
         )
     )
 
-    # Ensure all new fields are present
-    new_movie = WatchedMovie(
-        title=movie_data["title"],
-        poster=movie_data.get("poster"),
-        backdrop=movie_data.get("backdrop"),
-        tmdb_rating=movie_data.get("tmdb_rating"),
-        description=movie_data.get("description"),
-        user_rating=movie_data.get("user_rating"),
-        liked=movie_data.get("liked"),
-        review=movie_data.get("review"),
-        moods=movie_data.get("moods"),
-        watch_date=movie_data.get("watch_date"),
-        user_id=user_id,
-        tmdb_id=movie_data.get("tmdb_id"),
-        release_year=movie_data.get("release_year"),
-        genres=movie_data.get("genres"),
-        director=movie_data.get("director"),
+async def bulk_add_watched(session: AsyncSession, user_id: int, movies: list[dict]) -> list[int]:
+    """Insert many watched rows (and their catalog rows) in three statements.
+
+    Films already in the watched list are left untouched. Returns the
+    tmdb_ids that were actually added; those also leave the waiting list.
+    """
+    if not movies:
+        return []
+    catalog = {m["tmdb_id"]: m for m in movies}
+    await session.execute(catalog_upsert([
+        {"tmdb_id": tmdb_id, "title": m["title"], **{field: m.get(field) for field in CATALOG_FIELDS}}
+        for tmdb_id, m in catalog.items()
+    ]))
+    result = await session.execute(
+        insert(WatchedMovie)
+        .values([
+            {
+                "user_id": user_id,
+                "tmdb_id": m["tmdb_id"],
+                "title": m["title"],
+                "user_rating": m.get("user_rating"),
+                "liked": m.get("liked"),
+                "review": m.get("review"),
+                "moods": m.get("moods"),
+                "watch_date": m.get("watch_date"),
+            }
+            for m in movies
+        ])
+        .on_conflict_do_nothing(index_elements=["user_id", "tmdb_id"])
+        .returning(WatchedMovie.tmdb_id)
     )
-    session.add(new_movie)
+    added = list(result.scalars().all())
+    if added:
+        await session.execute(
+            delete(WaitingMovie).where(
+                WaitingMovie.user_id == user_id,
+                WaitingMovie.tmdb_id.in_(added),
+            )
+        )
+    return added
 
 # ---------- Waiting List ----------
-async def get_waiting_movies(user_id: int):
+async def get_waiting_movies(user_id: int, limit=None, cursor=None, sort="id", fields="full"):
+    """One page of the user's waiting list -> (movies, next_cursor, total)."""
     async with async_session() as session:
-        result = await session.execute(
-            select(WaitingMovie).where(WaitingMovie.user_id == user_id)
+        if fields == "summary":
+            query = select(*WAITING_SUMMARY_COLUMNS).outerjoin(Movie, WaitingMovie.movie)
+        else:
+            query = select(WaitingMovie)
+        query = query.where(WaitingMovie.user_id == user_id)
+        rows, next_cursor = await keyset_page(
+            session, query, WAITING_SORTS[sort], WaitingMovie.id, limit, cursor
         )
-        return result.scalars().all()
+        total = await count_rows(session, WaitingMovie, user_id)
+    if fields == "summary":
+        movies = [_summary_dict(row, WAITING_SUMMARY_COLUMNS) for row in rows]
+    else:
+        movies = [serialize_waiting(row[0]) for row in rows]
+    return movies, next_cursor, total
 
 async def add_to_waiting(session: AsyncSession, movie_data: dict):
     user_id = movie_data["user_id"]
-    title = movie_data["title"]
+    tmdb_id = movie_data["tmdb_id"]
 
-    existing_watched = await session.execute(
-    select(WatchedMovie).where(
+    await ensure_catalog_movie(session, movie_data)
+    # INSERT ... SELECT ... WHERE NOT EXISTS (watched) ON CONFLICT DO NOTHING
+    already_watched = exists().where(
         WatchedMovie.user_id == user_id,
-        WatchedMovie.tmdb_id == movie_data["tmdb_id"]
-    )
-)
-    if existing_watched.scalar():
-        return
-
-    existing_waiting = await session.execute(
-    select(WaitingMovie).where(
-        WaitingMovie.user_id == user_id,
-        WaitingMovie.tmdb_id == movie_data["tmdb_id"]
+        WatchedMovie.tmdb_id == tmdb_id,
     )
-)
-    if existing_waiting.scalar():
-        return
-
-    new_movie = WaitingMovie(
-        title=movie_data["title"],
-        poster=movie_data.get("poster"),
-        backdrop=movie_data.get("backdrop"),
-        tmdb_rating=movie_data.get("tmdb_rating"),
-        description=movie_data.get("description"),
-        user_id=user_id,
-        tmdb_id=movie_data.get("tmdb_id"),
-        release_year=movie_data.get("release_year"),
-        genres=movie_data.get("genres"),
-        director=movie_data.get("director"),
-        added_date=movie_data.get("added_date")  # Optional
+    await session.execute(
+        insert(WaitingMovie)
+        .from_select(
+            ["title", "user_id", "tmdb_id", "added_date"],
+            select(
+                literal(movie_data["title"]),
+                literal(user_id),
+                literal(tmdb_id),
+                literal(movie_data.get("added_date"), WaitingMovie.added_date.type),  # Optional
+            ).where(~already_watched),
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "tmdb_id"])
     )
-    session.add(new_movie)
 
 # ---------- Move from Waiting → Watched ----------
 async def move_to_watched(session: AsyncSession, movie_data: dict):
+    """Delete the waiting row and insert the watched one in the caller's transaction."""
     user_id = movie_data["user_id"]
-    title = movie_data["title"]
 
     result = await session.execute(
-    select(WaitingMovie).where(
-        WaitingMovie.user_id == user_id,
-        WaitingMovie.tmdb_id == movie_data["tmdb_id"]
+        delete(WaitingMovie)
+        .where(
+            WaitingMovie.user_id == user_id,
+            WaitingMovie.tmdb_id == movie_data["tmdb_id"],
+        )
+        .returning(WaitingMovie.title, WaitingMovie.tmdb_id)
     )
-)
-    waiting_movie = result.scalar_one_or_none()
+    waiting_movie = result.first()
     if not waiting_movie:
         return
 
+    # 元数据在 movies 表里，只需要写用户自己的字段
     await session.execute(
-    delete(WaitingMovie).where(
-        WaitingMovie.user_id == user_id,
-        WaitingMovie.tmdb_id == movie_data["tmdb_id"]
+        insert(WatchedMovie)
+        .values(
+            user_id=user_id,
+            title=waiting_movie.title,
+            user_rating=movie_data.get("user_rating"),
+            liked=movie_data.get("liked", False),
+            review=movie_data.get("review", ""),
+            tmdb_id=waiting_movie.tmdb_id,
+            moods=", ".join(movie_data.get("moods") or []) if isinstance(movie_data.get("moods"), list) else (movie_data.get("moods") or ""),
+            watch_date=datetime.strptime(movie_data["watch_date"], "%Y-%m-%d").date()
+                if movie_data.get("watch_date")
+                else None,
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "tmdb_id"])
     )
-)
-
-    full_data = {
-        "user_id": waiting_movie.user_id,
-        "title": waiting_movie.title,
-        "poster": waiting_movie.poster,
-        "backdrop": waiting_movie.backdrop,
-        "tmdb_rating": waiting_movie.tmdb_rating,
-        "description": waiting_movie.description,
-        "user_rating": movie_data.get("user_rating"),
-        "liked": movie_data.get("liked", False),
-        "review": movie_data.get("review", ""),
-        "tmdb_id": waiting_movie.tmdb_id,
-        "release_year": waiting_movie.release_year,
-        "genres": waiting_movie.genres,
-        "director": waiting_movie.director,
-        "moods": ", ".join(movie_data.get("moods") or []) if isinstance(movie_data.get("moods"), list) else (movie_data.get("moods") or ""),
-        "watch_date": datetime.strptime(movie_data["watch_date"], "%Y-%m-%d").date()
-            if movie_data.get("watch_date")
-            else None,
+
+# ---------- Snapshot History ----------
+async def get_snapshot_history(user_id: int, limit=None, cursor=None, sort="-timestamp", fields="full"):
+    """One page of the user's taste snapshots -> (snapshots, next_cursor, total)."""
+    async with async_session() as session:
+        if fields == "summary":
+            query = select(*SNAPSHOT_SUMMARY_COLUMNS)
+        else:
+            query = select(TasteSnapshot)
+        query = query.where(TasteSnapshot.user_id == user_id)
+        rows, next_cursor = await keyset_page(
+            session, query, SNAPSHOT_SORTS[sort], TasteSnapshot.id, limit, cursor
+        )
+        total = await count_rows(session, TasteSnapshot, user_id)
+    if fields == "summary":
+        snapshots = [
+            {
+                "id": row.id,
+                "movie_id": row.movie_id,
+                "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+                "mood": row.mood_tag,
+                "movie_title": row.movie_title,
+            }
+            for row in rows
+        ]
+    else:
+        snapshots = [serialize_snapshot(row[0]) for row in rows]
+    return snapshots, next_cursor, total
+
+# ---------- Export ----------
+EXPORT_COLUMNS = {
+    "watched": [
+        WatchedMovie.id, WatchedMovie.title, WatchedMovie.tmdb_id, WatchedMovie.user_rating,
+        WatchedMovie.liked, WatchedMovie.disliked, WatchedMovie.review, WatchedMovie.moods,
+        WatchedMovie.watch_date, Movie.release_year, Movie.genres, Movie.director, Movie.tmdb_rating,
+    ],
+    "waiting": [
+        WaitingMovie.id, WaitingMovie.title, WaitingMovie.tmdb_id, WaitingMovie.added_date,
+        Movie.release_year, Movie.genres, Movie.director, Movie.tmdb_rating,
+    ],
+    "snapshots": [
+        TasteSnapshot.id, TasteSnapshot.movie_id, TasteSnapshot.timestamp, TasteSnapshot.action_type,
+        TasteSnapshot.mood_tag, TasteSnapshot.movie_title, TasteSnapshot.gpt_comment,
+    ],
+}
+EXPORT_MODELS = {"watched": WatchedMovie, "waiting": WaitingMovie, "snapshots": TasteSnapshot}
+
+def export_fields(kind: str) -> list[str]:
+    return [column.key for column in EXPORT_COLUMNS[kind]]
+
+def _export_dict(row) -> dict:
+    data = {
+        key: value.isoformat() if isinstance(value, (date, datetime)) else value
+        for key, value in row._mapping.items()
     }
+    if "tmdb_id" in data:
+        data["tmdb_id"] = public_tmdb_id(data["tmdb_id"])
+    return data
 
-    existing = await session.execute(
-    select(WatchedMovie).where(
-        WatchedMovie.user_id == user_id,
-        WatchedMovie.tmdb_id == movie_data["tmdb_id"]
-    )
-)
-    if existing.scalar():
-        return
+async def stream_export(user_id: int, kind: str):
+    """Yield the user's rows of one kind as lists of dicts, EXPORT_CHUNK_ROWS at a time.
 
-    session.add(WatchedMovie(**full_data))
+    Plain columns (no ORM objects) read through a server-side cursor, so
+    memory stays flat however long the history is.
+    """
+    model = EXPORT_MODELS[kind]
+    query = select(*EXPORT_COLUMNS[kind])
+    if kind != "snapshots":
+        query = query.outerjoin(Movie, model.movie)
+    query = (
+        query.where(model.user_id == user_id)
+        .order_by(model.id)
+        .execution_options(yield_per=EXPORT_CHUNK_ROWS)
+    )
+    async with async_session() as session:
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            yield [_export_dict(row) for row in partition]
 
 # ---------- Dependency ----------
-from contextlib import asynccontextmanager
-
 async def get_db() -> AsyncSession:
     async with async_session() as session:
         yield session
\ No newline at end of file
@@ -0,0 +1,349 @@
+# backend/importer.py
+import os
+import csv
+import codecs
+import asyncio
+from collections import Counter
+from datetime import date, datetime
+from database import async_session, bulk_add_watched
+from models import TasteSnapshot
+from tmdb import fetch_movie_info, find_by_imdb_id
+from ratelimit import UpstreamUnavailable, upstream_priority, PRIORITY_BACKGROUND
+from recommend import normalize
+from cache import bump_user_version
+from search_index import search_index
+from worker import taste_scheduler
+
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", "8"))  # parallel TMDB lookups per import
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "200"))  # rows per bulk insert
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "10000"))
+IMPORT_PROGRESS_SECONDS = 0.5
+UNRESOLVED_REPORTED = 50
+
+SOURCE_NAMES = {"letterboxd": "Letterboxd", "imdb": "IMDb"}
+
+
+# ---------- CSV parsing ----------
+class CSVRecordReader:
+    """Incremental CSV parser: feed() raw byte chunks, get back the records completed so far.
+
+    A quoted field may span lines (Letterboxd reviews do), so lines are held
+    back until their quotes balance.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        self._buffer = ""
+        self._lines = []
+        self._quotes = 0
+
+    def feed(self, chunk: bytes, final: bool = False) -> list[list[str]]:
+        self._buffer += self._decoder.decode(chunk, final)
+        *lines, self._buffer = self._buffer.split("\n")
+        if final:
+            lines.append(self._buffer)
+            self._buffer = ""
+
+        records = []
+        for line in lines:
+            line = line.rstrip("\r")
+            self._lines.append(line)
+            self._quotes += line.count('"')
+            if self._quotes % 2:
+                continue  # still inside a quoted field
+            text = "\n".join(self._lines)
+            self._lines, self._quotes = [], 0
+            if text.strip():
+                records.extend(csv.reader([text]))
+        return records
+
+
+def detect_format(header: list[str]) -> str:
+    columns = set(header)
+    if "const" in columns and "title" in columns:
+        return "imdb"
+    if "name" in columns and "year" in columns:
+        return "letterboxd"
+    raise ValueError("Unrecognised CSV: expected a Letterboxd export (Name, Year, ...) or an IMDb export (Const, Title, ...)")
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _date(value):
+    try:
+        return date.fromisoformat((value or "")[:10])
+    except ValueError:
+        return None
+
+def parse_row(source: str, row: dict) -> dict | None:
+    """One CSV row -> {"title", "year", "imdb_id", "user_rating", "review", "watch_date"}; None to skip it."""
+    if source == "letterboxd":
+        title = (row.get("name") or "").strip()
+        rating = _float(row.get("rating"))
+        entry = {
+            "title": title,
+            "year": _int(row.get("year")),
+            "imdb_id": None,
+            "user_rating": rating * 2 if rating is not None else None,  # 0.5–5 stars -> 1–10
+            "review": (row.get("review") or "").strip() or None,
+            "watch_date": _date(row.get("watched date") or row.get("date")),
+        }
+    else:
+        title_type = (row.get("title type") or "movie").lower()
+        if "movie" not in title_type:
+            return None  # series, episodes, games
+        title = (row.get("title") or "").strip()
+        const = (row.get("const") or "").strip()
+        entry = {
+            "title": title,
+            "year": _int(row.get("year")),
+            "imdb_id": const if const.startswith("tt") else None,
+            "user_rating": _float(row.get("your rating")),
+            "review": None,
+            "watch_date": _date(row.get("date rated")),
+        }
+    return entry if entry["title"] else None
+
+
+def import_snapshot_text(source: str, movies: list[dict]) -> str:
+    """Plain-text digest of an import, written locally instead of one LLM comment per film."""
+    rated = sorted(
+        (m for m in movies if m.get("user_rating") is not None),
+        key=lambda m: m["user_rating"],
+        reverse=True,
+    )
+    genres = Counter(g.strip() for m in movies for g in (m.get("genres") or "").split(",") if g.strip())
+    directors = Counter(m["director"] for m in movies if m.get("director"))
+
+    parts = [f"Imported {len(movies)} films from {SOURCE_NAMES[source]}."]
+    if rated:
+        parts.append("Highest rated: " + ", ".join(f"{m['title']} ({m['user_rating']:g}/10)" for m in rated[:5]) + ".")
+        lowest = [m for m in reversed(rated) if m["user_rating"] <= 4][:3]
+        if lowest:
+            parts.append("Lowest rated: " + ", ".join(f"{m['title']} ({m['user_rating']:g}/10)" for m in lowest) + ".")
+    if genres:
+        parts.append("Most watched genres: " + ", ".join(g for g, _ in genres.most_common(5)) + ".")
+    recurring = [d for d, n in directors.most_common(3) if n > 1]
+    if recurring:
+        parts.append("Recurring directors: " + ", ".join(recurring) + ".")
+    return " ".join(parts)
+
+
+# ---------- Import job ----------
+class WatchHistoryImport:
+    """One user's CSV import.
+
+    Rows are parsed as the upload arrives and each distinct film starts its
+    TMDB lookup right away (IMPORT_CONCURRENCY at a time, at background
+    priority, through the cached fetch_movie_info path). run() runs while
+    the upload is still being fed: it collects the lookups, writes resolved
+    films IMPORT_BATCH_SIZE at a time and yields progress events. At the end
+    one "import" snapshot is written and a single taste-summary
+    regeneration is queued, instead of a snapshot comment per film.
+    """
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.reader = CSVRecordReader()
+        self.header = None
+        self.source = None
+        self.counts = Counter()
+        self.unresolved = []
+        self._entries = {}  # dedupe key -> entry (diary files list rewatches)
+        self._tasks = set()
+        self._new_tasks = []  # started since run() last looked
+        self._wakeup = asyncio.Event()
+        self.input_done = False
+        self._error = None
+        self._semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+        self._ready = []  # resolved films waiting for the next batch insert
+        self._seen_tmdb_ids = set()
+        self._imported = []
+        self._rate_limited = None
+        self._finished = False
+
+    # ---------- Input ----------
+    def feed(self, chunk: bytes, final: bool = False):
+        """Parse a chunk of the upload. Raises ValueError for unusable files."""
+        for fields in self.reader.feed(chunk, final):
+            if self.header is None:
+                self.header = [f.strip().lower() for f in fields]
+                self.source = detect_format(self.header)
+                continue
+            self._add_row(dict(zip(self.header, fields)))
+        if final:
+            if self.header is None:
+                raise ValueError("The file is empty")
+            self.input_done = True
+            self._wakeup.set()
+
+    def fail(self, error: Exception):
+        """The upload went wrong part-way (e.g. too many rows): run() stops and raises it."""
+        self._error = error
+        self.input_done = True
+        self._wakeup.set()
+
+    def _add_row(self, row: dict):
+        self.counts["rows"] += 1
+        if self.counts["rows"] > IMPORT_MAX_ROWS:
+            raise ValueError(f"Imports are limited to {IMPORT_MAX_ROWS} rows")
+        entry = parse_row(self.source, row)
+        if entry is None:
+            self.counts["skipped"] += 1
+            return
+
+        key = entry["imdb_id"] or (normalize(entry["title"]), entry["year"])
+        existing = self._entries.get(key)
+        if existing is not None:
+            # 重看记录合并成一行：后出现的非空字段覆盖前面的（已写入的批次不再改）
+            self.counts["duplicates"] += 1
+            for field in ("user_rating", "review", "watch_date"):
+                if entry[field] is not None:
+                    existing[field] = entry[field]
+            return
+        self._entries[key] = entry
+        task = asyncio.create_task(self._resolve(entry))
+        self._tasks.add(task)
+        self._new_tasks.append(task)
+        self._wakeup.set()
+
+    async def _resolve(self, entry: dict):
+        upstream_priority.set(PRIORITY_BACKGROUND)
+        try:
+            async with self._semaphore:
+                info = None
+                if entry["imdb_id"]:
+                    info = await find_by_imdb_id(entry["imdb_id"])
+                if info is None:
+                    info = await fetch_movie_info(entry["title"], entry["year"])
+            return entry, info, None
+        except Exception as e:
+            return entry, None, e
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+    # ---------- Processing ----------
+    async def run(self):
+        """Yield progress events until the upload has ended and every row is resolved
+        and written, then a "done" event."""
+        loop = asyncio.get_running_loop()
+        pending = set()
+        last_progress = loop.time()
+        try:
+            yield self._progress("started")
+            while True:
+                self._wakeup.clear()
+                pending.update(self._new_tasks)
+                self._new_tasks.clear()
+                if self._error is not None:
+                    raise self._error
+                if pending:
+                    done, pending = await asyncio.wait(
+                        pending, timeout=IMPORT_PROGRESS_SECONDS, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        self._collect(*task.result())
+                elif self.input_done:
+                    break
+                else:
+                    # 上传还没结束，等新的行进来
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), IMPORT_PROGRESS_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                if len(self._ready) >= IMPORT_BATCH_SIZE:
+                    await self._flush()
+                if loop.time() - last_progress >= IMPORT_PROGRESS_SECONDS:
+                    last_progress = loop.time()
+                    yield self._progress()
+            await self._flush()
+            await self._finish()
+            event = self._progress("done")
+            event["unresolved_titles"] = self.unresolved
+            if self._rate_limited is not None:
+                event["detail"] = self._rate_limited.detail
+            yield event
+        finally:
+            self.cancel()
+            if self._imported and not self._finished:
+                # 客户端中途断开：已写入的部分照样更新画像
+                taste_scheduler.enqueue_summary(self.user_id, rebuild_vector=True)
+
+    def _collect(self, entry: dict, info: dict | None, error: Exception | None):
+        label = f"{entry['title']} ({entry['year']})" if entry["year"] else entry["title"]
+        if error is not None:
+            self.counts["failed"] += 1
+            if isinstance(error, UpstreamUnavailable):
+                self._rate_limited = error
+            else:
+                print(f"[import] lookup failed for {label}: {error}")
+        elif not info or info.get("tmdb_id") is None:
+            self.counts["unresolved"] += 1
+        else:
+            self.counts["resolved"] += 1
+            if info["tmdb_id"] in self._seen_tmdb_ids:
+                self.counts["duplicates"] += 1
+                return
+            self._seen_tmdb_ids.add(info["tmdb_id"])
+            self._ready.append({**info, **{k: entry[k] for k in ("user_rating", "review", "watch_date")}})
+            return
+        if len(self.unresolved) < UNRESOLVED_REPORTED:
+            self.unresolved.append(label)
+
+    async def _flush(self):
+        while self._ready:
+            batch, self._ready = self._ready[:IMPORT_BATCH_SIZE], self._ready[IMPORT_BATCH_SIZE:]
+            async with async_session() as session:
+                added = set(await bulk_add_watched(session, self.user_id, batch))
+                await session.commit()
+            bump_user_version(self.user_id, "list")
+            self.counts["imported"] += len(added)
+            self.counts["already_listed"] += len(batch) - len(added)
+            for movie in batch:
+                if movie["tmdb_id"] in added:
+                    self._imported.append(movie)
+                    search_index.add(movie["tmdb_id"], movie["title"], movie.get("poster"))
+                    search_index.boost(movie["tmdb_id"])
+
+    async def _finish(self):
+        self._finished = True
+        if not self._imported:
+            return
+        async with async_session() as session:
+            session.add(TasteSnapshot(
+                user_id=self.user_id,
+                movie_id=None,
+                action_type="import",
+                movie_title=None,
+                gpt_comment=import_snapshot_text(self.source, self._imported),
+                timestamp=datetime.utcnow(),
+            ))
+            await session.commit()
+        # 向量整体重建 + 只生成一次 summary
+        taste_scheduler.enqueue_summary(self.user_id, rebuild_vector=True)
+
+    def _progress(self, event_type: str = "progress") -> dict:
+        return {
+            "type": event_type,
+            "source": self.source,
+            "rows": self.counts["rows"],
+            "films": len(self._entries),
+            "resolved": self.counts["resolved"],
+            "unresolved": self.counts["unresolved"],
+            "failed": self.counts["failed"],
+            "imported": self.counts["imported"],
+            "already_listed": self.counts["already_listed"],
+            "duplicates": self.counts["duplicates"],
+            "skipped": self.counts["skipped"],
+        }
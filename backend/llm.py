@@ -0,0 +1,235 @@
+# backend/llm.py
+import os
+import json
+import random
+import hashlib
+import asyncio
+import openai
+from datetime import datetime, timedelta
+from openai import AsyncOpenAI
+from cache import TTLCache
+from singleflight import SingleFlight
+from cassette import cassette
+from metrics import track_upstream, record_tokens, background
+from ratelimit import RateLimiter, UpstreamUnavailable, parse_retry_after
+from database import async_session
+from models import LLMCacheEntry
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))  # per attempt, seconds
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "5"))  # requests per second
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+LLM_RETRY_DEADLINE = float(os.getenv("LLM_RETRY_DEADLINE", "60"))  # seconds, including waits
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "1") == "1"  # also keep outputs in the llm_cache table
+
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+llm_limiter = RateLimiter("openai", rate=LLM_RATE_LIMIT, burst=LLM_BURST)
+
+
+class LLMClient:
+    """Shared async OpenAI client.
+
+    Every chat completion goes through here so model calls never block the
+    event loop, each attempt has a timeout, at most LLM_MAX_INFLIGHT calls
+    run at once, and transient failures are retried with backoff.
+    """
+
+    def __init__(self):
+        self._client: AsyncOpenAI | None = None
+        self._semaphore = asyncio.Semaphore(LLM_MAX_INFLIGHT)
+        self.cache = TTLCache("llm", maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+        self.db_hits = 0
+        self.bypasses = 0
+        self._pending_writes = set()
+        self._flights = SingleFlight("llm")
+
+    async def start(self):
+        if self._client is not None:
+            return
+        if not os.getenv("OPENAI_API_KEY"):
+            # 没有 key 也要能启动（登录、列表、搜索不依赖 OpenAI）；AI 调用各自报错
+            print("⚠️ OPENAI_API_KEY is not set, AI features will fail until it is")
+            return
+        self._client = self._new_client()
+
+    def _new_client(self) -> AsyncOpenAI:
+        # retries are handled below so they respect the in-flight limit
+        return AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=LLM_TIMEOUT,
+            max_retries=0,
+        )
+
+    async def close(self):
+        if self._pending_writes:
+            await asyncio.gather(*self._pending_writes, return_exceptions=True)
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def chat(
+        self,
+        prompt: str,
+        *,
+        temperature: float = 0.7,
+        model: str | None = None,
+        timeout: float | None = None,
+        cache: bool = True,
+        site: str = "other",
+    ) -> str:
+        """Chat completion for a single user prompt.
+
+        Identical (model, prompt, temperature) requests are answered from the
+        content-addressed cache. cache=False skips the lookup for callers that
+        need a fresh answer; the new output still replaces the cached one.
+        `site` names the caller in /metrics (latency, errors, tokens).
+        """
+        model = model or LLM_MODEL
+        key = prompt_key(model, prompt, temperature)
+
+        if cache:
+            content = self.cache.get(key)
+            if content is not None:
+                return content
+            content = await self._load_persisted(key)
+            if content is not None:
+                self.db_hits += 1
+                self.cache.set(key, content)
+                return content
+        else:
+            self.bypasses += 1
+
+        # identical prompts already in flight share one completion
+        return await self._flights.do(key, self._complete_and_store, key, prompt, temperature, model, timeout, site)
+
+    async def _complete_and_store(self, key, prompt, temperature, model, timeout, site) -> str:
+        content = await self._complete(prompt, temperature, model, timeout, site)
+        self.cache.set(key, content)
+        if LLM_CACHE_PERSIST:
+            task = asyncio.create_task(background(self._persist(key, model, content)))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+        return content
+
+    def evict(self, prompt: str, *, temperature: float = 0.7, model: str | None = None):
+        """Drop a cached output, e.g. when the caller could not parse it."""
+        key = prompt_key(model or LLM_MODEL, prompt, temperature)
+        self.cache.pop(key)
+        if LLM_CACHE_PERSIST:
+            task = asyncio.create_task(background(self._delete_persisted(key)))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+
+    async def _complete(self, prompt, temperature, model, timeout, site) -> str:
+        if self._client is None:
+            self._client = self._new_client()  # raises OpenAIError while the key is missing
+
+        timeout = timeout or LLM_TIMEOUT
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + LLM_RETRY_DEADLINE
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await llm_limiter.acquire(deadline)
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    with track_upstream("openai", site):
+                        return await asyncio.wait_for(
+                            cassette.exchange(
+                                "openai", prompt_key(model, prompt, temperature),
+                                self._create, prompt, temperature, model, site,
+                                request=prompt[:200],
+                            ),
+                            timeout,
+                        )
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, openai.RateLimitError):
+                    retry_after = parse_retry_after(e.response.headers.get("retry-after"))
+                    llm_limiter.penalize(retry_after)
+                delay = LLM_BACKOFF_BASE * (2 ** attempt) * (1 + random.random())
+                out_of_time = loop.time() + max(delay, retry_after or 0) >= deadline
+                if attempt >= LLM_MAX_RETRIES or out_of_time:
+                    if isinstance(e, openai.RateLimitError):
+                        raise UpstreamUnavailable("OpenAI", retry_after)
+                    raise
+                print(f"[llm] {type(e).__name__}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _create(self, prompt, temperature, model, site) -> str:
+        response = await self._client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+        )
+        record_tokens(site, response.usage)
+        return response.choices[0].message.content.strip()
+
+    # ---------- Persistent tier ----------
+    async def _load_persisted(self, key: str):
+        if not LLM_CACHE_PERSIST:
+            return None
+        try:
+            async with async_session() as session:
+                row = await session.get(LLMCacheEntry, key)
+        except Exception as e:
+            print("[llm cache] read failed:", e)
+            return None
+        if row is None or row.created_at < datetime.utcnow() - timedelta(seconds=LLM_CACHE_TTL):
+            return None
+        return row.response
+
+    async def _persist(self, key: str, model: str, content: str):
+        try:
+            async with async_session() as session:
+                await session.merge(LLMCacheEntry(
+                    key=key,
+                    model=model,
+                    response=content,
+                    created_at=datetime.utcnow(),
+                ))
+                await session.commit()
+        except Exception as e:
+            print("[llm cache] write failed:", e)
+
+    async def _delete_persisted(self, key: str):
+        try:
+            async with async_session() as session:
+                row = await session.get(LLMCacheEntry, key)
+                if row is not None:
+                    await session.delete(row)
+                    await session.commit()
+        except Exception as e:
+            print("[llm cache] delete failed:", e)
+
+    def cache_stats(self):
+        stats = self.cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "db_hits": self.db_hits,
+            "bypasses": self.bypasses,
+            # memory + db hits over all cached lookups
+            "overall_hit_ratio": round((stats["hits"] + self.db_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def prompt_key(model: str, prompt: str, temperature: float) -> str:
+    payload = json.dumps(
+        {"model": model, "messages": [{"role": "user", "content": prompt}], "temperature": temperature},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+llm_client = LLMClient()
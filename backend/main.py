@@ -1,46 +1,81 @@
-from fastapi import FastAPI, HTTPException, Body, Query
+from fastapi import FastAPI, HTTPException, Body, Query, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from auth import get_current_user
 from models import User
 from fastapi import Depends
-import openai
-import re
 import os
+import io
+import csv
+import copy
 import json
 import asyncio
-import aiohttp
 from sqlalchemy import select, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
-import httpx
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from auth import router as auth_router
-from typing import Optional
-from ai import generate_snapshot_comment, regenerate_taste_summary
+from typing import Optional, Literal
+from worker import taste_scheduler
+from tmdb import tmdb_client, fetch_movie_info, get_movie_detail_by_id, enrich_candidates, iter_enriched
+from cache import cache_stats, bump_user_version
+from singleflight import singleflight_stats
+from ratelimit import UpstreamUnavailable, ratelimit_stats
+from cassette import cassette
+from metrics import MetricsMiddleware, instrument_engine, render as render_metrics
+from query_profiler import query_profiler
+from importer import WatchHistoryImport
+from recommend import (
+    RECOMMEND_COUNT,
+    recommendation_cache,
+    recommendation_cache_key,
+    get_guest_candidates,
+    load_user_context,
+    build_user_prompt,
+    iter_user_candidate_batches,
+    guest_fast_context,
+    get_fast_recommendations,
+    RECOMMEND_PIPELINE,
+    RECOMMEND_OVERGENERATE,
+    get_ranked_recommendations,
+    get_user_candidates_once,
+    stash_recommendations,
+    stash_cursor,
+    next_from_stash,
+    exclusion_filter,
+)
+from taste_vector import rank_candidates
+from search_index import search_index, poster_url
+from llm import llm_client
 from database import (
     async_session,
     init_db,
     get_db,
     get_watched_movies,
     get_waiting_movies,
+    get_snapshot_history,
     add_to_watched,
     add_to_waiting,
     move_to_watched,
+    stream_export,
+    export_fields,
 )
 from models import WatchedMovie, WaitingMovie, TasteSnapshot, TasteSummary
 
-# Set OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("🌱 Initializing DB...")
     await init_db()
     print("✅ DB Ready.")
+    await search_index.build()
+    await tmdb_client.start()
+    await llm_client.start()
     yield
     print("🧹 Cleanup if needed.")
+    await taste_scheduler.stop()
+    await tmdb_client.close()
+    await llm_client.close()
 
 app = FastAPI(lifespan=lifespan)
 from database import engine
@@ -59,13 +94,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count"],
 )
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
 
 # ---------- Pydantic Models ----------
 class MoodInput(BaseModel):
     mood: str
-    mode: Optional[str] = None  # "include_waiting"
+    mode: Optional[str] = None  # "include_waiting", or "fast" to rank TMDB picks locally without the LLM
     user_id: Optional[int] = None
+    fresh: bool = False  # skip cached LLM output
+    cursor: Optional[str] = None  # next_cursor from a previous response: serve the next page
 
 class AddMovieInput(BaseModel):
     title: str
@@ -80,275 +120,250 @@ class AddMovieInput(BaseModel):
 
 class UpdateSummaryInput(BaseModel):
     feedback: str
-# ---------- TMDB Movie Info Helper ----------
-def parse_title_and_year(raw_title):
-    match = re.match(r"(.+)\s+\((\d{4})\)", raw_title)
-    if match:
-        return match.group(1).strip(), int(match.group(2))
-    return raw_title.strip(), None
-
-async def get_movie_detail_by_id(tmdb_id: int):
-    import os
-    import aiohttp
-    from fastapi import HTTPException
-
-    api_key = os.getenv("TMDB_API_KEY")
-    base_url = "https://api.themoviedb.org/3"
-
-    async with aiohttp.ClientSession() as session:
-        # 获取电影详情
-        async with session.get(f"{base_url}/movie/{tmdb_id}", params={"api_key": api_key}) as detail_resp:
-            if detail_resp.status != 200:
-                raise HTTPException(status_code=500, detail="TMDB API detail error")
-            detail = await detail_resp.json()
-
-        # 获取导演
-        async with session.get(f"{base_url}/movie/{tmdb_id}/credits", params={"api_key": api_key}) as credit_resp:
-            if credit_resp.status != 200:
-                raise HTTPException(status_code=500, detail="TMDB API credit error")
-            credits = await credit_resp.json()
-
-        director = next((c["name"] for c in credits.get("crew", []) if c.get("job") == "Director"), None)
-
-        return {
-            "title": detail.get("title"),
-            "description": detail.get("overview", ""),
-            "poster": f'https://image.tmdb.org/t/p/w500{detail.get("poster_path")}' if detail.get("poster_path") else "",
-            "backdrop": f'https://image.tmdb.org/t/p/w780{detail.get("backdrop_path")}' if detail.get("backdrop_path") else "",
-            "tmdb_rating": detail.get("vote_average"),
-            "tmdb_id": tmdb_id,
-            "release_year": int(detail.get("release_date", "0000")[:4]) if detail.get("release_date") else None,
-            "genres": ", ".join([g["name"] for g in detail.get("genres", [])]),
-            "director": director,
-        }
-    
-async def fetch_movie_info(title: str, year_hint: int | None = None):
-    api_key = os.getenv("TMDB_API_KEY")
-    base_url = "https://api.themoviedb.org/3"
-    search_url = f"{base_url}/search/movie"
-
-    params = {"api_key": api_key, "query": title}
-    if year_hint:
-        params["year"] = year_hint
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(search_url, params=params) as resp:
-            if resp.status != 200:
-                raise HTTPException(status_code=500, detail="TMDB API search error")
-            data = await resp.json()
-            candidates = data.get("results", [])
-
-            if not candidates:
-                return {
-                    "title": title,
-                    "description": "Not found",
-                    "poster": "",
-                    "backdrop": "",
-                    "tmdb_rating": None,
-                    "tmdb_id": None,
-                    "release_year": None,
-                    "genres": "",
-                    "director": "",
-                }
-
-            # 🎯 筛选年份匹配 ±5 的候选
-            filtered = []
-            for movie in candidates:
-                try:
-                    year = int(movie.get("release_date", "0000")[:4])
-                except:
-                    year = 0
-                if year_hint and abs(year - year_hint) > 5:
-                    continue
-                if not movie.get("poster_path") or movie.get("vote_count", 0) < 10:
-                    continue
-                filtered.append((movie, year))
-
-            # ✅ 使用 filtered，如果没有就 fallback 用 candidates
-            best_movie = None
-            if filtered:
-                best_movie = sorted(
-                    filtered,
-                    key=lambda m: (m[0].get("vote_count", 0), m[0].get("popularity", 0)),
-                    reverse=True
-                )[0][0]
-            else:
-                best_movie = candidates[0]
-
-            movie_id = best_movie["id"]
-
-        # 🔍 获取 /movie/{id}
-        async with session.get(f"{base_url}/movie/{movie_id}", params={"api_key": api_key}) as detail_resp:
-            if detail_resp.status != 200:
-                raise HTTPException(status_code=500, detail="TMDB API detail error")
-            detail = await detail_resp.json()
-
-        # 🎬 获取 /movie/{id}/credits（拿导演）
-        async with session.get(f"{base_url}/movie/{movie_id}/credits", params={"api_key": api_key}) as credit_resp:
-            if credit_resp.status != 200:
-                raise HTTPException(status_code=500, detail="TMDB API credit error")
-            credits = await credit_resp.json()
-
-        director = next((c["name"] for c in credits.get("crew", []) if c.get("job") == "Director"), None)
-        return {
-            "title": detail.get("title"),
-            "description": detail.get("overview", ""),
-            "poster": f"https://image.tmdb.org/t/p/w500{detail.get('poster_path')}" if detail.get("poster_path") else "",
-            "backdrop": f"https://image.tmdb.org/t/p/w780{detail.get('backdrop_path')}" if detail.get("backdrop_path") else "",
-            "tmdb_rating": detail.get("vote_average"),
-            "tmdb_id": movie_id,
-            "release_year": int(detail.get("release_date", "0000")[:4]) if detail.get("release_date") else None,
-            "genres": ", ".join([g["name"] for g in detail.get("genres", [])]),
-            "director": director,
-        }
-
 # ---------- Routes ----------
 
-def normalize(title):
-    return re.sub(r"[^\w\s]", "", title.lower().strip())
-
 @app.post("/recommend")
 async def recommend_movies(data: MoodInput, db: AsyncSession = Depends(get_db)):
-    def normalize_titles(titles):
-        return set(normalize(t) for t in titles if t)
-
-    async def get_filtered_recommendations(prompt, watched_set, waiting_set, has_summary):
-        for _ in range(3):  # retry up to 3 times
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-            )
-            raw_content = response.choices[0].message.content.strip()
-
-            try:
-                recommendations = json.loads(raw_content)
-            except json.JSONDecodeError:
-                continue
-
-            result = []
-            seen_titles = watched_set.union(waiting_set)
-
-            for item in recommendations:
-                title_raw = item.get("title", "")
-                norm_title = normalize(title_raw)
-                if not norm_title or norm_title in seen_titles:
-                    continue
-                year = item.get("year")
-                if not isinstance(year, int):
-                    year = None
-                reason = item.get("reason", "") if has_summary else ""
-                info = await fetch_movie_info(title_raw, year)
-                if info:
-                    info["reason"] = reason
-                    result.append(info)
-                if len(result) >= 3:
-                    break
-
-            if result:
-                return result
-
-        return []
-
     try:
         # === Guest Mode ===
         if data.user_id is None:
-            prompt = (
-                f"Return ONLY a JSON array of 3 movie titles that match user's input: '{data.mood}'. "
-                "Each item must include title and approximate release year. "
-                "Format: [\"Up (2009)\", \"La La Land (2016)\", \"Her (2013)\"]"
-            )
-
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-            )
-            raw_content = response.choices[0].message.content.strip()
-
-            try:
-                titles = json.loads(raw_content)
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=500, detail=f"Invalid JSON:\n{raw_content}")
-
-            movie_details = []
-            for raw_title in titles:
-                title, year = parse_title_and_year(raw_title)
-                info = await fetch_movie_info(title, year)
-                if info:
-                    info["reason"] = ""  # no insight in guest mode
-                    movie_details.append(info)
-
+            if data.mode == "fast":
+                return {"recommendations": await get_fast_recommendations(guest_fast_context(), data.mood)}
+            candidates = await get_guest_candidates(data.mood, fresh=data.fresh)
+            movie_details = await enrich_candidates(candidates, limit=RECOMMEND_COUNT)
             return {"recommendations": movie_details}
 
         # === Logged-in User Mode ===
         user_id = data.user_id
 
-        watched_result = await db.execute(
-            select(WatchedMovie.title).where(WatchedMovie.user_id == user_id)
-        )
-        raw_watched_titles = [row[0] for row in watched_result.fetchall()]
-        watched_titles = normalize_titles(raw_watched_titles)
-
-        waiting_result = await db.execute(
-            select(WaitingMovie.title).where(WaitingMovie.user_id == user_id)
-        )
-        raw_waiting_titles = [row[0] for row in waiting_result.fetchall()]
-        waiting_titles = normalize_titles(raw_waiting_titles)
+        # "show more": 直接从上一轮剩下的候选里取，不调 LLM / TMDB
+        if data.cursor and not data.fresh:
+            stashed = next_from_stash(user_id, data.mood, data.mode, data.cursor)
+            if stashed is not None:
+                page, next_cursor = stashed
+                return {"recommendations": copy.deepcopy(page), "next_cursor": next_cursor}
+
+        cache_key = recommendation_cache_key(user_id, data.mood, data.mode)
+        if not data.fresh and not data.cursor:
+            cached = recommendation_cache.get(cache_key)
+            if cached is not None:
+                return {
+                    "recommendations": copy.deepcopy(cached),
+                    "next_cursor": stash_cursor(user_id, data.mood, data.mode),
+                }
 
-        summary_result = await db.execute(
-            select(TasteSummary.summary).where(TasteSummary.user_id == user_id)
-        )
-        taste_summary = summary_result.scalar()
-        has_summary = bool(taste_summary and taste_summary.strip())
-        if not has_summary:
-            taste_summary = "User has no summary yet."
-
-        # --- Build prompt ---
-        prompt = (
-            f"You are a personalized movie recommender.\n"
-            f"User's taste summary:\n{taste_summary}\n\n"
-            f"User query or mood: {data.mood}\n"
-            f"IMPORTANT: Do NOT recommend these watched titles:\n{raw_watched_titles}\n"
-        )
-        if raw_waiting_titles:
-            prompt += f"IMPORTANT: Do NOT recommend these waiting titles:\n{raw_waiting_titles}\n"
-
-        if has_summary:
-            prompt += (
-                "Return a JSON array of 3 items. Each item must contain:\n"
-                "- 'title': movie title\n"
-                "- 'year': approximate release year\n"
-                "- 'reason': short reason for recommendation\n"
-                "Example: [{\"title\": \"Inception\", \"year\": 2010, \"reason\": \"You enjoy sci-fi mind-bending plots.\"}]\n"
-            )
-        else:
-            prompt += (
-                "Return a JSON array of 3 items. Each item must contain only 'title' and 'year'.\n"
-                "Do not include 'reason'. Example: [{\"title\": \"Inception\", \"year\": 2010}]\n"
-            )
+        ctx = await load_user_context(db, user_id)
 
         # --- Fetch with filtering ---
-        filtered = await get_filtered_recommendations(
-            prompt, watched_titles, waiting_titles, has_summary
-        )
+        filtered = []
+        next_cursor = None
+        if data.mode == "fast":
+            filtered = await get_fast_recommendations(ctx, data.mood)
+        elif RECOMMEND_PIPELINE == "rank":
+            ranked = await get_ranked_recommendations(ctx, data.mood, fresh=data.fresh)
+            filtered = ranked[:RECOMMEND_COUNT]
+            next_cursor = stash_recommendations(user_id, data.mood, data.mode, ranked[RECOMMEND_COUNT:])
+        else:
+            prompt = build_user_prompt(ctx, data.mood)
+            async for candidates in iter_user_candidate_batches(prompt, ctx, fresh=data.fresh):
+                # 并发查询 TMDB，再按本地口味向量重排
+                filtered = rank_candidates(ctx["taste"], await enrich_candidates(candidates, limit=RECOMMEND_COUNT, accept=exclusion_filter(ctx)))
+                if filtered:
+                    break
+        if filtered:
+            recommendation_cache.set(cache_key, copy.deepcopy(filtered))
 
-        return {"recommendations": filtered}
+        return {"recommendations": filtered, "next_cursor": next_cursor}
 
+    except (UpstreamUnavailable, HTTPException):
+        raise  # 503 + Retry-After / 502 from a bad LLM batch
     except Exception as e:
         print("[recommend top-level error]:", repr(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+# ---------- Streaming variants ----------
+# NDJSON, one event per line:
+#   {"type": "movie", "rank": 0, "movie": {...}}   as soon as each card is enriched
+#   {"type": "done", "count": 3, "next_cursor": …} when nothing more is coming (logged-in runs)
+#   {"type": "error", "detail": "..."}             if the run failed part-way
+def ndjson_event(**event):
+    return json.dumps(event) + "\n"
+
+def _unsent(ctx):
+    # 按解析完成的顺序去重：同一部电影只发一次
+    excluded = exclusion_filter(ctx)
+    sent_ids = set()
+    def accept(info):
+        if not excluded(info) or info["tmdb_id"] in sent_ids:
+            return False
+        sent_ids.add(info["tmdb_id"])
+        return True
+    return accept
+
+async def _aiter(batches):
+    # candidate batches may be a plain list or an async generator
+    if hasattr(batches, "__aiter__"):
+        async for batch in batches:
+            yield batch
+    else:
+        for batch in batches:
+            yield batch
+
+@app.post("/recommend/stream")
+async def recommend_movies_stream(data: MoodInput):
+    async def events():
+        emitted = []
+        try:
+            # === Fast mode: nothing to stream incrementally ===
+            if data.mode == "fast":
+                if data.user_id is None:
+                    ctx = guest_fast_context()
+                else:
+                    async with async_session() as db:
+                        ctx = await load_user_context(db, data.user_id)
+                emitted = await get_fast_recommendations(ctx, data.mood)
+                for rank, info in enumerate(emitted):
+                    yield ndjson_event(type="movie", rank=rank, movie=info)
+                yield ndjson_event(type="done", count=len(emitted))
+                return
+
+            # === Guest Mode ===
+            if data.user_id is None:
+                candidates = await get_guest_candidates(data.mood, fresh=data.fresh)
+                async for rank, info in iter_enriched(candidates, limit=RECOMMEND_COUNT):
+                    emitted.append(info)
+                    yield ndjson_event(type="movie", rank=rank, movie=info)
+                yield ndjson_event(type="done", count=len(emitted))
+                return
+
+            # === Logged-in User Mode ===
+            user_id = data.user_id
+            stashed = None
+            if data.cursor and not data.fresh:
+                stashed = next_from_stash(user_id, data.mood, data.mode, data.cursor)
+            if stashed is not None:
+                page, next_cursor = stashed
+                for rank, info in enumerate(page):
+                    yield ndjson_event(type="movie", rank=rank, movie=info)
+                yield ndjson_event(type="done", count=len(page), next_cursor=next_cursor)
+                return
+
+            cache_key = recommendation_cache_key(user_id, data.mood, data.mode)
+            cached = None if data.fresh else recommendation_cache.get(cache_key)
+            if cached is not None:
+                for rank, info in enumerate(cached):
+                    yield ndjson_event(type="movie", rank=rank, movie=info)
+                yield ndjson_event(type="done", count=len(cached), next_cursor=stash_cursor(user_id, data.mood, data.mode))
+                return
+
+            # StreamingResponse 在依赖退出后才跑完，这里自己开 session
+            async with async_session() as db:
+                ctx = await load_user_context(db, user_id)
+            if RECOMMEND_PIPELINE == "rank":
+                # 一次 LLM 调用；流式场景下先解析完的先发，不等全部再排序
+                prompt = build_user_prompt(ctx, data.mood, count=RECOMMEND_OVERGENERATE)
+                batches = [await get_user_candidates_once(prompt, ctx, fresh=data.fresh)]
+            else:
+                prompt = build_user_prompt(ctx, data.mood)
+                batches = iter_user_candidate_batches(prompt, ctx, fresh=data.fresh)
+
+            surplus = []
+            async for candidates in _aiter(batches):
+                ranked = []
+                # rank 模式把剩下的候选也解析完，留给 "show more"；前 RECOMMEND_COUNT 个照样先发
+                limit = len(candidates) if RECOMMEND_PIPELINE == "rank" else RECOMMEND_COUNT
+                async for rank, info in iter_enriched(candidates, limit=limit, accept=_unsent(ctx)):
+                    if len(ranked) < RECOMMEND_COUNT:
+                        ranked.append((rank, info))
+                        yield ndjson_event(type="movie", rank=rank, movie=info)
+                    else:
+                        surplus.append(info)
+                if ranked:
+                    emitted = rank_candidates(ctx["taste"], [info for _, info in sorted(ranked, key=lambda p: p[0])])
+                    recommendation_cache.set(cache_key, copy.deepcopy(emitted))
+                    break
+            # 每次新结果都覆盖旧的暂存，之后命中缓存时的 next_cursor 才对得上这一轮
+            next_cursor = stash_recommendations(user_id, data.mood, data.mode, rank_candidates(ctx["taste"], surplus))
+            yield ndjson_event(type="done", count=len(emitted), next_cursor=next_cursor)
+
+        except Exception as e:
+            print("[recommend stream error]:", repr(e))
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield ndjson_event(type="error", detail=detail)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.post("/search/stream")
+async def search_movies_stream(data: MoodInput):
+    async def events():
+        count = 0
+        try:
+            params = {
+                "query": data.mood,
+                "language": "en-US",
+                "page": 1,
+            }
+            status, result = await tmdb_client.get_cached("/search/movie", params)
+            if status != 200:
+                raise HTTPException(status_code=500, detail="TMDB search failed")
+            search_index.add_results(result.get("results", []))
+
+            # 搜索结果自带 id，直接按 id 取详情
+            candidates = [{"title": m.get("title"), "tmdb_id": m.get("id")} for m in result.get("results", [])[:3]]
+
+            async for rank, info in iter_enriched(candidates, limit=3):
+                info.pop("reason", None)
+                count += 1
+                yield ndjson_event(type="movie", rank=rank, movie=info)
+            yield ndjson_event(type="done", count=count)
+
+        except Exception as e:
+            print(f"[search stream error]: {e}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield ndjson_event(type="error", detail=detail)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+# ---------- Paged lists ----------
+# limit 不传时返回整个列表（前端现在就是这么用的）；传了就按 cursor 翻页
+LIST_PAGE_MAX = int(os.getenv("LIST_PAGE_MAX", "200"))
+
+async def paged(response: Response, fetch, user_id: int, limit, cursor, sort, fields):
+    try:
+        items, next_cursor, total = await fetch(user_id, limit, cursor, sort, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers["X-Total-Count"] = str(total)
+    return items, next_cursor
+
 @app.get("/watched-list")
-async def get_watched(user: User = Depends(get_current_user)):
-    return {"movies": await get_watched_movies(user.id)}
+async def get_watched(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    cursor: Optional[str] = None,
+    sort: Literal["id", "-id", "watch_date", "-watch_date"] = "id",
+    fields: Literal["full", "summary"] = "full",
+    user: User = Depends(get_current_user),
+):
+    movies, next_cursor = await paged(response, get_watched_movies, user.id, limit, cursor, sort, fields)
+    return {"movies": movies, "next_cursor": next_cursor}
 
 @app.get("/waiting-list")
-async def get_waiting(user: User = Depends(get_current_user)):
-    return {"movies": await get_waiting_movies(user.id)}
+async def get_waiting(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    cursor: Optional[str] = None,
+    sort: Literal["id", "-id"] = "id",
+    fields: Literal["full", "summary"] = "full",
+    user: User = Depends(get_current_user),
+):
+    movies, next_cursor = await paged(response, get_waiting_movies, user.id, limit, cursor, sort, fields)
+    return {"movies": movies, "next_cursor": next_cursor}
 
 @app.get("/taste-summary")
 async def get_taste_summary(user: User = Depends(get_current_user)):
+    # "pending": a snapshot/summary rebuild is queued or running for this user
+    status = "pending" if taste_scheduler.is_pending(user.id) else "ready"
     async with async_session() as session:
         result = await session.execute(
             select(TasteSummary).where(TasteSummary.user_id == user.id)
@@ -365,35 +380,82 @@ async def get_taste_summary(user: User = Depends(get_current_user)):
 
             return {
                 "summary": summary.summary,
-                "highlight_titles": highlight_titles
+                "highlight_titles": highlight_titles,
+                "status": status,
             }
         else:
             return {
                 "summary": "",
-                "highlight_titles": []
+                "highlight_titles": [],
+                "status": status,
             }
 
 @app.get("/snapshot-history")
-async def get_snapshot_history(user: User = Depends(get_current_user)):
-    async with async_session() as session:
-        result = await session.execute(
-            select(TasteSnapshot)
-            .where(TasteSnapshot.user_id == user.id)
-            .order_by(TasteSnapshot.timestamp.desc())
-        )
-        snapshots = result.scalars().all()
-        return {
-            "snapshots": [
-                {   "id": s.id,
-                    "movie_id": s.movie_id,
-                    "timestamp": s.timestamp.isoformat() if s.timestamp else None,
-                    "mood": s.mood_tag,
-                    "comment": s.gpt_comment,
-                    "movie_title": s.movie_title,
-                }
-                for s in snapshots
-            ]
-        }
+async def get_snapshot_history_page(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    cursor: Optional[str] = None,
+    sort: Literal["-timestamp", "timestamp"] = "-timestamp",
+    fields: Literal["full", "summary"] = "full",
+    user: User = Depends(get_current_user),
+):
+    snapshots, next_cursor = await paged(response, get_snapshot_history, user.id, limit, cursor, sort, fields)
+    return {"snapshots": snapshots, "next_cursor": next_cursor}
+
+EXPORT_KINDS = ["watched", "waiting", "snapshots"]
+
+@app.get("/export")
+async def export_history(
+    format_: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    kind: Literal["all", "watched", "waiting", "snapshots"] = "all",
+    user: User = Depends(get_current_user),
+):
+    """Stream the user's whole history (watched, waiting, snapshots) as NDJSON or CSV.
+
+    Rows are read EXPORT_CHUNK_ROWS at a time and written out chunk by chunk,
+    so the response never holds the full history in memory. NDJSON lines
+    carry "type" (the kind) and end with a "done" line; CSV is one kind per
+    file.
+    """
+    if format_ == "csv" and kind == "all":
+        raise HTTPException(status_code=400, detail="CSV exports one kind at a time: pass kind=watched, waiting or snapshots")
+    kinds = EXPORT_KINDS if kind == "all" else [kind]
+    user_id = user.id
+
+    async def ndjson_rows():
+        counts = {}
+        try:
+            for k in kinds:
+                counts[k] = 0
+                async for chunk in stream_export(user_id, k):
+                    counts[k] += len(chunk)
+                    yield "".join(ndjson_event(type=k, **row) for row in chunk)
+            yield ndjson_event(type="done", counts=counts)
+        except Exception as e:
+            print("[export error]:", repr(e))
+            yield ndjson_event(type="error", detail=str(e))
+
+    async def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=export_fields(kind))
+        writer.writeheader()
+        yield buffer.getvalue()
+        async for chunk in stream_export(user_id, kind):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(chunk)
+            yield buffer.getvalue()
+
+    stamp = datetime.utcnow().strftime("%Y%m%d")
+    if format_ == "csv":
+        body, media_type, filename = csv_rows(), "text/csv; charset=utf-8", f"movie-history-{kind}-{stamp}.csv"
+    else:
+        body, media_type, filename = ndjson_rows(), "application/x-ndjson", f"movie-history-{kind}-{stamp}.ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 @app.post("/watched")
@@ -407,8 +469,86 @@ async def add_watched(
     async with async_session() as session:
         await add_to_watched(session, movie_data)
         await session.commit()
+    bump_user_version(user.id, "list")
+    search_index.add(movie.tmdb_id, movie.title, movie.poster)
+    search_index.boost(movie.tmdb_id)
     return {"message": "Added to watched."}
 
+async def _feed_upload(job: WatchHistoryImport, receive, until_header: bool = False) -> bool:
+    """Feed raw http.request messages to the import job. False if the client went away."""
+    while not job.input_done:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return False
+        job.feed(message.get("body", b""), final=not message.get("more_body", False))
+        if until_header and job.header is not None:
+            break
+    return True
+
+class ImportProgressResponse(StreamingResponse):
+    """NDJSON progress for an import whose upload is still arriving.
+
+    The rest of the body is read here, next to the response, so rows are
+    looked up and written while the client is still sending. (Starlette's
+    StreamingResponse reads `receive` itself to notice disconnects, which
+    would swallow the body messages.)
+    """
+
+    def __init__(self, job: WatchHistoryImport, content, **kwargs):
+        super().__init__(content, **kwargs)
+        self.job = job
+
+    async def _read_upload(self, receive):
+        try:
+            if not await _feed_upload(self.job, receive):
+                return
+        except ValueError as e:
+            self.job.fail(e)
+        # 上传读完了，剩下的只可能是断开
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def __call__(self, scope, receive, send):
+        reader = asyncio.create_task(self._read_upload(receive))
+        streaming = asyncio.create_task(self.stream_response(send))
+        try:
+            # 客户端断开（reader 先结束）就停掉响应；响应发完就不用再读了
+            await asyncio.wait({reader, streaming}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (reader, streaming):
+                task.cancel()
+            await asyncio.gather(reader, streaming, return_exceptions=True)
+        if streaming.done() and not streaming.cancelled() and streaming.exception() is not None:
+            raise streaming.exception()
+
+@app.post("/import/watched")
+async def import_watched(request: Request, user: User = Depends(get_current_user)):
+    """Import a Letterboxd (watched / ratings / diary / reviews.csv) or IMDb ratings CSV.
+
+    The file is the raw request body. Progress comes back as NDJSON while the
+    upload is still arriving: "started", then "progress" events, then "done"
+    with the final counts (or "error" if the file goes bad part-way).
+    """
+    job = WatchHistoryImport(user.id)
+    try:
+        # 只等到表头：格式不对 / 空文件还能直接 400；其余部分边传边导入
+        if not await _feed_upload(job, request.receive, until_header=True):
+            job.cancel()
+            raise HTTPException(status_code=400, detail="Upload interrupted")
+    except ValueError as e:
+        job.cancel()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        try:
+            async for event in job.run():
+                yield ndjson_event(**event)
+        except Exception as e:
+            print("[import error]:", repr(e))
+            yield ndjson_event(type="error", detail=str(e))
+
+    return ImportProgressResponse(job, events(), media_type="application/x-ndjson")
+
 @app.post("/waiting")
 async def add_waiting(movie: AddMovieInput, user: User = Depends(get_current_user)):
     movie_data = movie.model_dump()
@@ -417,6 +557,9 @@ async def add_waiting(movie: AddMovieInput, user: User = Depends(get_current_use
     async with async_session() as session:
         await add_to_waiting(session, movie_data)
         await session.commit()
+    bump_user_version(user.id, "list")
+    search_index.add(movie.tmdb_id, movie.title, movie.poster)
+    search_index.boost(movie.tmdb_id)
     return {"message": "Added to waiting."}
 
 @app.delete("/watched/{title}")
@@ -434,11 +577,15 @@ async def delete_watched(title: str, user: User = Depends(get_current_user)):
             raise HTTPException(status_code=404, detail="Movie not found")
 
         # ✅ 删除 snapshot
-        await session.execute(
-            delete(TasteSnapshot).where(
+        result = await session.execute(
+            select(TasteSnapshot.id).where(
                 (TasteSnapshot.user_id == user.id) & (TasteSnapshot.movie_id == movie.id)
             )
         )
+        snapshot_ids = result.scalars().all()
+        await session.execute(
+            delete(TasteSnapshot).where(TasteSnapshot.id.in_(snapshot_ids))
+        )
 
         # ✅ 删除 watched
         await session.execute(
@@ -447,12 +594,14 @@ async def delete_watched(title: str, user: User = Depends(get_current_user)):
             )
         )
 
-        # ✅ 重建 summary
-        await regenerate_taste_summary(session, user.id)
-
         await session.commit()
+    bump_user_version(user.id, "list")
+
+    # ✅ 重建向量 + summary（后台执行）。没有 snapshot 的电影（导入的、review 失败的）
+    # 评分也在向量里，所以向量总要重建；summary 只有删掉已折叠进去的 snapshot 才全量重建
+    taste_scheduler.enqueue_summary(user.id, deleted_snapshot_ids=snapshot_ids, rebuild_vector=True)
 
-    return {"message": "Deleted and summary updated"}
+    return {"message": "Deleted and summary update queued"}
 
 @app.delete("/waiting/{title}")
 async def delete_waiting(title: str, user: User = Depends(get_current_user)):
@@ -463,6 +612,7 @@ async def delete_waiting(title: str, user: User = Depends(get_current_user)):
             )
         )
         await session.commit()
+    bump_user_version(user.id, "list")
     return {"message": "Deleted from waiting list"}
 
 @app.post("/review")
@@ -482,6 +632,7 @@ async def review_movie(
                 payload["user_id"] = user.id  # 提供给 move_to_watched 使用
                 await move_to_watched(session, payload)
                 await session.commit()
+                bump_user_version(user.id, "list")
                 print(" move_to_watched() committed")
 
                 # 🔄 再查一次刚添加的 watched movie（供 AI 使用）
@@ -495,8 +646,8 @@ async def review_movie(
                 if not movie:
                     raise HTTPException(status_code=500, detail="Movie moved but not found")
 
-                # ✨ AI 处理 snapshot + summary
-                await process_taste_modeling(session, user, movie)
+                # ✨ AI 处理 snapshot + summary（后台合并执行）
+                taste_scheduler.enqueue_review(user.id, movie.id)
 
             except Exception as e:
                 print(" Error in from_waiting block:", e)
@@ -522,10 +673,11 @@ async def review_movie(
                     movie.user_rating = payload.get("user_rating", movie.user_rating)
                     movie.liked = payload.get("liked", movie.liked)
                     await session.commit()
+                    bump_user_version(user.id, "list")
                     print(" Updated and committed")
 
-                    # ✨ AI 处理 snapshot + summary
-                    await process_taste_modeling(session, user, movie)
+                    # ✨ AI 处理 snapshot + summary（后台合并执行）
+                    taste_scheduler.enqueue_review(user.id, movie.id)
 
                 else:
                     print(" Movie not found in watched list")
@@ -535,39 +687,18 @@ async def review_movie(
                 raise
 
     return {"message": "Review saved."}
-async def process_taste_modeling(session, user, movie):
-    try:
-        snapshot_comment = await generate_snapshot_comment(
-            movie_title=movie.title,
-            user_rating=movie.user_rating,
-            review=movie.review,
-            mood_tags=movie.moods,
-            genres=movie.genres,
-            director=movie.director,
-            release_year=movie.release_year
-        )
 
-        snapshot = TasteSnapshot(
-            user_id=user.id,
-            movie_title=movie.title,
-            movie_id=movie.id,
-            action_type="review",
-            mood_tag=movie.moods,
-            gpt_comment=snapshot_comment
-        )
-        session.add(snapshot)
-
-        await regenerate_taste_summary(session, user.id)
-        await session.commit()
-    except Exception as e:
-        print("Snapshot/summary update failed:", e)
+# 本地索引命中够多就不请求 TMDB
+SUGGESTION_COUNT = 5
+SEARCH_MIN_LOCAL_HITS = int(os.getenv("SEARCH_MIN_LOCAL_HITS", "3"))
 
 @app.get("/search_suggestions")
 async def search_suggestions(query: str = Query(..., min_length=1)):
-    api_key = os.getenv("TMDB_API_KEY")
-    url = "https://api.themoviedb.org/3/search/movie"
+    local = search_index.search(query, SUGGESTION_COUNT)
+    if len(local) >= SEARCH_MIN_LOCAL_HITS:
+        return {"suggestions": local}
+
     params = {
-        "api_key": api_key,
         "query": query,
         "language": "en-US",
         "include_adult": False,
@@ -575,28 +706,34 @@ async def search_suggestions(query: str = Query(..., min_length=1)):
     }
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
+        status, data = await tmdb_client.get_cached("/search/movie", params)
+        if status != 200:
+            raise Exception(f"TMDB search returned {status}")
     except Exception as e:
+        if local:
+            return {"suggestions": local}
+        if isinstance(e, UpstreamUnavailable):
+            raise
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
-    results = data.get("results", [])[:5]
-    suggestions = []
+    results = data.get("results", [])
+    search_index.add_results(results)
 
+    # 回填后再查一次本地索引，TMDB 的模糊匹配结果补在后面
+    suggestions = search_index.search(query, SUGGESTION_COUNT)
+    seen = {s["id"] for s in suggestions}
     for movie in results:
+        if len(suggestions) >= SUGGESTION_COUNT:
+            break
         movie_id = movie.get("id")
         title = movie.get("title")
-        poster_path = movie.get("poster_path")
-
-        if not title or not movie_id:
+        if not title or not movie_id or movie_id in seen:
             continue
-
+        seen.add(movie_id)
         suggestions.append({
             "id": movie_id,
             "title": title,
-            "poster": f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else ""
+            "poster": poster_url(movie.get("poster_path")),
         })
 
     return {"suggestions": suggestions}
@@ -604,45 +741,36 @@ async def search_suggestions(query: str = Query(..., min_length=1)):
 @app.post("/search")
 async def search_movies(data: MoodInput):
     """
-    接收关键词并返回最多 3 个匹配电影的完整信息（通过 fetch_movie_info 获取）
+    接收关键词并返回最多 3 个匹配电影的完整信息（按搜索结果的 TMDB id 取详情）
     """
     query = data.mood  # 复用 MoodInput 的字段作为搜索关键词
 
     try:
-        api_key = os.getenv("TMDB_API_KEY")
-        url = f"https://api.themoviedb.org/3/search/movie"
         params = {
-            "api_key": api_key,
             "query": query,
             "language": "en-US",
             "page": 1,
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as resp:
-                if resp.status != 200:
-                    raise HTTPException(status_code=500, detail="TMDB search failed")
-                data = await resp.json()
+        status, data = await tmdb_client.get_cached("/search/movie", params)
+        if status != 200:
+            raise HTTPException(status_code=500, detail="TMDB search failed")
 
+        search_index.add_results(data.get("results", []))
         results = data.get("results", [])[:3]
         if not results:
             return {"recommendations": []}
 
-        # 用 fetch_movie_info 精确提取完整字段（含导演、类型等）
-        full_infos = []
-        for movie in results:
-            title = movie.get("title")
-            release_date = movie.get("release_date", "")
-            year_hint = int(release_date[:4]) if release_date else None
-
-            try:
-                info = await fetch_movie_info(title, year_hint=year_hint)
-                full_infos.append(info)
-            except Exception as e:
-                print(f"[search] failed to fetch detail for {title}: {e}")
+        # 搜索结果自带 id，直接按 id 取完整字段（含导演、类型等），不再按标题重新搜
+        candidates = [{"title": m.get("title"), "tmdb_id": m.get("id")} for m in results]
+        full_infos = await enrich_candidates(candidates, limit=3)
+        for info in full_infos:
+            info.pop("reason", None)
 
         return {"recommendations": full_infos}
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         print(f"[search top-level error]: {e}")
         return JSONResponse(content={"error": str(e)}, status_code=500)
@@ -652,9 +780,38 @@ async def movie_by_title(title: str):
     try:
         movie = await fetch_movie_info(title)
         return {"recommendations": [movie]}  
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+# /cache-stats 和 /debug/* 会暴露 SQL 形状、缓存 key 等内部信息，默认关闭（返回 404）
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", "0") == "1"
+
+def require_debug_endpoints():
+    if not DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/cache-stats", dependencies=[Depends(require_debug_endpoints)])
+async def get_cache_stats():
+    stats = cache_stats()
+    stats["tmdb"] = tmdb_client.cache_stats()
+    stats["llm"] = llm_client.cache_stats()
+    stats["singleflight"] = singleflight_stats()
+    stats["ratelimit"] = ratelimit_stats()
+    stats["cassette"] = cassette.stats()
+    return stats
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/slow-queries", dependencies=[Depends(require_debug_endpoints)])
+async def get_slow_queries(limit: int = Query(10, ge=1, le=100)):
+    """Slowest query shapes, recent slow statements and suspected N+1 requests."""
+    return query_profiler.report(limit)
+
 @app.get("/me")
 async def read_me(user: User = Depends(get_current_user)):
     return {"id": user.id, "username": user.username}
@@ -681,12 +838,12 @@ async def delete_snapshot(snapshot_id: int, user: User = Depends(get_current_use
             delete(TasteSnapshot).where(TasteSnapshot.id == snapshot_id)
         )
 
-        # 3. 重建 summary
-        await regenerate_taste_summary(session, user.id)
-
         await session.commit()
 
-    return {"message": "Snapshot deleted and summary updated"}
+    # 3. 重建 summary（后台执行）
+    taste_scheduler.enqueue_summary(user.id, deleted_snapshot_ids=[snapshot_id])
+
+    return {"message": "Snapshot deleted and summary update queued"}
 
 @app.post("/update_summary")
 async def update_taste_summary_feedback(
@@ -705,20 +862,18 @@ async def update_taste_summary_feedback(
                 timestamp=datetime.utcnow()
             )
             session.add(correction_snapshot)
-
-            # ✅ 重建 summary（将所有 snapshot 包括 correction 统一建模）
-            await regenerate_taste_summary(session, user.id)
-
             await session.commit()
-            print("✅ Summary regenerated with correction.")
 
-            # 🔁 再次获取新 summary 返回给前端
+            # ✅ 重建 summary（后台执行，correction 会和其他 snapshot 一起建模）
+            taste_scheduler.enqueue_summary(user.id)
+
+            # 🔁 返回当前 summary，前端可以通过 /taste-summary 的 status 轮询新版本
             result = await session.execute(
                 select(TasteSummary.summary).where(TasteSummary.user_id == user.id)
             )
-            updated_summary = result.scalar_one_or_none()
+            current_summary = result.scalar_one_or_none()
 
-            return {"summary": updated_summary or "Summary updated."}
+            return {"summary": current_summary or "Summary update queued.", "status": "pending"}
 
         except Exception as e:
             print("❌ COMMIT ERROR:", e)
@@ -728,6 +883,8 @@ async def update_taste_summary_feedback(
 async def movie_detail(tmdb_id: int):
     try:
         return await get_movie_detail_by_id(tmdb_id)
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         print(f"[movie_detail] Failed to fetch: {e}")
         return JSONResponse(content={"error": str(e)}, status_code=500)
\ No newline at end of file
@@ -0,0 +1,275 @@
+# backend/metrics.py
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from cache import caches
+from query_profiler import query_profiler
+
+# name -> metric, rendered in registration order at /metrics
+registry = {}
+# callables returning extra exposition lines (values read from other modules at scrape time)
+collectors = []
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values = {}
+        registry[name] = self
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, *labels):
+        self.inc(-amount, *labels)
+
+
+class Histogram(_Metric):
+    """Fixed buckets; each series keeps per-bucket counts, a sum and a count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = self._header()
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in registry.values():
+        lines += metric.render()
+    for collect in collectors:
+        lines += collect()
+    return "\n".join(lines) + "\n"
+
+
+# ---------- HTTP ----------
+http_requests = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "Time until the response body was fully sent.", ("method", "route"))
+http_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled.")
+http_db_queries = Histogram("http_request_db_queries", "SQL statements executed per request.", ("route",), COUNT_BUCKETS)
+
+db_queries = Counter("db_queries_total", "SQL statements executed, by the route that ran them.", ("route",))
+db_query_seconds = Counter("db_query_seconds_total", "Time spent in SQL statements, by route.", ("route",))
+db_query_latency = Histogram("db_query_duration_seconds", "Duration of single SQL statements.", (), QUERY_BUCKETS)
+
+
+class _RequestDB:
+    """SQL work done by the request being handled."""
+
+    __slots__ = ("scope", "queries", "seconds", "shapes", "finished")
+
+    def __init__(self, scope, profiled: bool):
+        self.scope = scope
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes = {} if profiled else None  # shape -> count, only for sampled requests
+        self.finished = False
+
+# None outside requests (worker, startup)
+_request_db: ContextVar[_RequestDB | None] = ContextVar("request_db", default=None)
+
+async def background(coro):
+    """Run `coro` detached from the request that spawned it.
+
+    Tasks copy their creator's context, so a task started while handling a
+    request would otherwise keep counting its SQL against that request
+    after it finished. Wrap fire-and-forget work in this:
+    asyncio.create_task(background(...)).
+    """
+    _request_db.set(None)
+    return await coro
+
+def _route(scope) -> str:
+    # 用路由模板（/movie_detail/{tmdb_id}）当标签，避免每个 id 一条时间序列
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streaming responses are timed until their last chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        db = _RequestDB(scope, query_profiler.sample())
+        token = _request_db.set(db)
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            _request_db.reset(token)
+            db.finished = True
+            route = _route(scope)
+            method = scope["method"]
+            http_requests.inc(1, method, route, str(status))
+            http_latency.observe(elapsed, method, route)
+            http_db_queries.observe(db.queries, route)
+            if db.queries:
+                db_queries.inc(db.queries, route)
+                db_query_seconds.inc(db.seconds, route)
+            if db.shapes:
+                query_profiler.finish_request(route, db.shapes)
+
+
+# ---------- Database ----------
+def instrument_engine(engine):
+    """Count and time every statement the (async) engine executes, and feed the query profiler."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_query_latency.observe(elapsed)
+        db = _request_db.get()
+        if db is None or db.finished:  # finished: a task the request left running
+            db_queries.inc(1, "background")
+            db_query_seconds.inc(elapsed, "background")
+            query_profiler.observe(statement, elapsed, "background", None)
+        else:
+            db.queries += 1
+            db.seconds += elapsed
+            query_profiler.observe(statement, elapsed, _route(db.scope), db.shapes)
+
+
+# ---------- Upstreams ----------
+upstream_requests = Counter("upstream_requests_total", "Upstream HTTP attempts by outcome (status code or exception).", ("upstream", "endpoint", "outcome"))
+upstream_errors = Counter("upstream_errors_total", "Upstream attempts that failed or returned a non-2xx status.", ("upstream", "endpoint", "outcome"))
+upstream_latency = Histogram("upstream_request_duration_seconds", "Upstream attempt latency.", ("upstream", "endpoint"))
+llm_tokens = Counter("llm_tokens_total", "OpenAI tokens used, by call site.", ("site", "kind"))
+
+
+def endpoint_template(path: str) -> str:
+    """/movie/603/credits -> /movie/{id}/credits, /find/tt0133093 -> /find/{id}"""
+    return re.sub(r"/(?:tt)?\d+(?=/|$)", "/{id}", path)
+
+
+class _Attempt:
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = None
+
+
+@contextmanager
+def track_upstream(upstream: str, endpoint: str):
+    """Time one upstream attempt; set `.status` on the yielded object when there is one."""
+    attempt = _Attempt()
+    started = time.perf_counter()
+    outcome = None
+    try:
+        yield attempt
+    except BaseException as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        upstream_latency.observe(time.perf_counter() - started, upstream, endpoint)
+        if outcome is None:
+            outcome = str(attempt.status) if attempt.status is not None else "ok"
+        upstream_requests.inc(1, upstream, endpoint, outcome)
+        if not (outcome == "ok" or outcome.startswith("2")):
+            upstream_errors.inc(1, upstream, endpoint, outcome)
+
+
+def record_tokens(site: str, usage):
+    if usage is None:
+        return
+    llm_tokens.inc(usage.prompt_tokens or 0, site, "prompt")
+    llm_tokens.inc(usage.completion_tokens or 0, site, "completion")
+
+
+# ---------- Caches ----------
+def _collect_caches():
+    lines = [
+        "# HELP cache_hits_total In-process cache hits.", "# TYPE cache_hits_total counter",
+    ]
+    lines += [f'cache_hits_total{{cache="{_escape(n)}"}} {c.hits}' for n, c in caches.items()]
+    lines += ["# HELP cache_misses_total In-process cache misses.", "# TYPE cache_misses_total counter"]
+    lines += [f'cache_misses_total{{cache="{_escape(n)}"}} {c.misses}' for n, c in caches.items()]
+    lines += ["# HELP cache_hit_ratio Hits over lookups since startup.", "# TYPE cache_hit_ratio gauge"]
+    lines += [f'cache_hit_ratio{{cache="{_escape(n)}"}} {c.stats()["hit_ratio"]}' for n, c in caches.items()]
+    lines += ["# HELP cache_entries Entries currently cached.", "# TYPE cache_entries gauge"]
+    lines += [f'cache_entries{{cache="{_escape(n)}"}} {len(c)}' for n, c in caches.items()]
+    return lines
+
+collectors.append(_collect_caches)
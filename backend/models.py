@@ -1,45 +1,90 @@
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, Text, DateTime, Boolean,func
+from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, Text, DateTime, Boolean, Index, LargeBinary, func
 from base import Base
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.associationproxy import association_proxy
 
-class WatchedMovie(Base):
-    __tablename__ = "watched_movies"
+class Movie(Base):
+    """Shared TMDB metadata, one row per film; list rows reference it by tmdb_id."""
+    __tablename__ = "movies"
 
-    id = Column(Integer, primary_key=True, index=True)
+    tmdb_id = Column(Integer, primary_key=True)
     title = Column(String, index=True)
     poster = Column(String)
     backdrop = Column(String)
     tmdb_rating = Column(Float)
-    user_rating = Column(Float, nullable=True)
     description = Column(String, nullable=True)
+    release_year = Column(Integer, nullable=True)
+    genres = Column(String, nullable=True)   # e.g., "Drama, Animation"
+    director = Column(String, nullable=True)
+
+# 列表行只存用户自己的数据，电影元数据通过 movie 关联（joined load）读取
+CATALOG_FIELDS = ("poster", "backdrop", "tmdb_rating", "description", "release_year", "genres", "director")
+
+class WatchedMovie(Base):
+    __tablename__ = "watched_movies"
+
+    id = Column(Integer, primary_key=True, index=True)
+    title = Column(String, index=True)
+    user_rating = Column(Float, nullable=True)
     liked = Column(Integer, nullable=True)  # 1 for liked, 0 or null otherwise
     review = Column(String, nullable=True)
     moods = Column(String, nullable=True)  # Stored as comma-separated tags
     watch_date = Column(Date, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     user = relationship("User", back_populates="watched_movies")
-    tmdb_id = Column(Integer, nullable=True)
-    release_year = Column(Integer, nullable=True)
-    genres = Column(String, nullable=True)   # e.g., "Drama, Animation"
-    director = Column(String, nullable=True)
+    tmdb_id = Column(Integer, ForeignKey("movies.tmdb_id"), nullable=True)
+    movie = relationship("Movie", lazy="joined")
     disliked = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index("uq_watched_movies_user_tmdb", "user_id", "tmdb_id", unique=True),
+    )
+
+    poster = association_proxy("movie", "poster")
+    backdrop = association_proxy("movie", "backdrop")
+    tmdb_rating = association_proxy("movie", "tmdb_rating")
+    description = association_proxy("movie", "description")
+    release_year = association_proxy("movie", "release_year")
+    genres = association_proxy("movie", "genres")
+    director = association_proxy("movie", "director")
+
+class TMDBCacheEntry(Base):
+    __tablename__ = "tmdb_cache"
+
+    key = Column(String, primary_key=True)  # e.g. "/movie/603" or "/search/movie?query=heat&year=1995"
+    payload = Column(Text)  # raw TMDB JSON response
+    fetched_at = Column(DateTime, nullable=False)
+
+class LLMCacheEntry(Base):
+    __tablename__ = "llm_cache"
+
+    key = Column(String, primary_key=True)  # sha256 of model + prompt + sampling params
+    model = Column(String)
+    response = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+
 class WaitingMovie(Base):
     __tablename__ = "waiting_movies"
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
-    poster = Column(String)
-    backdrop = Column(String)
-    tmdb_rating = Column(Float)
-    description = Column(String, nullable=True)
     added_date = Column(Date, nullable=True)  # 可以新增记录加入watchlist的时间（可选）
     user_id = Column(Integer, ForeignKey("users.id"))
     user = relationship("User", back_populates="waiting_movies")
-    tmdb_id = Column(Integer, nullable=True)
-    release_year = Column(Integer, nullable=True)
-    genres = Column(String, nullable=True)   # e.g., "Drama, Animation"
-    director = Column(String, nullable=True)
+    tmdb_id = Column(Integer, ForeignKey("movies.tmdb_id"), nullable=True)
+    movie = relationship("Movie", lazy="joined")
+
+    __table_args__ = (
+        Index("uq_waiting_movies_user_tmdb", "user_id", "tmdb_id", unique=True),
+    )
+
+    poster = association_proxy("movie", "poster")
+    backdrop = association_proxy("movie", "backdrop")
+    tmdb_rating = association_proxy("movie", "tmdb_rating")
+    description = association_proxy("movie", "description")
+    release_year = association_proxy("movie", "release_year")
+    genres = association_proxy("movie", "genres")
+    director = association_proxy("movie", "director")
 
 
 class User(Base):
@@ -67,6 +112,10 @@ class TasteSnapshot(Base):
     movie_title = Column(String) 
     user = relationship("User", back_populates="taste_snapshots")
 
+    __table_args__ = (
+        Index("ix_taste_snapshots_user_timestamp", "user_id", "timestamp"),
+    )
+
 class TasteSummary(Base):
     __tablename__ = "taste_summaries"
 
@@ -74,4 +123,15 @@ class TasteSummary(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     summary = Column(Text)
     highlight_titles = Column(String, nullable=True)  # stored as JSON string
-    user = relationship("User", back_populates="taste_summary")
\ No newline at end of file
+    last_snapshot_id = Column(Integer, nullable=True)  # newest snapshot folded into summary
+    checkpoints = Column(Text, nullable=True)  # JSON list of {"through_id", "text"} digests of older snapshots
+    user = relationship("User", back_populates="taste_summary")
+
+class TasteVector(Base):
+    """Numeric taste profile: weighted sum of watched-movie features (see taste_vector.py)."""
+    __tablename__ = "taste_vectors"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    vector = Column(LargeBinary)  # float32 bytes
+    movie_ids = Column(Text)  # JSON list of watched ids already folded in
+    updated_at = Column(DateTime)
\ No newline at end of file
@@ -0,0 +1,101 @@
+# backend/query_profiler.py
+import os
+import re
+import time
+import random
+from collections import deque
+from functools import lru_cache
+
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "100"))  # statements slower than this are logged
+SQL_PROFILE_SAMPLE = float(os.getenv("SQL_PROFILE_SAMPLE", "0.1"))  # fraction of requests profiled per statement
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "10"))  # same shape this often in one request
+SQL_PROFILE_MAX_SHAPES = 500
+
+_IN_LIST = re.compile(r"\bIN \((?:\?, )+\?\)", re.IGNORECASE)
+_VALUES_ROWS = re.compile(r"(\([?, ]+\))(?:, \([?, ]+\))+")  # multi-row INSERT ... VALUES
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def query_shape(statement: str) -> str:
+    """Statement with literals and IN-list lengths collapsed, so N lookups by id look identical."""
+    shape = _SPACE.sub(" ", statement).strip()
+    shape = _LITERAL.sub("?", shape)
+    shape = _VALUES_ROWS.sub(r"\1", shape)
+    return _IN_LIST.sub("IN (?)", shape)
+
+
+class QueryProfiler:
+    """Slow-query log, per-shape timings and N+1 detection.
+
+    Every statement is checked against SQL_SLOW_MS. Statements in a sampled
+    fraction of requests (SQL_PROFILE_SAMPLE) are also grouped by shape, which
+    feeds the slowest-shapes table and flags requests that ran one shape
+    SQL_N_PLUS_ONE_THRESHOLD times or more. Slow statements are always
+    recorded in the table, sampled or not.
+    """
+
+    def __init__(self):
+        self.shapes = {}  # shape -> {"count", "total", "max", "routes"}
+        self.slow = deque(maxlen=100)
+        self.n_plus_one = deque(maxlen=50)
+
+    def sample(self) -> bool:
+        return SQL_PROFILE_SAMPLE >= 1 or random.random() < SQL_PROFILE_SAMPLE
+
+    def observe(self, statement: str, elapsed: float, route: str, request_shapes: dict | None):
+        is_slow = elapsed * 1000 >= SQL_SLOW_MS
+        if request_shapes is None and not is_slow:
+            return
+
+        shape = query_shape(statement)
+        if request_shapes is not None:
+            request_shapes[shape] = request_shapes.get(shape, 0) + 1
+        self._record(shape, elapsed, route)
+        if is_slow:
+            self.slow.append({"route": route, "ms": round(elapsed * 1000, 2), "shape": shape, "at": time.time()})
+            print(f"🐢 Slow query ({elapsed * 1000:.0f}ms) in {route}: {shape[:300]}")
+
+    def _record(self, shape: str, elapsed: float, route: str):
+        stats = self.shapes.get(shape)
+        if stats is None:
+            if len(self.shapes) >= SQL_PROFILE_MAX_SHAPES:
+                return
+            stats = self.shapes[shape] = {"count": 0, "total": 0.0, "max": 0.0, "routes": set()}
+        stats["count"] += 1
+        stats["total"] += elapsed
+        stats["max"] = max(stats["max"], elapsed)
+        stats["routes"].add(route)
+
+    def finish_request(self, route: str, request_shapes: dict):
+        for shape, count in request_shapes.items():
+            if count >= SQL_N_PLUS_ONE_THRESHOLD:
+                self.n_plus_one.append({"route": route, "count": count, "shape": shape, "at": time.time()})
+                print(f"🔁 Possible N+1 in {route}: {count}× {shape[:200]}")
+
+    def report(self, limit: int = 10) -> dict:
+        slowest = sorted(self.shapes.items(), key=lambda item: item[1]["max"], reverse=True)[:limit]
+        return {
+            "settings": {
+                "slow_ms": SQL_SLOW_MS,
+                "sample": SQL_PROFILE_SAMPLE,
+                "n_plus_one_threshold": SQL_N_PLUS_ONE_THRESHOLD,
+            },
+            "slowest_shapes": [
+                {
+                    "shape": shape,
+                    "count": s["count"],
+                    "max_ms": round(s["max"] * 1000, 2),
+                    "mean_ms": round(s["total"] / s["count"] * 1000, 2),
+                    "total_ms": round(s["total"] * 1000, 2),
+                    "routes": sorted(s["routes"]),
+                }
+                for shape, s in slowest
+            ],
+            "recent_slow": list(self.slow)[-limit:],
+            "recent_n_plus_one": list(self.n_plus_one)[-limit:],
+        }
+
+
+query_profiler = QueryProfiler()
@@ -0,0 +1,143 @@
+# backend/ratelimit.py
+import heapq
+import random
+import asyncio
+import itertools
+from contextvars import ContextVar
+from fastapi import HTTPException
+from metrics import background
+
+# Lower value = served first when an upstream is saturated
+PRIORITY_INTERACTIVE = 0  # user is waiting on this exact call (search, detail pages)
+PRIORITY_ENRICH = 1       # recommendation enrichment fan-out
+PRIORITY_BACKGROUND = 2   # taste worker, imports, warm-ups
+
+upstream_priority: ContextVar[int] = ContextVar("upstream_priority", default=PRIORITY_INTERACTIVE)
+
+# name -> limiter, so /cache-stats can report them
+limiters = {}
+
+
+class UpstreamUnavailable(HTTPException):
+    """An upstream kept rate-limiting us past the caller's deadline."""
+
+    def __init__(self, upstream: str, retry_after: float | None = None):
+        headers = {"Retry-After": str(max(1, round(retry_after)))} if retry_after else None
+        super().__init__(status_code=503, detail=f"{upstream} is rate limiting requests, try again shortly", headers=headers)
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket with a priority queue in front of it.
+
+    `rate` tokens per second refill up to `burst`. Callers that find the
+    bucket empty queue up and are released lowest-priority-value first (FIFO
+    within a priority). `penalize()` empties the bucket and pauses releases
+    until the upstream's Retry-After has passed.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = None
+        self._blocked_until = 0.0
+        self._queue = []  # (priority, seq, future)
+        self._seq = itertools.count()
+        self._dispatcher: asyncio.Task | None = None
+        self.granted = 0
+        self.queued = 0
+        self.throttled = 0
+        self.timeouts = 0
+        limiters[name] = self
+
+    def _refill(self, now: float):
+        if self._updated is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, deadline: float | None = None):
+        """Wait for a token. Raises UpstreamUnavailable if `deadline` (loop time) passes first."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._refill(now)
+        if not self._queue and now >= self._blocked_until and self._tokens >= 1:
+            self._tokens -= 1
+            self.granted += 1
+            return
+
+        future = loop.create_future()
+        heapq.heappush(self._queue, (upstream_priority.get(), next(self._seq), future))
+        self.queued += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(background(self._dispatch()))
+
+        timeout = None if deadline is None else max(0.0, deadline - now)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            if future.done() and not future.cancelled():
+                return  # granted just as the deadline hit
+            future.cancel()
+            raise UpstreamUnavailable(self.name, self._blocked_until - loop.time())
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self._queue:
+            now = loop.time()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._refill(now)
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue  # caller gave up
+            self._tokens -= 1
+            self.granted += 1
+            future.set_result(None)
+
+    def penalize(self, retry_after: float | None):
+        """Upstream said 429: stop releasing tokens for `retry_after` seconds."""
+        self.throttled += 1
+        now = asyncio.get_running_loop().time()
+        self._tokens = 0.0
+        self._updated = now
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "waiting": sum(1 for _, _, f in self._queue if not f.done()),
+            "granted": self.granted,
+            "queued": self.queued,
+            "throttled": self.throttled,
+            "deadline_misses": self.timeouts,
+        }
+
+
+def parse_retry_after(value) -> float | None:
+    """Retry-After seconds (the HTTP-date form is rare for APIs and treated as absent)."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float = 10.0) -> float:
+    # "full jitter": spreads retries from many callers instead of syncing them
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def ratelimit_stats():
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -0,0 +1,317 @@
+# backend/recommend.py
+import os
+import re
+import json
+import asyncio
+import secrets
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import TTLCache, get_user_version
+from llm import llm_client
+from models import WatchedMovie, WaitingMovie, TasteSummary
+from tmdb import tmdb_client, get_movie_detail_by_id, enrich_candidates
+from taste_vector import GENRES, GENRE_BY_ID, load_taste_vector, score_candidates, top_genres, rank_candidates
+
+RECOMMEND_COUNT = 3
+
+# "rank": one LLM call for RECOMMEND_OVERGENERATE candidates, resolved together
+# and ranked locally. "retry": ask for RECOMMEND_COUNT and re-ask up to 3 times.
+RECOMMEND_PIPELINE = os.getenv("RECOMMEND_PIPELINE", "rank")
+RECOMMEND_OVERGENERATE = int(os.getenv("RECOMMEND_OVERGENERATE", "8"))
+
+# (user_id, mood, mode, summary version, list version) -> recommendations
+RECOMMEND_CACHE_TTL = float(os.getenv("RECOMMEND_CACHE_TTL", "120"))
+recommendation_cache = TTLCache("recommendations", maxsize=2048, ttl=RECOMMEND_CACHE_TTL)
+
+# (user_id, mood, mode) -> ranked picks beyond the first page, for "show more"
+RECOMMEND_STASH_TTL = float(os.getenv("RECOMMEND_STASH_TTL", "600"))
+recommendation_stash = TTLCache("recommendation_stash", maxsize=1024, ttl=RECOMMEND_STASH_TTL)
+
+
+# ---------- Title helpers ----------
+def parse_title_and_year(raw_title):
+    match = re.match(r"(.+)\s+\((\d{4})\)", raw_title)
+    if match:
+        return match.group(1).strip(), int(match.group(2))
+    return raw_title.strip(), None
+
+def normalize(title):
+    return re.sub(r"[^\w\s]", "", title.lower().strip())
+
+def normalize_titles(titles):
+    return set(normalize(t) for t in titles if t)
+
+def normalize_mood(mood):
+    return " ".join(mood.lower().split())
+
+def recommendation_cache_key(user_id: int, mood: str, mode: str | None):
+    # 版本号在请求开始时读取：期间如有写入，结果会落到旧 key 上，不会被读到
+    return (
+        user_id,
+        normalize_mood(mood),
+        mode,
+        get_user_version(user_id, "summary"),
+        get_user_version(user_id, "list"),
+    )
+
+
+# ---------- Guest mode ----------
+async def get_guest_candidates(mood: str, fresh: bool = False):
+    prompt = (
+        f"Return ONLY a JSON array of 3 movie titles that match user's input: '{mood}'. "
+        "Each item must include title and approximate release year. "
+        "Format: [\"Up (2009)\", \"La La Land (2016)\", \"Her (2013)\"]"
+    )
+
+    raw_content = await llm_client.chat(prompt, temperature=0.7, cache=not fresh, site="guest_candidates")
+
+    try:
+        titles = json.loads(raw_content)
+    except json.JSONDecodeError:
+        llm_client.evict(prompt, temperature=0.7)
+        raise HTTPException(status_code=500, detail=f"Invalid JSON:\n{raw_content}")
+
+    candidates = []
+    for raw_title in titles:
+        title, year = parse_title_and_year(raw_title)
+        candidates.append({"title": title, "year": year, "reason": ""})  # no insight in guest mode
+    return candidates
+
+
+# ---------- Logged-in mode ----------
+async def load_user_context(db: AsyncSession, user_id: int):
+    watched_result = await db.execute(
+        select(WatchedMovie.title, WatchedMovie.tmdb_id).where(WatchedMovie.user_id == user_id)
+    )
+    watched_rows = watched_result.fetchall()
+    raw_watched_titles = [row[0] for row in watched_rows]
+
+    waiting_result = await db.execute(
+        select(WaitingMovie.title, WaitingMovie.tmdb_id).where(WaitingMovie.user_id == user_id)
+    )
+    waiting_rows = waiting_result.fetchall()
+    raw_waiting_titles = [row[0] for row in waiting_rows]
+
+    summary_result = await db.execute(
+        select(TasteSummary.summary).where(TasteSummary.user_id == user_id)
+    )
+    taste_summary = summary_result.scalar()
+    has_summary = bool(taste_summary and taste_summary.strip())
+    if not has_summary:
+        taste_summary = "User has no summary yet."
+
+    return {
+        "raw_watched_titles": raw_watched_titles,
+        "raw_waiting_titles": raw_waiting_titles,
+        "seen_titles": normalize_titles(raw_watched_titles) | normalize_titles(raw_waiting_titles),
+        "seen_ids": {row[1] for row in watched_rows + waiting_rows if row[1] is not None},
+        "taste_summary": taste_summary,
+        "has_summary": has_summary,
+        "taste": await load_taste_vector(db, user_id),
+    }
+
+def build_user_prompt(ctx: dict, mood: str, count: int = RECOMMEND_COUNT):
+    prompt = (
+        f"You are a personalized movie recommender.\n"
+        f"User's taste summary:\n{ctx['taste_summary']}\n\n"
+        f"User query or mood: {mood}\n"
+        f"IMPORTANT: Do NOT recommend these watched titles:\n{ctx['raw_watched_titles']}\n"
+    )
+    if ctx["raw_waiting_titles"]:
+        prompt += f"IMPORTANT: Do NOT recommend these waiting titles:\n{ctx['raw_waiting_titles']}\n"
+
+    if ctx["has_summary"]:
+        prompt += (
+            f"Return a JSON array of {count} items. Each item must contain:\n"
+            "- 'title': movie title\n"
+            "- 'year': approximate release year\n"
+            "- 'reason': short reason for recommendation\n"
+            "Example: [{\"title\": \"Inception\", \"year\": 2010, \"reason\": \"You enjoy sci-fi mind-bending plots.\"}]\n"
+        )
+    else:
+        prompt += (
+            f"Return a JSON array of {count} items. Each item must contain only 'title' and 'year'.\n"
+            "Do not include 'reason'. Example: [{\"title\": \"Inception\", \"year\": 2010}]\n"
+        )
+    return prompt
+
+def parse_user_candidates(raw_content: str, ctx: dict):
+    """LLM output -> candidates not already in the user's lists. None if it isn't valid JSON."""
+    try:
+        recommendations = json.loads(raw_content)
+    except json.JSONDecodeError:
+        return None
+
+    candidates = []
+    for item in recommendations:
+        title_raw = item.get("title", "")
+        norm_title = normalize(title_raw)
+        if not norm_title or norm_title in ctx["seen_titles"]:
+            continue
+        year = item.get("year")
+        if not isinstance(year, int):
+            year = None
+        reason = item.get("reason", "") if ctx["has_summary"] else ""
+        candidates.append({"title": title_raw, "year": year, "reason": reason})
+    return candidates
+
+async def iter_user_candidate_batches(prompt: str, ctx: dict, fresh: bool = False, attempts: int = 3):
+    """Yield one candidate list per LLM attempt; the caller stops once a batch resolves."""
+    for attempt in range(attempts):
+        # 重试时不能再用缓存，否则会拿到同一个结果
+        use_cache = attempt == 0 and not fresh
+        raw_content = await llm_client.chat(prompt, temperature=0.7, cache=use_cache, site="user_candidates")
+
+        candidates = parse_user_candidates(raw_content, ctx)
+        if candidates is None:
+            llm_client.evict(prompt, temperature=0.7)
+            continue
+        yield candidates
+
+
+# ---------- Over-generate and rank ----------
+def dedupe_titles(candidates: list[dict]):
+    unique, seen = [], set()
+    for candidate in candidates:
+        key = normalize(candidate["title"])
+        if key not in seen:
+            seen.add(key)
+            unique.append(candidate)
+    return unique
+
+def exclusion_filter(ctx: dict):
+    """accept() for enrich_candidates: drop movies already in the user's lists."""
+    def accept(info):
+        return info["tmdb_id"] not in ctx["seen_ids"] and normalize(info.get("title") or "") not in ctx["seen_titles"]
+    return accept
+
+def dedupe_resolved(infos: list[dict]):
+    # two LLM titles can resolve to the same TMDB movie
+    unique, seen = [], set()
+    for info in infos:
+        if info["tmdb_id"] not in seen:
+            seen.add(info["tmdb_id"])
+            unique.append(info)
+    return unique
+
+async def get_user_candidates_once(prompt: str, ctx: dict, fresh: bool = False):
+    """One wide LLM batch. Unparseable output gets one uncached retry, then a 502."""
+    for use_cache in ((False,) if fresh else (True, False)):
+        raw_content = await llm_client.chat(prompt, temperature=0.7, cache=use_cache, site="user_candidates")
+        candidates = parse_user_candidates(raw_content, ctx)
+        if candidates is not None:
+            return dedupe_titles(candidates)
+        llm_client.evict(prompt, temperature=0.7)
+    raise HTTPException(status_code=502, detail="The recommender returned invalid JSON, please try again")
+
+async def get_ranked_recommendations(ctx: dict, mood: str, fresh: bool = False):
+    """One LLM call for a wide batch, all survivors resolved at once and ranked by taste.
+
+    Returns every ranked survivor; callers show the first RECOMMEND_COUNT and
+    stash the rest.
+    """
+    prompt = build_user_prompt(ctx, mood, count=RECOMMEND_OVERGENERATE)
+    candidates = await get_user_candidates_once(prompt, ctx, fresh)
+    resolved = await enrich_candidates(candidates, limit=len(candidates), accept=exclusion_filter(ctx))
+    return rank_candidates(ctx["taste"], dedupe_resolved(resolved))
+
+
+# ---------- "Show more" stash ----------
+# The stash never changes once written; a cursor is "<token>:<offset>" into it,
+# so re-sending a cursor returns the same page.
+def stash_key(user_id: int, mood: str, mode: str | None):
+    return (user_id, normalize_mood(mood), mode)
+
+def stash_recommendations(user_id: int, mood: str, mode: str | None, surplus: list[dict]):
+    """Keep surplus picks for follow-up pages. Returns the cursor of the next page, if any."""
+    key = stash_key(user_id, mood, mode)
+    if not surplus:
+        recommendation_stash.pop(key)
+        return None
+    token = secrets.token_urlsafe(6)
+    recommendation_stash.set(key, {
+        "token": token,
+        "list_version": get_user_version(user_id, "list"),
+        "items": surplus,
+    })
+    return f"{token}:0"
+
+def stash_cursor(user_id: int, mood: str, mode: str | None):
+    """Cursor for the first stashed page, e.g. when page one came from the result cache."""
+    entry = recommendation_stash.get(stash_key(user_id, mood, mode))
+    if entry is None or entry["list_version"] != get_user_version(user_id, "list"):
+        return None
+    return f"{entry['token']}:0"
+
+def next_from_stash(user_id: int, mood: str, mode: str | None, cursor: str):
+    """(page, next_cursor) from the stash, or None if the cursor is stale or unknown."""
+    entry = recommendation_stash.get(stash_key(user_id, mood, mode))
+    token, _, offset = cursor.partition(":")
+    if entry is None or entry["token"] != token or not offset.isdigit():
+        return None
+    # 列表变了（加了/删了电影），暂存的结果可能已经看过
+    if entry["list_version"] != get_user_version(user_id, "list"):
+        return None
+    offset = int(offset)
+    page = entry["items"][offset:offset + RECOMMEND_COUNT]
+    if not page:
+        return None
+    end = offset + RECOMMEND_COUNT
+    next_cursor = f"{token}:{end}" if end < len(entry["items"]) else None
+    return page, next_cursor
+
+
+# ---------- Fast mode (no LLM) ----------
+FAST_DISCOVER_PAGES = 2
+
+def mood_genres(mood: str):
+    text = mood.lower()
+    return [name for name in GENRES if name.lower() in text]
+
+def guest_fast_context():
+    return {"seen_ids": set(), "seen_titles": set(), "taste": None}
+
+async def get_fast_recommendations(ctx: dict, mood: str):
+    """Rank TMDB discover results with the local taste vector only."""
+    taste = ctx["taste"]
+    genres = mood_genres(mood) or top_genres(taste)
+    params = {"sort_by": "popularity.desc", "vote_count.gte": 200, "language": "en-US"}
+    if genres:
+        params["with_genres"] = "|".join(str(GENRES[g]) for g in genres)
+
+    pages = await asyncio.gather(*(
+        tmdb_client.get_cached("/discover/movie", {**params, "page": page})
+        for page in range(1, FAST_DISCOVER_PAGES + 1)
+    ))
+    candidates = []
+    picked = set()
+    for status, data in pages:
+        if status != 200:
+            continue
+        for movie in data.get("results", []):
+            tmdb_id = movie.get("id")
+            if tmdb_id in picked or tmdb_id in ctx["seen_ids"] or normalize(movie.get("title") or "") in ctx["seen_titles"]:
+                continue
+            picked.add(tmdb_id)
+            release_date = movie.get("release_date") or ""
+            candidates.append({
+                "tmdb_id": tmdb_id,
+                "genres": [GENRE_BY_ID[g] for g in movie.get("genre_ids", []) if g in GENRE_BY_ID],
+                "release_year": int(release_date[:4]) if release_date[:4].isdigit() else None,
+                "popularity": movie.get("popularity") or 0,
+            })
+    if not candidates:
+        return []
+
+    # discover 结果没有导演，先按类型+年代打分；同分按热度
+    scores = score_candidates(taste, candidates)
+    order = sorted(range(len(candidates)), key=lambda i: (-scores[i], -candidates[i]["popularity"]))
+    chosen = [candidates[i] for i in order[:RECOMMEND_COUNT]]
+
+    details = await asyncio.gather(*(get_movie_detail_by_id(c["tmdb_id"]) for c in chosen))
+    favourite = set(top_genres(taste, n=3))
+    for info, candidate in zip(details, chosen):
+        shared = [g for g in candidate["genres"] if g in favourite]
+        info["reason"] = f"Matches your taste for {', '.join(shared)}." if shared else ""
+    return details
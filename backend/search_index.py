@@ -0,0 +1,184 @@
+# backend/search_index.py
+import os
+import re
+import json
+import heapq
+from collections import OrderedDict, defaultdict
+from sqlalchemy import select, func, union_all
+from database import async_session
+from models import Movie, WatchedMovie, WaitingMovie, TMDBCacheEntry
+
+PREFIX_MAX = 12     # longest word prefix indexed
+LIST_BOOST = 5.0    # popularity added per user who has the film in a list
+MIN_TRIGRAM_SCORE = 0.5
+# titles only seen in TMDB results (not in the catalog or anyone's list) are kept LRU, up to this many
+SEARCH_INDEX_MAX_UNLISTED = int(os.getenv("SEARCH_INDEX_MAX_UNLISTED", "20000"))
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+def _trigrams(norm: str) -> set[str]:
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def poster_url(poster_path):
+    return f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else ""
+
+
+class SearchIndex:
+    """In-memory title index for autocomplete.
+
+    Word prefixes answer the usual as-you-type queries; trigrams catch typos
+    and mid-title matches when prefixes find too little. Hits are ordered by
+    whether the title starts with the query, then by popularity.
+    Catalog and list titles stay for the life of the process; titles that
+    only came from TMDB results are evicted least-recently-used once there
+    are more than SEARCH_INDEX_MAX_UNLISTED of them.
+    """
+
+    def __init__(self, max_unlisted: int = SEARCH_INDEX_MAX_UNLISTED):
+        self._entries: dict[int, dict] = {}
+        self._prefixes: dict[str, set[int]] = defaultdict(set)
+        self._trigrams: dict[str, set[int]] = defaultdict(set)
+        self._unlisted: OrderedDict[int, None] = OrderedDict()
+        self.max_unlisted = max_unlisted
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ---------- Building ----------
+    def add(self, tmdb_id, title, poster="", popularity=0.0, listed=True):
+        """Index a title; listed=False marks one that is only known from TMDB results."""
+        if not tmdb_id or tmdb_id < 0 or not title:
+            return  # negative ids are placeholders for legacy list rows
+        entry = self._entries.get(tmdb_id)
+        if entry is not None:
+            entry["popularity"] = max(entry["popularity"], popularity or 0.0)
+            entry["poster"] = entry["poster"] or poster
+            if listed:
+                self._unlisted.pop(tmdb_id, None)
+            elif tmdb_id in self._unlisted:
+                self._unlisted.move_to_end(tmdb_id)
+            return
+
+        norm = _normalize(title)
+        self._entries[tmdb_id] = {
+            "id": tmdb_id,
+            "title": title,
+            "poster": poster or "",
+            "popularity": popularity or 0.0,
+            "norm": norm,
+        }
+        for word in norm.split():
+            for n in range(1, min(len(word), PREFIX_MAX) + 1):
+                self._prefixes[word[:n]].add(tmdb_id)
+        for gram in _trigrams(norm):
+            self._trigrams[gram].add(tmdb_id)
+        if not listed:
+            self._unlisted[tmdb_id] = None
+            while len(self._unlisted) > self.max_unlisted:
+                self._remove(self._unlisted.popitem(last=False)[0])
+
+    def _remove(self, tmdb_id):
+        norm = self._entries.pop(tmdb_id)["norm"]
+        for word in norm.split():
+            for n in range(1, min(len(word), PREFIX_MAX) + 1):
+                self._discard(self._prefixes, word[:n], tmdb_id)
+        for gram in _trigrams(norm):
+            self._discard(self._trigrams, gram, tmdb_id)
+
+    @staticmethod
+    def _discard(postings, key, tmdb_id):
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(tmdb_id)
+            if not ids:
+                del postings[key]
+
+    def add_results(self, results: list[dict]):
+        """Feed raw TMDB movie objects (search / discover / detail) into the index."""
+        for movie in results:
+            self.add(
+                movie.get("id"),
+                movie.get("title"),
+                poster_url(movie.get("poster_path")),
+                movie.get("popularity") or 0.0,
+                listed=False,
+            )
+
+    def boost(self, tmdb_id, amount: float = LIST_BOOST):
+        entry = self._entries.get(tmdb_id)
+        if entry is not None:
+            entry["popularity"] += amount
+
+    async def build(self):
+        """Load titles the server already knows: catalog, list counts and cached TMDB payloads."""
+        async with async_session() as session:
+            movies = await session.execute(select(Movie.tmdb_id, Movie.title, Movie.poster))
+            for tmdb_id, title, poster in movies:
+                self.add(tmdb_id, title, poster)
+
+            listed = union_all(
+                select(WatchedMovie.tmdb_id.label("tmdb_id")),
+                select(WaitingMovie.tmdb_id.label("tmdb_id")),
+            ).subquery()
+            counts = await session.execute(
+                select(listed.c.tmdb_id, func.count()).group_by(listed.c.tmdb_id)
+            )
+            for tmdb_id, users in counts:
+                self.boost(tmdb_id, LIST_BOOST * users)
+
+            payloads = await session.execute(select(TMDBCacheEntry.payload))
+            for (payload,) in payloads:
+                try:
+                    data = json.loads(payload)
+                except ValueError:
+                    continue
+                if "results" in data:
+                    self.add_results(data["results"])
+                elif "title" in data and "id" in data:
+                    self.add_results([data])
+        print(f"🔎 Search index ready: {len(self)} titles")
+
+    # ---------- Lookup ----------
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        norm = _normalize(query)
+        if not norm:
+            return []
+
+        words = norm.split()
+        postings = [self._prefixes.get(w[:PREFIX_MAX], set()) for w in words]
+        hits = set.intersection(*postings) if all(postings) else set()
+        # long words are indexed up to PREFIX_MAX chars; confirm the full word
+        hits = {i for i in hits if all(
+            any(t.startswith(w) for t in self._entries[i]["norm"].split()) for w in words
+        )}
+
+        scores = {i: 1.0 for i in hits}
+        if len(hits) < limit and len(norm) >= 3:
+            grams = _trigrams(norm)
+            overlap = defaultdict(int)
+            for gram in grams:
+                for i in self._trigrams.get(gram, ()):
+                    overlap[i] += 1
+            for i, common in overlap.items():
+                score = common / len(grams)
+                if i not in scores and score >= MIN_TRIGRAM_SCORE:
+                    scores[i] = score
+
+        def rank(i):
+            entry = self._entries[i]
+            return (entry["norm"].startswith(norm), scores[i], entry["popularity"])
+
+        best = heapq.nlargest(limit, scores, key=rank)
+        for i in reversed(best):  # the top hit ends up most recently used
+            if i in self._unlisted:
+                self._unlisted.move_to_end(i)
+        return [
+            {"id": i, "title": self._entries[i]["title"], "poster": self._entries[i]["poster"]}
+            for i in best
+        ]
+
+
+search_index = SearchIndex()
@@ -0,0 +1,75 @@
+# backend/singleflight.py
+import copy
+import asyncio
+
+# name -> group, so /cache-stats can report how many calls were shared
+groups = {}
+
+
+class SingleFlight:
+    """Coalesce identical concurrent async calls.
+
+    The first caller for a key starts the call as its own task; callers that
+    arrive while it is running await the same task instead of starting
+    another. Every caller gets the same result (as a deep copy, so callers
+    may mutate it) or the same exception. A caller being cancelled does not
+    cancel the shared call unless it was the last one waiting.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict = {}  # key -> (task, [waiter count])
+        self.calls = 0
+        self.shared = 0
+        groups[name] = self
+
+    async def do(self, key, fn, *args, **kwargs):
+        entry = self._inflight.get(key)
+        if entry is None:
+            self.calls += 1
+            task = asyncio.create_task(fn(*args, **kwargs))
+            entry = (task, [0])
+            self._inflight[key] = entry
+            task.add_done_callback(lambda t, key=key: self._forget(key, t))
+        else:
+            self.shared += 1
+
+        task, waiters = entry
+        waiters[0] += 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                raise
+            waiters[0] -= 1
+            if waiters[0] == 0 and not task.done():
+                # 先摘掉 key：cancel 到 _forget 之间进来的调用者要开新任务，而不是拿到 CancelledError
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                task.cancel()  # nobody is waiting for it any more
+            raise
+        waiters[0] -= 1
+        return copy.deepcopy(result)
+
+    def _forget(self, key, task):
+        entry = self._inflight.get(key)
+        if entry is not None and entry[0] is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved; waiters re-raise it themselves
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def stats(self):
+        total = self.calls + self.shared
+        return {
+            "in_flight": len(self._inflight),
+            "calls": self.calls,
+            "shared": self.shared,
+            "shared_ratio": round(self.shared / total, 4) if total else 0.0,
+        }
+
+
+def singleflight_stats():
+    return {name: g.stats() for name, g in groups.items()}
@@ -0,0 +1,179 @@
+# backend/taste_vector.py
+import json
+import zlib
+import numpy as np
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import WatchedMovie, TasteVector
+
+# TMDB movie genres (name -> id); the order fixes the one-hot layout
+GENRES = {
+    "Action": 28, "Adventure": 12, "Animation": 16, "Comedy": 35, "Crime": 80,
+    "Documentary": 99, "Drama": 18, "Family": 10751, "Fantasy": 14, "History": 36,
+    "Horror": 27, "Music": 10402, "Mystery": 9648, "Romance": 10749,
+    "Science Fiction": 878, "TV Movie": 10770, "Thriller": 53, "War": 10752, "Western": 37,
+}
+GENRE_NAMES = list(GENRES)
+GENRE_BY_ID = {gid: name for name, gid in GENRES.items()}
+DIRECTOR_BUCKETS = 64
+MOOD_BUCKETS = 32
+DECADES = list(range(1920, 2030, 10))  # 1920s ... 2020s
+
+# block -> (offset, size, weight); each block is unit-normalised, then weighted
+_BLOCKS = {}
+_offset = 0
+for _name, _size, _weight in (
+    ("genre", len(GENRE_NAMES), 1.0),
+    ("director", DIRECTOR_BUCKETS, 0.6),
+    ("mood", MOOD_BUCKETS, 0.5),
+    ("decade", len(DECADES), 0.4),
+):
+    _BLOCKS[_name] = (_offset, _size, _weight)
+    _offset += _size
+DIM = _offset
+
+
+def _bucket(text: str, size: int) -> int:
+    # crc32 rather than hash(): Python's string hash changes between runs
+    return zlib.crc32(text.strip().lower().encode("utf-8")) % size
+
+def _split(value) -> list[str]:
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in str(value).split(",") if v.strip()]
+
+
+# ---------- Features ----------
+def movie_features(genres=None, director=None, moods=None, release_year=None) -> np.ndarray:
+    vec = np.zeros(DIM, dtype=np.float32)
+    parts = {"genre": [], "director": [], "mood": [], "decade": []}
+    for genre in _split(genres):
+        if genre in GENRES:
+            parts["genre"].append(GENRE_NAMES.index(genre))
+    if director:
+        parts["director"].append(_bucket(director, DIRECTOR_BUCKETS))
+    for mood in _split(moods):
+        parts["mood"].append(_bucket(mood, MOOD_BUCKETS))
+    if release_year:
+        decade = min(max(int(release_year) // 10 * 10, DECADES[0]), DECADES[-1])
+        parts["decade"].append(DECADES.index(decade))
+
+    for block, indexes in parts.items():
+        if not indexes:
+            continue
+        offset, _, weight = _BLOCKS[block]
+        for i in indexes:
+            vec[offset + i] += 1.0
+        block_slice = vec[offset:offset + _BLOCKS[block][1]]
+        block_slice *= weight / np.linalg.norm(block_slice)
+    return vec
+
+def feature_matrix(movies: list[dict]) -> np.ndarray:
+    """Stack features for dicts with genres / director / moods / release_year keys."""
+    if not movies:
+        return np.zeros((0, DIM), dtype=np.float32)
+    return np.stack([
+        movie_features(m.get("genres"), m.get("director"), m.get("moods"), m.get("release_year"))
+        for m in movies
+    ])
+
+def review_weight(user_rating=None, liked=None, disliked=None) -> float:
+    """How strongly a watched movie pulls the taste vector (negative pushes away)."""
+    weight = 0.0
+    if user_rating:
+        weight += (float(user_rating) - 5.5) / 4.5  # 1..10 -> -1..1
+    if liked:
+        weight += 0.5
+    if disliked:
+        weight -= 0.7
+    return max(-1.5, min(1.5, weight))
+
+
+# ---------- Per-user state ----------
+def _watched_row(movie: WatchedMovie) -> dict:
+    return {
+        "genres": movie.genres,
+        "director": movie.director,
+        "moods": movie.moods,
+        "release_year": movie.release_year,
+    }
+
+def _unpack(row: TasteVector) -> np.ndarray:
+    return np.frombuffer(row.vector, dtype=np.float32).copy()
+
+async def load_taste_vector(session: AsyncSession, user_id: int):
+    """Unit-length taste vector for the user, or None if nothing has been rated yet."""
+    row = await session.get(TasteVector, user_id)
+    if row is None or not row.vector:
+        return None
+    vec = _unpack(row)
+    if vec.shape != (DIM,):
+        return None  # layout changed; the next review rebuilds it
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else None
+
+async def update_taste_vector(session: AsyncSession, user_id: int, movie_ids: list[int], rebuild: bool = False):
+    """Fold newly reviewed watched movies into the stored vector.
+
+    New reviews are added on top of the stored sum. A re-review (the movie
+    was already counted), a deletion, or a layout change rebuilds the sum
+    from the whole watched list in one matrix product instead.
+    """
+    row = await session.get(TasteVector, user_id)
+    counted = set(json.loads(row.movie_ids)) if row and row.movie_ids else set()
+    vec = _unpack(row) if row and row.vector else None
+
+    if rebuild or vec is None or vec.shape != (DIM,) or counted & set(movie_ids):
+        result = await session.execute(select(WatchedMovie).where(WatchedMovie.user_id == user_id))
+        movies = result.scalars().all()
+        vec = np.zeros(DIM, dtype=np.float32)
+        counted = set()
+    else:
+        if not movie_ids:
+            return
+        result = await session.execute(
+            select(WatchedMovie).where(WatchedMovie.user_id == user_id, WatchedMovie.id.in_(movie_ids))
+        )
+        movies = result.scalars().all()
+
+    weights = np.array([review_weight(m.user_rating, m.liked, m.disliked) for m in movies], dtype=np.float32)
+    if len(movies):
+        vec = vec + weights @ feature_matrix([_watched_row(m) for m in movies])
+    counted |= {m.id for m, w in zip(movies, weights) if w != 0}
+
+    if row is None:
+        row = TasteVector(user_id=user_id)
+        session.add(row)
+    row.vector = vec.astype(np.float32).tobytes()
+    row.movie_ids = json.dumps(sorted(counted))
+    row.updated_at = datetime.utcnow()
+    await session.commit()
+
+
+# ---------- Ranking ----------
+def score_candidates(taste, candidates: list[dict]) -> np.ndarray:
+    """Cosine-style affinity of each candidate to the taste vector (zeros without one)."""
+    if taste is None or not candidates:
+        return np.zeros(len(candidates), dtype=np.float32)
+    features = feature_matrix(candidates)
+    norms = np.linalg.norm(features, axis=1)
+    norms[norms == 0] = 1.0
+    return (features @ taste) / norms
+
+def rank_candidates(taste, candidates: list[dict]) -> list[dict]:
+    """Candidates sorted by affinity; ties keep their original order."""
+    if taste is None or len(candidates) < 2:
+        return candidates
+    scores = score_candidates(taste, candidates)
+    order = np.argsort(-scores, kind="stable")
+    return [candidates[i] for i in order]
+
+def top_genres(taste, n: int = 2) -> list[str]:
+    if taste is None:
+        return []
+    offset, size, _ = _BLOCKS["genre"]
+    block = taste[offset:offset + size]
+    return [GENRE_NAMES[i] for i in np.argsort(-block)[:n] if block[i] > 0]
@@ -0,0 +1,438 @@
+# backend/tmdb.py
+import os
+import json
+import asyncio
+import aiohttp
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from cache import TTLCache
+from singleflight import SingleFlight
+from cassette import cassette
+from metrics import track_upstream, endpoint_template, background
+from ratelimit import RateLimiter, UpstreamUnavailable, PRIORITY_ENRICH, upstream_priority, parse_retry_after, backoff_delay
+from database import async_session
+from models import TMDBCacheEntry
+
+TMDB_BASE_URL = os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3")
+TMDB_POOL_SIZE = int(os.getenv("TMDB_POOL_SIZE", "32"))
+TMDB_PER_HOST_LIMIT = int(os.getenv("TMDB_PER_HOST_LIMIT", "16"))
+TMDB_TIMEOUT = float(os.getenv("TMDB_TIMEOUT", "10"))
+TMDB_CONNECT_TIMEOUT = float(os.getenv("TMDB_CONNECT_TIMEOUT", "3"))
+TMDB_KEEPALIVE = float(os.getenv("TMDB_KEEPALIVE", "30"))
+TMDB_CACHE_SIZE = int(os.getenv("TMDB_CACHE_SIZE", "4096"))
+TMDB_CACHE_TTL = float(os.getenv("TMDB_CACHE_TTL", "3600"))  # in-memory tier
+TMDB_DB_CACHE_TTL = float(os.getenv("TMDB_DB_CACHE_TTL", str(7 * 24 * 3600)))  # SQLite tier
+TMDB_ENRICH_CONCURRENCY = int(os.getenv("TMDB_ENRICH_CONCURRENCY", "6"))
+TMDB_ENRICH_TIMEOUT = float(os.getenv("TMDB_ENRICH_TIMEOUT", "8"))
+TMDB_RATE_LIMIT = float(os.getenv("TMDB_RATE_LIMIT", "40"))  # requests per second
+TMDB_BURST = int(os.getenv("TMDB_BURST", "40"))
+TMDB_RETRY_DEADLINE = float(os.getenv("TMDB_RETRY_DEADLINE", "8"))  # seconds, including waits
+TMDB_BACKOFF_BASE = float(os.getenv("TMDB_BACKOFF_BASE", "0.25"))
+
+tmdb_limiter = RateLimiter("tmdb", rate=TMDB_RATE_LIMIT, burst=TMDB_BURST)
+
+
+class TMDBClient:
+    """One long-lived aiohttp session shared by every TMDB call site.
+
+    Keeps connections alive between requests so lookups stop paying a new
+    TCP + TLS handshake each time. Created in the app lifespan.
+    """
+
+    def __init__(self):
+        self._session: aiohttp.ClientSession | None = None
+        self.cache = TTLCache("tmdb", maxsize=TMDB_CACHE_SIZE, ttl=TMDB_CACHE_TTL)
+        self.db_hits = 0
+        self.upstream_fetches = 0
+        self._pending_writes = set()
+
+    async def start(self):
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=TMDB_POOL_SIZE,
+            limit_per_host=TMDB_PER_HOST_LIMIT,
+            keepalive_timeout=TMDB_KEEPALIVE,
+            ttl_dns_cache=300,
+        )
+        timeout = aiohttp.ClientTimeout(total=TMDB_TIMEOUT, connect=TMDB_CONNECT_TIMEOUT)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        if self._pending_writes:
+            await asyncio.gather(*self._pending_writes, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get(self, path: str, params: dict | None = None):
+        """GET {TMDB_BASE_URL}{path}. Returns (status, json or None).
+
+        Every attempt takes a token from tmdb_limiter. 429s (honouring
+        Retry-After), 5xx and connection errors are retried with jittered
+        backoff until TMDB_RETRY_DEADLINE; a 429 that outlasts it raises
+        UpstreamUnavailable (503) instead of looking like a missing movie.
+        """
+        if self._session is None or self._session.closed:
+            # scripts / tests that skip the lifespan still work
+            await self.start()
+
+        query = {"api_key": os.getenv("TMDB_API_KEY")}
+        for key, value in (params or {}).items():
+            if value is None:
+                continue
+            # aiohttp refuses bools in query strings
+            query[key] = str(value).lower() if isinstance(value, bool) else value
+
+        endpoint = endpoint_template(path)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + TMDB_RETRY_DEADLINE
+        attempt = 0
+        while True:
+            await tmdb_limiter.acquire(deadline)
+            status, retry_after, error = None, None, None
+            try:
+                with track_upstream("tmdb", endpoint) as tracked:
+                    reply = await cassette.exchange("tmdb", cache_key(path, params), self._request, path, query)
+                    tracked.status = reply["status"]
+                status = reply["status"]
+                if status == 200:
+                    return status, reply["body"]
+                if status == 429:
+                    retry_after = parse_retry_after(reply["retry_after"])
+                    tmdb_limiter.penalize(retry_after)
+                elif status < 500:
+                    return status, None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+
+            delay = backoff_delay(attempt, TMDB_BACKOFF_BASE)
+            if loop.time() + max(delay, retry_after or 0) >= deadline:
+                if status == 429:
+                    raise UpstreamUnavailable("TMDB", retry_after)
+                if error is not None:
+                    raise error
+                return status, None
+            print(f"[tmdb] {status or type(error).__name__} on {path}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _request(self, path: str, query: dict):
+        """One HTTP exchange, reduced to what get() needs (and what a cassette stores)."""
+        async with self._session.get(f"{TMDB_BASE_URL}{path}", params=query) as resp:
+            return {
+                "status": resp.status,
+                "retry_after": resp.headers.get("Retry-After"),
+                "body": await resp.json() if resp.status == 200 else None,
+            }
+
+    # ---------- Cached lookups ----------
+    async def get_cached(self, path: str, params: dict | None = None):
+        """Like get(), but served from memory -> SQLite -> TMDB, in that order.
+
+        Only 200 responses are cached. Keys are the path plus the sorted
+        query params, so /movie/{id} is keyed by tmdb_id and /search/movie
+        by the search query (and year).
+        """
+        key = cache_key(path, params)
+
+        data = self.cache.get(key)
+        if data is not None:
+            return 200, data
+
+        data = await self._load_persisted(key)
+        if data is not None:
+            self.db_hits += 1
+            self.cache.set(key, data)
+            return 200, data
+
+        status, data = await self.get(path, params)
+        self.upstream_fetches += 1
+        if status == 200:
+            self.cache.set(key, data)
+            # persist off the request path
+            task = asyncio.create_task(background(self._persist(key, data)))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+        return status, data
+
+    async def _load_persisted(self, key: str):
+        try:
+            async with async_session() as session:
+                row = await session.get(TMDBCacheEntry, key)
+        except Exception as e:
+            print("[tmdb cache] read failed:", e)
+            return None
+        if row is None:
+            return None
+        if row.fetched_at < datetime.utcnow() - timedelta(seconds=TMDB_DB_CACHE_TTL):
+            return None
+        return json.loads(row.payload)
+
+    async def _persist(self, key: str, data: dict):
+        try:
+            async with async_session() as session:
+                await session.merge(TMDBCacheEntry(
+                    key=key,
+                    payload=json.dumps(data),
+                    fetched_at=datetime.utcnow(),
+                ))
+                await session.commit()
+        except Exception as e:
+            print("[tmdb cache] write failed:", e)
+
+    def cache_stats(self):
+        return {
+            **self.cache.stats(),
+            "db_hits": self.db_hits,
+            "upstream_fetches": self.upstream_fetches,
+        }
+
+
+def cache_key(path: str, params: dict | None = None):
+    items = sorted(
+        (k, str(v).lower() if isinstance(v, str) else str(v))
+        for k, v in (params or {}).items()
+        if v is not None
+    )
+    if not items:
+        return path
+    return path + "?" + "&".join(f"{k}={v}" for k, v in items)
+
+
+tmdb_client = TMDBClient()
+
+
+# ---------- Movie helpers ----------
+def format_movie(detail: dict, credits: dict, tmdb_id: int):
+    director = next((c["name"] for c in credits.get("crew", []) if c.get("job") == "Director"), None)
+    return {
+        "title": detail.get("title"),
+        "description": detail.get("overview", ""),
+        "poster": f"https://image.tmdb.org/t/p/w500{detail.get('poster_path')}" if detail.get("poster_path") else "",
+        "backdrop": f"https://image.tmdb.org/t/p/w780{detail.get('backdrop_path')}" if detail.get("backdrop_path") else "",
+        "tmdb_rating": detail.get("vote_average"),
+        "tmdb_id": tmdb_id,
+        "release_year": int(detail.get("release_date", "0000")[:4]) if detail.get("release_date") else None,
+        "genres": ", ".join([g["name"] for g in detail.get("genres", [])]),
+        "director": director,
+    }
+
+
+# 同一部电影 / 同一个查询同时只发一次请求，其余调用者等同一个结果
+movie_flights = SingleFlight("tmdb_movies")
+
+
+async def get_movie_detail_by_id(tmdb_id: int):
+    return await movie_flights.do(("detail", tmdb_id), _get_movie_detail_by_id, tmdb_id)
+
+
+async def _get_movie_detail_by_id(tmdb_id: int):
+    # 详情和导演（credits）同时取，不要串行等两次
+    (status, detail), (credits_status, credits) = await asyncio.gather(
+        tmdb_client.get_cached(f"/movie/{tmdb_id}"),
+        tmdb_client.get_cached(f"/movie/{tmdb_id}/credits"),
+    )
+    if status != 200:
+        raise HTTPException(status_code=500, detail="TMDB API detail error")
+    if credits_status != 200:
+        raise HTTPException(status_code=500, detail="TMDB API credit error")
+
+    return format_movie(detail, credits, tmdb_id)
+
+
+async def fetch_movie_info(title: str, year_hint: int | None = None):
+    return await movie_flights.do(("search", title, year_hint), _fetch_movie_info, title, year_hint)
+
+
+async def _fetch_movie_info(title: str, year_hint: int | None = None):
+    status, data = await tmdb_client.get_cached("/search/movie", {"query": title, "year": year_hint or None})
+    if status != 200:
+        raise HTTPException(status_code=500, detail="TMDB API search error")
+    candidates = data.get("results", [])
+
+    if not candidates:
+        return {
+            "title": title,
+            "description": "Not found",
+            "poster": "",
+            "backdrop": "",
+            "tmdb_rating": None,
+            "tmdb_id": None,
+            "release_year": None,
+            "genres": "",
+            "director": "",
+        }
+
+    # 🎯 筛选年份匹配 ±5 的候选
+    filtered = []
+    for movie in candidates:
+        try:
+            year = int(movie.get("release_date", "0000")[:4])
+        except:
+            year = 0
+        if year_hint and abs(year - year_hint) > 5:
+            continue
+        if not movie.get("poster_path") or movie.get("vote_count", 0) < 10:
+            continue
+        filtered.append((movie, year))
+
+    # ✅ 使用 filtered，如果没有就 fallback 用 candidates
+    best_movie = None
+    if filtered:
+        best_movie = sorted(
+            filtered,
+            key=lambda m: (m[0].get("vote_count", 0), m[0].get("popularity", 0)),
+            reverse=True
+        )[0][0]
+    else:
+        best_movie = candidates[0]
+
+    # 🔍 详情 + 导演（和 /movie_detail 共用同一个 in-flight 请求）
+    return await get_movie_detail_by_id(best_movie["id"])
+
+
+async def find_by_imdb_id(imdb_id: str):
+    """IMDb id (tt0133093) -> movie info like fetch_movie_info's, or None if TMDB has no match."""
+    status, data = await tmdb_client.get_cached(f"/find/{imdb_id}", {"external_source": "imdb_id"})
+    if status != 200:
+        raise HTTPException(status_code=500, detail="TMDB API find error")
+    results = data.get("movie_results") or []
+    if not results:
+        return None
+    return await get_movie_detail_by_id(results[0]["id"])
+
+
+# ---------- Concurrent enrichment ----------
+def _make_resolver(accept, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def resolve(index: int, candidate: dict):
+        # runs as its own task, so this only lowers the priority of this lookup
+        upstream_priority.set(PRIORITY_ENRICH)
+        try:
+            async with semaphore:
+                if candidate.get("tmdb_id") is not None:
+                    # TMDB 已经给了 id（比如 /search 的结果），直接取详情，不再按标题搜一遍
+                    info = await get_movie_detail_by_id(candidate["tmdb_id"])
+                else:
+                    info = await fetch_movie_info(candidate["title"], candidate.get("year"))
+        except UpstreamUnavailable as e:
+            resolve.rate_limited = e
+            return index, None
+        except Exception as e:
+            print(f"[enrich] failed to fetch {candidate['title']}: {e}")
+            return index, None
+        if not info or info.get("tmdb_id") is None:
+            return index, None
+        if accept is not None and not accept(info):
+            return index, None
+        info["reason"] = candidate.get("reason", "")
+        return index, info
+
+    resolve.rate_limited = None  # set if TMDB kept answering 429
+    return resolve
+
+
+async def enrich_candidates(
+    candidates: list[dict],
+    limit: int,
+    accept=None,
+    concurrency: int = TMDB_ENRICH_CONCURRENCY,
+    timeout: float = TMDB_ENRICH_TIMEOUT,
+):
+    """Resolve candidates ({"title", "year", "reason"}) through fetch_movie_info concurrently.
+
+    A candidate that already carries a "tmdb_id" is fetched by id instead.
+
+    Returns at most `limit` movie infos in the same order as `candidates`.
+    A result is valid when the lookup succeeded, TMDB found the movie and
+    `accept(info)` (if given) is true. As soon as the first `limit` valid
+    results in candidate order are known, the remaining lookups are
+    cancelled; anything still running after `timeout` seconds is cancelled too.
+    """
+    if not candidates or limit <= 0:
+        return []
+
+    resolve = _make_resolver(accept, concurrency)
+    tasks = [asyncio.create_task(resolve(i, c)) for i, c in enumerate(candidates)]
+
+    def outcome(task):
+        if not task.done() or task.cancelled():
+            return None
+        return task.result()[1]
+
+    def prefix_ready():
+        found = 0
+        for task in tasks:
+            if not task.done():
+                return False
+            if outcome(task) is not None:
+                found += 1
+                if found >= limit:
+                    return True
+        return True
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    pending = set(tasks)
+    try:
+        while pending and not prefix_ready():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            _, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    results = []
+    for task in tasks:
+        info = outcome(task)
+        if info is not None:
+            results.append(info)
+            if len(results) >= limit:
+                break
+    if not results and resolve.rate_limited is not None:
+        raise resolve.rate_limited  # 503, not an empty "nothing found"
+    return results
+
+
+async def iter_enriched(
+    candidates: list[dict],
+    limit: int,
+    accept=None,
+    concurrency: int = TMDB_ENRICH_CONCURRENCY,
+    timeout: float = TMDB_ENRICH_TIMEOUT,
+):
+    """Streaming counterpart of enrich_candidates.
+
+    Yields (index, info) in completion order, as soon as each lookup
+    resolves, until `limit` valid results have been yielded. `index` is
+    the candidate's position, so clients can still order by the LLM's rank.
+    """
+    if not candidates or limit <= 0:
+        return
+
+    resolve = _make_resolver(accept, concurrency)
+    tasks = [asyncio.create_task(resolve(i, c)) for i, c in enumerate(candidates)]
+    found = 0
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=timeout):
+            try:
+                index, info = await next_done
+            except asyncio.TimeoutError:
+                break
+            if info is None:
+                continue
+            yield index, info
+            found += 1
+            if found >= limit:
+                break
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    if not found and resolve.rate_limited is not None:
+        raise resolve.rate_limited
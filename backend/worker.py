@@ -0,0 +1,186 @@
+# backend/worker.py
+import os
+import asyncio
+from datetime import datetime
+from sqlalchemy import select
+from ai import generate_snapshot_comment, regenerate_taste_summary
+from taste_vector import update_taste_vector
+from ratelimit import upstream_priority, PRIORITY_BACKGROUND
+from database import async_session
+from models import WatchedMovie, TasteSnapshot
+from metrics import background
+
+TASTE_DEBOUNCE_SECONDS = float(os.getenv("TASTE_DEBOUNCE_SECONDS", "3"))
+TASTE_MAX_DELAY_SECONDS = float(os.getenv("TASTE_MAX_DELAY_SECONDS", "30"))
+TASTE_STOP_TIMEOUT_SECONDS = float(os.getenv("TASTE_STOP_TIMEOUT_SECONDS", "20"))  # shutdown 最多等这么久
+
+
+class _PendingWork:
+    def __init__(self, now: float):
+        self.first_event_at = now
+        self.due_at = now
+        self.reviews = {}  # watched movie id -> time of the review
+        self.deleted_snapshot_ids = []
+        self.rebuild_vector = False
+
+
+class TasteScheduler:
+    """In-process background scheduler for taste modeling.
+
+    Endpoints enqueue work and return immediately. Events for the same user
+    are debounced: the work runs TASTE_DEBOUNCE_SECONDS after the last
+    event (but never later than TASTE_MAX_DELAY_SECONDS after the first),
+    so logging ten films in a row costs ten snapshot comments and a single
+    summary regeneration. Runs for one user never overlap.
+    """
+
+    def __init__(self):
+        self._pending: dict[int, _PendingWork] = {}
+        self._timers: dict[int, asyncio.Task] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._running: set[int] = set()
+        self._in_flight: set[asyncio.Task] = set()  # timers that are past the debounce and running
+
+    # ---------- Enqueue ----------
+    def enqueue_review(self, user_id: int, movie_id: int):
+        work = self._touch(user_id)
+        work.reviews[movie_id] = datetime.utcnow()
+        self._arm(user_id)
+
+    def enqueue_summary(
+        self,
+        user_id: int,
+        deleted_snapshot_ids: list[int] | None = None,
+        rebuild_vector: bool = False,
+    ):
+        work = self._touch(user_id)
+        work.deleted_snapshot_ids.extend(deleted_snapshot_ids or [])
+        work.rebuild_vector = work.rebuild_vector or rebuild_vector
+        self._arm(user_id)
+
+    def is_pending(self, user_id: int) -> bool:
+        return user_id in self._pending or user_id in self._running
+
+    # ---------- Scheduling ----------
+    def _touch(self, user_id: int) -> _PendingWork:
+        if user_id not in self._pending:
+            self._pending[user_id] = _PendingWork(asyncio.get_running_loop().time())
+        return self._pending[user_id]
+
+    def _arm(self, user_id: int):
+        work = self._pending[user_id]
+        now = asyncio.get_running_loop().time()
+        work.due_at = min(now + TASTE_DEBOUNCE_SECONDS, work.first_event_at + TASTE_MAX_DELAY_SECONDS)
+        timer = self._timers.get(user_id)
+        if timer is None or timer.done():
+            self._timers[user_id] = asyncio.create_task(background(self._wait_and_run(user_id)))
+
+    async def _wait_and_run(self, user_id: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            work = self._pending.get(user_id)
+            if work is None:
+                return
+            delay = work.due_at - loop.time()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        self._timers.pop(user_id, None)
+        task = asyncio.current_task()
+        self._in_flight.add(task)
+        try:
+            await self._run(user_id)
+        finally:
+            self._in_flight.discard(task)
+
+    async def _run(self, user_id: int):
+        # 后台任务：上游繁忙时让用户正在等的请求先走
+        upstream_priority.set(PRIORITY_BACKGROUND)
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            work = self._pending.pop(user_id, None)
+            if work is None:
+                return
+            self._running.add(user_id)
+            try:
+                await process_taste_modeling(
+                    user_id, work.reviews, work.deleted_snapshot_ids, work.rebuild_vector
+                )
+            except Exception as e:
+                print(f"❌ Taste modeling failed for user {user_id}:", e)
+            finally:
+                self._running.discard(user_id)
+
+    async def stop(self):
+        """Run whatever is still queued right away and wait for runs already going (used on shutdown).
+
+        Anything not finished after TASTE_STOP_TIMEOUT_SECONDS is cancelled.
+        """
+        for timer in list(self._timers.values()):
+            timer.cancel()
+        self._timers.clear()
+        tasks = [*self._in_flight, *(asyncio.create_task(self._run(uid)) for uid in list(self._pending))]
+        if not tasks:
+            return
+        _, unfinished = await asyncio.wait(tasks, timeout=TASTE_STOP_TIMEOUT_SECONDS)
+        if unfinished:
+            print(f"⚠️ {len(unfinished)} taste run(s) still going after {TASTE_STOP_TIMEOUT_SECONDS}s, cancelling")
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
+
+taste_scheduler = TasteScheduler()
+
+
+async def process_taste_modeling(
+    user_id: int,
+    reviews: dict,
+    deleted_snapshot_ids: list[int],
+    rebuild_vector: bool = False,
+):
+    async with async_session() as session:
+        # 数值向量不依赖 LLM，先更新，LLM 失败也不受影响
+        if reviews or rebuild_vector:
+            try:
+                await update_taste_vector(session, user_id, list(reviews), rebuild=rebuild_vector)
+            except Exception as e:
+                await session.rollback()
+                print(f"❌ Taste vector update failed for user {user_id}:", e)
+
+        if reviews:
+            result = await session.execute(
+                select(WatchedMovie).where(
+                    WatchedMovie.user_id == user_id,
+                    WatchedMovie.id.in_(list(reviews)),
+                )
+            )
+            movies = result.scalars().all()  # 已删除的电影直接跳过
+
+            comments = await asyncio.gather(*(
+                generate_snapshot_comment(
+                    movie_title=movie.title,
+                    user_rating=movie.user_rating,
+                    review=movie.review,
+                    mood_tags=movie.moods,
+                    genres=movie.genres,
+                    director=movie.director,
+                    release_year=movie.release_year
+                )
+                for movie in movies
+            ))
+
+            for movie, snapshot_comment in sorted(zip(movies, comments), key=lambda p: reviews[p[0].id]):
+                session.add(TasteSnapshot(
+                    user_id=user_id,
+                    movie_title=movie.title,
+                    movie_id=movie.id,
+                    action_type="review",
+                    mood_tag=movie.moods,
+                    gpt_comment=snapshot_comment,
+                    timestamp=reviews[movie.id],
+                ))
+            await session.commit()
+
+        await regenerate_taste_summary(session, user_id, deleted_snapshot_ids=deleted_snapshot_ids)
+        await session.commit()
@@ -15,8 +15,9 @@ function UpdateSummaryModal({ onClose, onUpdated }) {
 
     setLoading(true);
     try {
+      // 只是排进了后台队列；新 summary 由 onUpdated 轮询 /taste-summary 拿到
       await API.post("/update_summary", { feedback: input });
-      toast.success("Summary updated.");
+      toast.success("Got it! Updating your summary…");
       onUpdated?.();
       onClose();
     } catch (err) {
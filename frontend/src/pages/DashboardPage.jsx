@@ -12,6 +12,10 @@ import { ChevronUp, ChevronDown } from "lucide-react";
 import { motion } from "framer-motion";
 import TasteCharts from "../components/TasteCharts";
 
+// summary 在后台重建，/taste-summary 的 status 变回 ready 之前隔一会儿再取
+const SUMMARY_POLL_MS = 2000;
+const SUMMARY_POLL_ATTEMPTS = 30;
+
 function DashboardPage() {
   const { user, isLoading } = useAuth();
   const [summary, setSummary] = useState("");
@@ -56,6 +60,36 @@ function DashboardPage() {
     }
   };
 
+  const pollSummary = async () => {
+    for (let i = 0; i < SUMMARY_POLL_ATTEMPTS; i++) {
+      await new Promise((resolve) => setTimeout(resolve, SUMMARY_POLL_MS));
+      try {
+        const res = await API.get("/taste-summary");
+        if (res.data.status !== "pending") {
+          setSummary(res.data.summary || "");
+          setHighlightTitles(res.data.highlight_titles || []);
+          return true;
+        }
+      } catch (err) {
+        console.error("Error polling summary:", err);
+        return false;
+      }
+    }
+    return false;
+  };
+
+  const handleSummaryQueued = async () => {
+    fetchSnapshots();
+    setSummaryLoading(true);
+    const updated = await pollSummary();
+    setSummaryLoading(false);
+    if (updated) {
+      toast.success("Summary updated.");
+    } else {
+      toast("Your summary is still updating. Check back in a moment.");
+    }
+  };
+
   const refreshDashboard = async () => {
     await Promise.all([fetchSummary(), fetchSnapshots(), fetchWatched()]);
   };
@@ -184,9 +218,15 @@ function DashboardPage() {
                     <button
                       className="text-[#FC7023] hover:underline text-sm"
                       onClick={() => setShowUpdateModal(true)}
+                      disabled={summaryLoading}
                     >
                       I want to update AI
                     </button>
+                    {summaryLoading && (
+                      <p className="text-sm text-gray-300 mt-2">
+                        Updating your summary…
+                      </p>
+                    )}
                   </motion.div>
                 )}
               </motion.div>
@@ -237,7 +277,7 @@ function DashboardPage() {
       {showUpdateModal && (
         <UpdateSummaryModal
           onClose={() => setShowUpdateModal(false)}
-          onUpdated={refreshDashboard}
+          onUpdated={handleSummaryQueued}
         />
       )}
 